@@ -5,19 +5,19 @@
 import yaml
 from apispec import APISpec, yaml_utils
 from quart import Blueprint, request, jsonify, render_template, current_app
-from zmq.asyncio import Socket
 from flowapi import __version__
+from flowapi.zmq_multiplexer import RequestSocket
 
 blueprint = Blueprint("spec", __name__)
 
 
-async def get_spec(socket: Socket, request_id: str) -> APISpec:
+async def get_spec(socket: RequestSocket, request_id: str) -> APISpec:
     """
     Construct open api spec by interrogating FlowMachine.
 
     Parameters
     ----------
-    socket : Socket
+    socket : RequestSocket
     request_id : str
         Unique id of the request
 
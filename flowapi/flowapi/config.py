@@ -61,6 +61,10 @@ def get_config():
         flowdb_host = environ["FLOWDB_HOST"]
         flowdb_port = environ["FLOWDB_PORT"]
         flowapi_server_id = environ["FLOWAPI_IDENTIFIER"]
+        result_batch_size = int(getenv("FLOWAPI_RESULT_BATCH_SIZE", 1000))
+        gzip_level = int(getenv("FLOWAPI_GZIP_LEVEL", 6))
+        zstd_level = int(getenv("FLOWAPI_ZSTD_LEVEL", 3))
+        result_max_age = int(getenv("FLOWAPI_RESULT_MAX_AGE", 86400))
     except KeyError as e:
         raise UndefinedConfigOption(
             f"Undefined configuration option: '{e.args[0]}'. Please set docker secret or environment variable."
@@ -74,4 +78,8 @@ def get_config():
         FLOWMACHINE_PORT=flowmachine_port,
         FLOWDB_DSN=f"postgres://{flowdb_user}:{flowdb_password}@{flowdb_host}:{flowdb_port}/flowdb",
         JWT_DECODE_AUDIENCE=flowapi_server_id,
+        RESULT_BATCH_SIZE=result_batch_size,
+        GZIP_LEVEL=gzip_level,
+        ZSTD_LEVEL=zstd_level,
+        RESULT_MAX_AGE=result_max_age,
     )
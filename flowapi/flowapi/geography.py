@@ -3,7 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from flask_jwt_extended import jwt_required, current_user
 from quart import Blueprint, current_app, request, stream_with_context, jsonify
-from .stream_results import stream_result_as_json
+from .stream_results import compress_if_accepted, stream_result_as_json
 
 blueprint = Blueprint("geography", __name__)
 
@@ -74,15 +74,15 @@ async def get_geography(aggregation_unit):
                 f"Returning {aggregation_unit} geography data.",
                 request_id=request.request_id,
             )
-            return (
+            results_streamer, headers = compress_if_accepted(
                 results_streamer,
-                200,
                 {
                     "Transfer-Encoding": "chunked",
                     "Content-Disposition": f"attachment;filename={aggregation_unit}.geojson",
                     "Content-type": mimetype,
                 },
             )
+            return results_streamer, 200, headers
         # TODO: Reinstate correct status codes for geographies
         #
         # elif query_state == "error":
@@ -10,14 +10,13 @@ import quart.flask_patch
 from quart import Quart, request, current_app
 import asyncpg
 import logging
-import zmq
-from zmq.asyncio import Context
 
 from flowapi.config import get_config
 from flowapi.jwt_auth_callbacks import register_logging_callbacks
 from flowapi.query_endpoints import blueprint as query_endpoints_blueprint
 from flowapi.geography import blueprint as geography_blueprint
 from flowapi.api_spec import blueprint as spec_blueprint
+from flowapi.zmq_multiplexer import ZMQMultiplexer
 from flask_jwt_extended import JWTManager
 
 import structlog
@@ -78,14 +77,11 @@ async def connect_logger():
 
 
 async def connect_zmq():
-    context = Context.instance()
-    #  Socket to talk to server
+    #  Socket to talk to server, shared by all requests
     current_app.flowapi_logger.debug("Connecting to FlowMachine server…")
-    socket = context.socket(zmq.REQ)
-    socket.connect(
-        f"tcp://{current_app.config['FLOWMACHINE_HOST']}:{current_app.config['FLOWMACHINE_PORT']}"
+    current_app.zmq_multiplexer = ZMQMultiplexer.connect(
+        current_app.config["FLOWMACHINE_HOST"], current_app.config["FLOWMACHINE_PORT"]
     )
-    request.socket = socket
     current_app.flowapi_logger.debug("Connected.")
 
 
@@ -93,13 +89,18 @@ async def add_uuid():
     request.request_id = str(uuid.uuid4())
 
 
-def close_zmq(exc):
+async def add_socket():
+    request.socket = current_app.zmq_multiplexer.for_request(request.request_id)
+
+
+def release_socket(exc):
+    current_app.zmq_multiplexer.forget(request.request_id)
+
+
+async def close_zmq():
     current_app.flowapi_logger.debug("Closing connection to FlowMachine server…")
-    try:
-        request.socket.close()
-        current_app.flowapi_logger.debug("Closed socket.")
-    except AttributeError:
-        current_app.flowapi_logger.debug("No socket to close.")
+    current_app.zmq_multiplexer.close()
+    current_app.flowapi_logger.debug("Closed socket.")
 
 
 async def create_db():
@@ -115,9 +116,11 @@ def create_app():
     jwt = JWTManager(app)
     app.before_serving(connect_logger)
     app.before_serving(create_db)
+    app.before_serving(connect_zmq)
+    app.after_serving(close_zmq)
     app.before_request(add_uuid)
-    app.before_request(connect_zmq)
-    app.teardown_request(close_zmq)
+    app.before_request(add_socket)
+    app.teardown_request(release_socket)
 
     @app.route("/")
     async def root():
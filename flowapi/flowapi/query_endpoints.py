@@ -2,12 +2,157 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+import importlib.util
+from typing import Any, Dict, Optional
+
+import rapidjson
 from flask_jwt_extended import jwt_required, jwt_required, current_user
 from quart import Blueprint, current_app, request, url_for, stream_with_context, jsonify
-from .stream_results import stream_result_as_json
+from .stream_results import (
+    compress_if_accepted,
+    stream_result_as_arrow,
+    stream_result_as_csv,
+    stream_result_as_json,
+    stream_result_as_ndjson,
+)
 
 blueprint = Blueprint("query", __name__)
 
+# MIME type and file extension for each format query results can be returned in
+RESULT_FORMATS = {
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def get_result_format() -> Optional[str]:
+    """
+    Get the format requested for a query result, from the request's `format`
+    parameter if given, or else from its Accept header. Defaults to json if
+    the Accept header doesn't allow any of the supported formats.
+
+    Returns
+    -------
+    str or None
+        Name of the format, or None if the `format` parameter is not a
+        supported format.
+    """
+    result_format = request.args.get("format")
+    if result_format is not None:
+        return result_format if result_format in RESULT_FORMATS else None
+    formats_by_mimetype = {
+        mimetype: result_format
+        for result_format, (mimetype, _) in RESULT_FORMATS.items()
+    }
+    return formats_by_mimetype[
+        request.accept_mimetypes.best_match(
+            list(formats_by_mimetype), default="application/json"
+        )
+    ]
+
+
+def get_result_page() -> Dict[str, Any]:
+    """
+    Get the page of a query result requested by the request's `columns`,
+    `filter`, `order_by`, `limit` and `offset` parameters, as parameters for
+    FlowMachine's `get_sql_for_query_result` action.
+
+    `columns` and `order_by` are comma separated lists of column names, with
+    columns to sort in descending order in `order_by` prefixed with '-'. Each
+    `filter` parameter is of the form `<column>:<operator>:<value>`.
+
+    Returns
+    -------
+    dict
+        Page parameters which were given. Empty if the whole result was requested.
+
+    Raises
+    ------
+    ValueError
+        If a filter, limit or offset is malformed.
+    """
+    page = {}
+    for param in ("columns", "order_by"):
+        if param in request.args:
+            page[param] = request.args[param].split(",")
+    filters = request.args.getlist("filter")
+    if len(filters) > 0:
+        page["filters"] = [filter_.split(":", 2) for filter_ in filters]
+        if any(len(filter_) != 3 for filter_ in page["filters"]):
+            raise ValueError(
+                "Filters must be of the form '<column>:<operator>:<value>'."
+            )
+    for param in ("limit", "offset"):
+        if param in request.args:
+            try:
+                page[param] = int(request.args[param])
+            except ValueError:
+                raise ValueError(f"'{param}' must be an integer.")
+    return page
+
+
+def get_result_etag(
+    query_id: str,
+    created: str,
+    result_format: str,
+    content_encoding: Optional[str],
+    page: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Get the entity tag for a query result. A query's result doesn't change
+    until it is removed from FlowMachine's cache, so the tag is derived from the
+    query id and the time the result was cached, as well as the format and
+    encoding it is sent in and the page of the result requested.
+
+    Parameters
+    ----------
+    query_id : str
+        Unique id of the query
+    created : str
+        Time the result was added to the cache, as an ISO format string
+    result_format : str
+        Format the result is sent in
+    content_encoding : str or None
+        Compression the result is sent with, if any
+    page : dict, optional
+        Page of the result, as returned by `get_result_page`
+
+    Returns
+    -------
+    str
+        Entity tag, including the surrounding quotes
+    """
+    page = rapidjson.dumps(page or {}, sort_keys=True)
+    tag = hashlib.md5(
+        f"{query_id}:{created}:{result_format}:{content_encoding}:{page}".encode()
+    ).hexdigest()
+    return f'"{tag}"'
+
+
+def etag_matches(etag: str) -> bool:
+    """
+    Check whether the request's If-None-Match header matches an entity tag,
+    i.e. whether the client already has this version of the resource.
+
+    Parameters
+    ----------
+    etag : str
+        Entity tag, including the surrounding quotes
+
+    Returns
+    -------
+    bool
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is None:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
 
 @blueprint.route("/run", methods=["POST"])
 @jwt_required
@@ -187,12 +332,80 @@ async def get_query_result(query_id):
           required: true
           schema:
             type: string
+        - in: query
+          name: format
+          required: false
+          description: Format to return the result in. If not given, the format is chosen using the Accept header. In the arrow and parquet formats, numeric columns are converted to 64 bit floats.
+          schema:
+            type: string
+            enum:
+              - json
+              - ndjson
+              - csv
+              - arrow
+              - parquet
+        - in: query
+          name: columns
+          required: false
+          description: Comma separated list of the columns to return. Defaults to all columns.
+          schema:
+            type: string
+        - in: query
+          name: filter
+          required: false
+          description: Only return rows matching these filters, each of the form `<column>:<operator>:<value>`, where operator is one of eq, ne, lt, le, gt or ge.
+          schema:
+            type: array
+            items:
+              type: string
+          style: form
+          explode: true
+        - in: query
+          name: order_by
+          required: false
+          description: Comma separated list of columns to sort rows by. Prefix a column with '-' to sort in descending order. Rows are always returned in a consistent order.
+          schema:
+            type: string
+        - in: query
+          name: limit
+          required: false
+          description: Maximum number of rows to return.
+          schema:
+            type: integer
+            minimum: 0
+        - in: query
+          name: offset
+          required: false
+          description: Number of rows to skip.
+          schema:
+            type: integer
+            minimum: 0
+        - in: header
+          name: If-None-Match
+          required: false
+          description: Entity tag of a copy of the result the client already has.
+          schema:
+            type: string
       responses:
         '200':
           content:
             application/json:
               schema:
                 type: object
+            application/x-ndjson:
+              schema:
+                type: string
+            text/csv:
+              schema:
+                type: string
+            application/vnd.apache.arrow.stream:
+              schema:
+                type: string
+                format: binary
+            application/vnd.apache.parquet:
+              schema:
+                type: string
+                format: binary
           description: Results returning.
         '202':
           content:
@@ -200,8 +413,16 @@ async def get_query_result(query_id):
               schema:
                 type: object
           description: Request accepted.
+        '304':
+          description: The client's copy of the result, given by If-None-Match, is current.
         '401':
           description: Unauthorized.
+        '400':
+          content:
+            application/json:
+              schema:
+                type: object
+          description: Unsupported result format, or invalid columns, filters, limit or offset.
         '403':
           content:
             application/json:
@@ -210,15 +431,49 @@ async def get_query_result(query_id):
           description: Token does not grant results access to this query or spatial aggregation unit.
         '404':
           description: Unknown ID
+        '406':
+          content:
+            application/json:
+              schema:
+                type: object
+          description: Result format not available on this server.
         '500':
           description: Server error.
       summary: Get the output of query
     """
     await current_user.can_get_results_by_query_id(query_id=query_id)
+    result_format = get_result_format()
+    if result_format is None:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "msg": f"Unsupported result format '{request.args['format']}'. Must be one of {list(RESULT_FORMATS)}.",
+                }
+            ),
+            400,
+        )
+    if (
+        result_format in ("arrow", "parquet")
+        and importlib.util.find_spec("pyarrow") is None
+    ):
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "msg": f"Results can't be returned as {result_format}, because pyarrow is not installed.",
+                }
+            ),
+            406,
+        )
+    try:
+        page = get_result_page()
+    except ValueError as exc:
+        return jsonify({"status": "error", "msg": str(exc)}), 400
     msg = {
         "request_id": request.request_id,
         "action": "get_sql_for_query_result",
-        "params": {"query_id": query_id},
+        "params": {"query_id": query_id, **page},
     }
     request.socket.send_json(msg)
     reply = await request.socket.recv_json()
@@ -239,6 +494,9 @@ async def get_query_result(query_id):
                 )  # TODO: should this really be 403?
             elif query_state in ("awol", "known"):
                 return (jsonify({"status": "Error", "msg": reply["msg"]}), 404)
+            elif query_state == "completed":
+                # The result exists, but the page requested is invalid
+                return jsonify({"status": "error", "msg": reply["msg"]}), 400
             else:
                 return (
                     jsonify(
@@ -253,23 +511,54 @@ async def get_query_result(query_id):
             return jsonify({"status": "error", "msg": reply["msg"]}), 500
     else:
         sql = reply["payload"]["sql"]
-        results_streamer = stream_with_context(stream_result_as_json)(
-            sql, additional_elements={"query_id": query_id}
-        )
-        mimetype = "application/json"
+        if result_format == "json":
+            results_streamer = stream_with_context(stream_result_as_json)(
+                sql, additional_elements={"query_id": query_id}
+            )
+        elif result_format == "ndjson":
+            results_streamer = stream_with_context(stream_result_as_ndjson)(sql)
+        elif result_format == "csv":
+            results_streamer = stream_with_context(stream_result_as_csv)(sql)
+        else:
+            results_streamer = stream_with_context(stream_result_as_arrow)(
+                sql, file_format="parquet" if result_format == "parquet" else "stream"
+            )
+        mimetype, extension = RESULT_FORMATS[result_format]
 
         current_app.flowapi_logger.debug(
-            f"Returning result of query {query_id}.", request_id=request.request_id
-        )
-        return (
-            results_streamer,
-            200,
-            {
-                "Transfer-Encoding": "chunked",
-                "Content-Disposition": f"attachment;filename={query_id}.json",
-                "Content-type": mimetype,
-            },
+            f"Returning result of query {query_id} as {result_format}.",
+            request_id=request.request_id,
         )
+        headers = {
+            "Transfer-Encoding": "chunked",
+            "Content-Disposition": f"attachment;filename={query_id}.{extension}",
+            "Content-type": mimetype,
+            "Vary": "Accept",
+        }
+        if result_format != "parquet":  # Parquet files are already compressed
+            results_streamer, headers = compress_if_accepted(results_streamer, headers)
+        created = reply["payload"].get("created")
+        if created is not None:
+            cache_headers = {
+                "ETag": get_result_etag(
+                    query_id,
+                    created,
+                    result_format,
+                    headers.get("Content-Encoding"),
+                    page,
+                ),
+                "Cache-Control": f"private, max-age={current_app.config['RESULT_MAX_AGE']}, immutable",
+                "Vary": headers["Vary"],
+            }
+            if etag_matches(cache_headers["ETag"]):
+                # The results streamer is never iterated, so the result isn't fetched
+                current_app.flowapi_logger.debug(
+                    f"Client already has result of query {query_id}.",
+                    request_id=request.request_id,
+                )
+                return "", 304, cache_headers
+            headers = {**headers, **cache_headers}
+        return results_streamer, 200, headers
 
 
 @blueprint.route("/available_dates")
@@ -2,12 +2,41 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
+import io
+import zlib
+from typing import AsyncGenerator, AsyncIterator, Dict, Optional, Tuple
+
 import rapidjson as json
 from quart import current_app, request
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _encode_rows(rows):
+    """
+    Encode a list of rows as the comma separated elements of a JSON array.
+
+    Parameters
+    ----------
+    rows : list of dict
+        Rows to encode
+
+    Returns
+    -------
+    str
+        JSON objects for the rows, separated by commas
+    """
+    return json.dumps(rows, number_mode=json.NM_DECIMAL, datetime_mode=json.DM_ISO8601)[
+        1:-1
+    ]
+
 
 async def stream_result_as_json(
-    sql_query, result_name="query_result", additional_elements=None
+    sql_query, result_name="query_result", additional_elements=None, batch_size=None
 ):
     """
     Generate a JSON representation of a query result.
@@ -20,15 +49,19 @@ async def stream_result_as_json(
         Name of the JSON item containing the rows of the result
     additional_elements : dict
         Additional JSON elements to include along with the query result
+    batch_size : int, optional
+        Number of rows to fetch from the database and encode at a time.
+        Defaults to the app's RESULT_BATCH_SIZE config option.
 
     Yields
     ------
     bytes
-        Encoded lines of JSON
+        Encoded chunks of JSON, each containing a batch of rows
 
     """
     logger = current_app.flowapi_logger
-    db_conn_pool = current_app.db_conn_pool
+    if batch_size is None:
+        batch_size = current_app.config["RESULT_BATCH_SIZE"]
     prefix = "{"
     if additional_elements:
         for key, value in additional_elements.items():
@@ -36,8 +69,64 @@ async def stream_result_as_json(
     prefix += f'"{result_name}":['
     yield prefix.encode()
     prepend = ""
+    try:
+        async for batch in _stream_row_batches(sql_query, batch_size):
+            yield f"{prepend}{_encode_rows(batch)}".encode()
+            prepend = ", "
+        yield b"]}"
+    except Exception as e:
+        logger.error(e)
+
+
+async def stream_result_as_ndjson(sql_query, batch_size=None):
+    """
+    Generate a newline delimited JSON representation of a query result,
+    with one JSON object per row.
+
+    Parameters
+    ----------
+    sql_query : str
+        SQL query to stream output of
+    batch_size : int, optional
+        Number of rows to fetch from the database and encode at a time.
+        Defaults to the app's RESULT_BATCH_SIZE config option.
+
+    Yields
+    ------
+    bytes
+        Encoded chunks of newline delimited JSON, each containing a batch of rows
+    """
+    if batch_size is None:
+        batch_size = current_app.config["RESULT_BATCH_SIZE"]
+    try:
+        async for batch in _stream_row_batches(sql_query, batch_size):
+            yield "".join(
+                f"{json.dumps(row, number_mode=json.NM_DECIMAL, datetime_mode=json.DM_ISO8601)}\n"
+                for row in batch
+            ).encode()
+    except Exception as e:
+        current_app.flowapi_logger.error(e)
+
+
+async def _stream_row_batches(sql_query, batch_size):
+    """
+    Fetch the rows of a query result from the database in batches.
+
+    Parameters
+    ----------
+    sql_query : str
+        SQL query to stream output of
+    batch_size : int
+        Number of rows to fetch at a time
+
+    Yields
+    ------
+    list of dict
+        Batches of rows
+    """
+    logger = current_app.flowapi_logger
     logger.debug("Starting generator.", request_id=request.request_id)
-    async with db_conn_pool.acquire() as connection:
+    async with current_app.db_conn_pool.acquire() as connection:
         # Configure asyncpg to encode/decode JSON values
         await connection.set_type_codec(
             "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
@@ -46,11 +135,311 @@ async def stream_result_as_json(
         async with connection.transaction():
             logger.debug("Got transaction.", request_id=request.request_id)
             logger.debug(f"Running {sql_query}", request_id=request.request_id)
-            try:
-                async for row in connection.cursor(sql_query):
-                    yield f"{prepend}{json.dumps(dict(row.items()), number_mode=json.NM_DECIMAL, datetime_mode=json.DM_ISO8601)}".encode()
-                    prepend = ", "
+            batch = []
+            async for row in connection.cursor(sql_query, prefetch=batch_size):
+                batch.append(dict(row.items()))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            logger.debug("Finishing up.", request_id=request.request_id)
+
+
+async def stream_result_as_csv(sql_query):
+    """
+    Generate a CSV representation of a query result, with a header row,
+    using Postgres' `COPY ... TO STDOUT`.
+
+    Parameters
+    ----------
+    sql_query : str
+        SQL query to stream output of
+
+    Yields
+    ------
+    bytes
+        Chunks of CSV, as sent by the database
+    """
+    logger = current_app.flowapi_logger
+    db_conn_pool = current_app.db_conn_pool
+    request_id = request.request_id
+    # Chunks are passed from the copy to this generator through a bounded
+    # queue, so the copy waits if the client is reading slowly.
+    chunks = asyncio.Queue(maxsize=16)
+
+    async def copy():
+        try:
+            async with db_conn_pool.acquire() as connection:
+                logger.debug(f"Copying {sql_query} as csv.", request_id=request_id)
+                await connection.copy_from_query(
+                    sql_query, output=chunks.put, format="csv", header=True
+                )
+        except asyncio.CancelledError:
+            # The generator has stopped reading, so isn't waiting for the end of the
+            # chunks, and the queue may be full.
+            raise
+        except Exception:
+            await chunks.put(None)
+            raise
+        await chunks.put(None)
+
+    copy_task = asyncio.ensure_future(copy())
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        await copy_task
+        logger.debug("Finishing up.", request_id=request_id)
+    except Exception as e:
+        logger.error(e)
+    finally:
+        copy_task.cancel()
+
+
+async def stream_result_as_arrow(sql_query, file_format="stream", batch_size=None):
+    """
+    Generate an Apache Arrow IPC stream, or a Parquet file, containing a query result.
+    Requires the `pyarrow` package.
+
+    Numeric columns are converted to float64, because Postgres doesn't report the
+    precision and scale of numeric query results, so values with more than 15
+    significant digits are rounded. Use the JSON or CSV formats for exact values.
+
+    Parameters
+    ----------
+    sql_query : str
+        SQL query to stream output of
+    file_format : {"stream", "parquet"}, default "stream"
+        Whether to produce an Arrow IPC stream, or a Parquet file
+    batch_size : int, optional
+        Number of rows to fetch from the database and encode at a time, as
+        an Arrow record batch or Parquet row group. Defaults to the app's
+        RESULT_BATCH_SIZE config option.
+
+    Yields
+    ------
+    bytes
+        Chunks of the encoded result
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    logger = current_app.flowapi_logger
+    if batch_size is None:
+        batch_size = current_app.config["RESULT_BATCH_SIZE"]
+    sink = _ChunkSink()
+    try:
+        async with current_app.db_conn_pool.acquire() as connection:
+            async with connection.transaction():
+                logger.debug(
+                    f"Running {sql_query} as arrow {file_format}.",
+                    request_id=request.request_id,
+                )
+                statement = await connection.prepare(sql_query)
+                column_types = [
+                    attribute.type.name for attribute in statement.get_attributes()
+                ]
+                schema = pa.schema(
+                    [
+                        (attribute.name, _arrow_type(pa, attribute.type.name))
+                        for attribute in statement.get_attributes()
+                    ]
+                )
+                if file_format == "parquet":
+                    writer = pq.ParquetWriter(sink, schema)
+                else:
+                    writer = pa.ipc.new_stream(sink, schema)
+                rows = []
+                async for row in statement.cursor(prefetch=batch_size):
+                    rows.append(row)
+                    if len(rows) >= batch_size:
+                        writer.write_table(_arrow_table(pa, rows, schema, column_types))
+                        rows = []
+                        yield sink.take()
+                if rows:
+                    writer.write_table(_arrow_table(pa, rows, schema, column_types))
+                writer.close()
+                yield sink.take()
                 logger.debug("Finishing up.", request_id=request.request_id)
-                yield b"]}"
-            except Exception as e:
-                logger.error(e)
+    except Exception as e:
+        logger.error(e)
+
+
+# Arrow types for Postgres types. Other types are sent as strings. Numeric has
+# no fixed precision, so can't be represented as an Arrow decimal.
+_ARROW_TYPE_NAMES = {
+    "bool": "bool_",
+    "int2": "int16",
+    "int4": "int32",
+    "int8": "int64",
+    "float4": "float32",
+    "float8": "float64",
+    "numeric": "float64",
+    "date": "date32",
+}
+
+
+def _arrow_type(pa, pg_type_name):
+    """
+    Get the Arrow type used for a Postgres type.
+    """
+    if pg_type_name == "timestamp":
+        return pa.timestamp("us")
+    elif pg_type_name == "timestamptz":
+        return pa.timestamp("us", tz="UTC")
+    return getattr(pa, _ARROW_TYPE_NAMES.get(pg_type_name, "string"))()
+
+
+def _arrow_table(pa, rows, schema, column_types):
+    """
+    Convert a list of rows to an Arrow table, column by column.
+    """
+    columns = []
+    for i, (field, pg_type_name) in enumerate(zip(schema, column_types)):
+        values = [row[i] for row in rows]
+        if pg_type_name == "numeric":
+            values = [None if value is None else float(value) for value in values]
+        elif pg_type_name not in _ARROW_TYPE_NAMES and not pg_type_name.startswith(
+            "timestamp"
+        ):
+            values = [_as_string(value) for value in values]
+        columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _as_string(value):
+    """
+    Convert a value of a type which doesn't have an equivalent Arrow type to a string.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Writable file-like object which collects what is written to it, so
+    it can be sent in chunks as it is produced.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        """
+        Returns
+        -------
+        bytes
+            Everything written since this was last called
+        """
+        chunk = b"".join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def get_content_encoding() -> Optional[str]:
+    """
+    Get the best content encoding to compress a result with, out of those
+    which the request's Accept-Encoding header allows.
+
+    Returns
+    -------
+    str or None
+        "zstd" or "gzip", or None if the result shouldn't be compressed
+    """
+    encodings = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress_if_accepted(
+    results_streamer: AsyncIterator[bytes], headers: Dict[str, str]
+) -> Tuple[AsyncIterator[bytes], Dict[str, str]]:
+    """
+    Compress a streamed result with the best content encoding the client
+    accepts, if any.
+
+    Parameters
+    ----------
+    results_streamer : async iterator of bytes
+        Chunks of the result
+    headers : dict
+        Headers of the response
+
+    Returns
+    -------
+    async iterator of bytes
+        Chunks of the (possibly compressed) result
+    dict
+        Headers of the response, including the Content-Encoding used
+    """
+    headers = {
+        **headers,
+        "Vary": ", ".join(
+            vary for vary in (headers.get("Vary"), "Accept-Encoding") if vary
+        ),
+    }
+    content_encoding = get_content_encoding()
+    if content_encoding is None:
+        return results_streamer, headers
+    level = current_app.config[f"{content_encoding.upper()}_LEVEL"]
+    return (
+        stream_compressed(results_streamer, content_encoding, level),
+        {**headers, "Content-Encoding": content_encoding},
+    )
+
+
+async def stream_compressed(
+    results_streamer: AsyncGenerator[bytes, None], content_encoding: str, level: int
+) -> AsyncIterator[bytes]:
+    """
+    Compress a stream of chunks, doing the compression in a worker thread
+    so that the event loop is free to serve other requests.
+
+    Parameters
+    ----------
+    results_streamer : async generator of bytes
+        Chunks to compress. Closed when the compressed stream finishes or is closed.
+    content_encoding : {"gzip", "zstd"}
+        Compression to use
+    level : int
+        Compression level
+
+    Yields
+    ------
+    bytes
+        Compressed chunks
+    """
+    if content_encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    loop = asyncio.get_event_loop()
+    try:
+        async for chunk in results_streamer:
+            compressed = await loop.run_in_executor(None, compressor.compress, chunk)
+            if compressed:
+                yield compressed
+        yield await loop.run_in_executor(None, compressor.flush)
+    finally:
+        # Close the results streamer (and release its database connection) straight
+        # away if the client disconnects, rather than when it's garbage collected.
+        await results_streamer.aclose()
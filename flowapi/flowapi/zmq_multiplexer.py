@@ -0,0 +1,194 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+from typing import Dict, List
+
+import rapidjson
+import zmq
+from quart import current_app
+from zmq.asyncio import Context, Socket
+
+
+class ZMQMultiplexer:
+    """
+    A single long-lived DEALER socket connected to the FlowMachine server,
+    shared by all the requests handled by a FlowAPI worker.
+
+    Each message is sent with the id of the request it belongs to as its
+    routing envelope, and the FlowMachine server returns the envelope with
+    the reply, so replies can be matched to requests whatever order they
+    arrive in. As with a REQ socket, each request must receive the reply to
+    a message before sending another.
+
+    Parameters
+    ----------
+    socket : zmq.asyncio.Socket
+        Connected DEALER socket
+    """
+
+    def __init__(self, socket: Socket):
+        self.socket = socket
+        self._replies: Dict[str, asyncio.Future] = {}
+        self._recv_lock = asyncio.Lock()
+
+    @classmethod
+    def connect(cls, host: str, port: int) -> "ZMQMultiplexer":
+        """
+        Open a DEALER socket to the FlowMachine server.
+
+        Parameters
+        ----------
+        host : str
+            Host the FlowMachine server is running on
+        port : int
+            Port the FlowMachine server is listening on
+
+        Returns
+        -------
+        ZMQMultiplexer
+        """
+        socket = Context.instance().socket(zmq.DEALER)
+        socket.connect(f"tcp://{host}:{port}")
+        return cls(socket)
+
+    def send_json(self, request_id: str, msg: dict) -> None:
+        """
+        Send a message to the FlowMachine server on behalf of a request.
+
+        Parameters
+        ----------
+        request_id : str
+            Unique id of the request
+        msg : dict
+            JSON-serialisable message
+        """
+        if request_id in self._replies:
+            raise ValueError(
+                f"Request '{request_id}' is already waiting for a reply from FlowMachine."
+            )
+        self._replies[request_id] = asyncio.get_event_loop().create_future()
+        self.socket.send_multipart(
+            [request_id.encode(), b"", rapidjson.dumps(msg).encode()]
+        )
+
+    async def recv_json(self, request_id: str) -> dict:
+        """
+        Wait for the reply to the last message sent on behalf of a request.
+
+        Parameters
+        ----------
+        request_id : str
+            Unique id of the request
+
+        Returns
+        -------
+        dict
+            The reply from FlowMachine
+        """
+        reply = self._replies[request_id]
+        try:
+            while not reply.done():
+                # Only one request reads from the socket at a time, handing
+                # out any replies it receives which belong to other requests.
+                async with self._recv_lock:
+                    if not reply.done():
+                        self._dispatch(await self.socket.recv_multipart())
+            return reply.result()
+        finally:
+            self._replies.pop(request_id, None)
+
+    def _dispatch(self, multipart_msg: List[bytes]) -> None:
+        """
+        Pass a reply from FlowMachine to the request waiting for it.
+        """
+        if len(multipart_msg) != 3 or multipart_msg[1] != b"":
+            current_app.flowapi_logger.error(
+                "Ignoring reply from FlowMachine with unexpected structure."
+            )
+            return
+        request_id, _, reply = multipart_msg
+        request_id = request_id.decode()
+        try:
+            self._replies[request_id].set_result(rapidjson.loads(reply))
+        except (KeyError, asyncio.InvalidStateError):
+            current_app.flowapi_logger.debug(
+                "Ignoring reply for request which is no longer waiting.",
+                request_id=request_id,
+            )
+
+    def for_request(self, request_id: str) -> "RequestSocket":
+        """
+        Get a socket-like object for sending messages on behalf of one request.
+
+        Parameters
+        ----------
+        request_id : str
+            Unique id of the request
+
+        Returns
+        -------
+        RequestSocket
+        """
+        return RequestSocket(self, request_id)
+
+    def forget(self, request_id: str) -> None:
+        """
+        Stop waiting for a reply to a request, e.g. because the request has finished.
+
+        Parameters
+        ----------
+        request_id : str
+            Unique id of the request
+        """
+        self._replies.pop(request_id, None)
+
+    def close(self) -> None:
+        """
+        Close the socket. Any requests still waiting for replies will fail.
+        """
+        for reply in self._replies.values():
+            if not reply.done():
+                reply.set_exception(ConnectionError("FlowMachine socket closed."))
+        self.socket.close(linger=0)
+
+
+class RequestSocket:
+    """
+    Sends messages to the FlowMachine server for a single request, through
+    the worker's shared `ZMQMultiplexer`.
+
+    Parameters
+    ----------
+    multiplexer : ZMQMultiplexer
+        The shared socket
+    request_id : str
+        Unique id of the request
+    """
+
+    def __init__(self, multiplexer: ZMQMultiplexer, request_id: str):
+        self.multiplexer = multiplexer
+        self.request_id = request_id
+
+    def send_json(self, msg: dict) -> None:
+        """
+        Send a message to the FlowMachine server.
+
+        Parameters
+        ----------
+        msg : dict
+            JSON-serialisable message
+        """
+        self.multiplexer.send_json(self.request_id, msg)
+
+    async def recv_json(self) -> dict:
+        """
+        Wait for the reply to the last message sent.
+
+        Returns
+        -------
+        dict
+            The reply from FlowMachine
+        """
+        return await self.multiplexer.recv_json(self.request_id)
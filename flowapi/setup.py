@@ -37,5 +37,9 @@ setup(
         "apispec[yaml]",
         "get-secret-or-env-var",
     ],
-    extras_require={"test": ["pytest", "coverage"]},
+    extras_require={
+        "test": ["pytest", "coverage"],
+        "arrow": ["pyarrow"],
+        "zstd": ["zstandard"],
+    },
 )
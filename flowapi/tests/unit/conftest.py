@@ -53,10 +53,21 @@ def dummy_zmq_server(monkeypatch):
 
     """
     dummy = Mock()
-    dummy.return_value.socket.return_value.recv_json = CoroutineMock()
+    socket = dummy.return_value.socket.return_value
+    socket.recv_json = CoroutineMock()
+    sent = []
+    socket.send_multipart.side_effect = sent.append
+
+    async def recv_multipart():
+        # Reply to the oldest message with the next reply from recv_json
+        request_id, delimiter, _ = sent.pop(0)
+        reply = await socket.recv_json()
+        return [request_id, delimiter, json.dumps(reply).encode()]
+
+    socket.recv_multipart = recv_multipart
 
     monkeypatch.setattr(zmq.asyncio.Context, "instance", dummy)
-    yield dummy.return_value.socket.return_value.recv_json
+    yield socket.recv_json
 
 
 @pytest.fixture
@@ -2,11 +2,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
+import gzip
+import os
 import pytest
+from decimal import Decimal
 from json import loads
+from unittest.mock import ANY
+
+import zmq.asyncio
+from quart import request
+
+from flowapi.stream_results import stream_compressed, stream_result_as_csv
 
 from tests.unit.zmq_helpers import ZMQReply
-from asynctest import CoroutineMock
+from asynctest import CoroutineMock, MagicMock, Mock
 
 
 @pytest.mark.asyncio
@@ -61,6 +71,50 @@ async def test_get_query(app, access_token_builder, dummy_zmq_server):
     )
 
 
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 10])
+@pytest.mark.asyncio
+async def test_get_query_in_batches(
+    batch_size, app, access_token_builder, dummy_zmq_server
+):
+    """
+    Test that the JSON returned is the same whatever the batch size used to stream the rows.
+    """
+    app.app.config["RESULT_BATCH_SIZE"] = batch_size
+    rows = [{"some": "valid"}, {"json": "bits"}, {"more": 1}]
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = (
+        rows
+    )
+    token = access_token_builder(
+        {
+            "modal_location": {
+                "permissions": {"get_result": True},
+                "spatial_aggregation": ["DUMMY_AGGREGATION"],
+            }
+        }
+    )
+    dummy_zmq_server.side_effect = (
+        {
+            "status": "success",
+            "payload": {
+                "query_id": "5ffe4a96dbe33a117ae9550178b81836",
+                "query_params": {
+                    "aggregation_unit": "DUMMY_AGGREGATION",
+                    "query_kind": "modal_location",
+                },
+            },
+        },
+        {
+            "status": "success",
+            "payload": {"query_state": "completed", "sql": "SELECT 1;"},
+        },
+    )
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID", headers={"Authorization": f"Bearer {token}"}
+    )
+    json_data = loads(await response.get_data())
+    assert rows == json_data["query_result"]
+
+
 # FIXME: this test is very difficult to adjust and debug when things change
 # on the flowmachine side (e.g. in the structure of the zmq reply message).
 # It should probably be turned into an integration test, or we should rethink
@@ -153,3 +207,429 @@ async def test_get_error_message_without_query_state(
     json = await response.get_json()
     assert 500 == response.status_code
     assert "DUMMY_ERROR_MESSAGE" == json["msg"]
+
+
+def _get_result_replies():
+    """
+    Replies from FlowMachine for the messages sent when getting a completed query's result.
+    """
+    return (
+        {
+            "status": "success",
+            "payload": {
+                "query_id": "5ffe4a96dbe33a117ae9550178b81836",
+                "query_params": {
+                    "aggregation_unit": "DUMMY_AGGREGATION",
+                    "query_kind": "modal_location",
+                },
+            },
+        },
+        {
+            "status": "success",
+            "payload": {"query_state": "completed", "sql": "SELECT 1;"},
+        },
+    )
+
+
+@pytest.fixture
+def get_result_token(access_token_builder):
+    return access_token_builder(
+        {
+            "modal_location": {
+                "permissions": {"get_result": True},
+                "spatial_aggregation": ["DUMMY_AGGREGATION"],
+            }
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_query_as_ndjson(app, get_result_token, dummy_zmq_server):
+    """
+    Test that newline delimited JSON is returned when requested with the format parameter.
+    """
+    rows = [{"some": "valid"}, {"json": "bits"}]
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = (
+        rows
+    )
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID?format=ndjson",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert (
+        "attachment;filename=DUMMY_QUERY_ID.ndjson"
+        == response.headers["content-disposition"]
+    )
+    lines = (await response.get_data()).decode().splitlines()
+    assert rows == [loads(line) for line in lines]
+
+
+@pytest.mark.asyncio
+async def test_get_query_as_csv(app, get_result_token, dummy_zmq_server):
+    """
+    Test that CSV is copied from the database when requested with the Accept header.
+    """
+
+    async def copy_from_query(sql, *, output, **kwargs):
+        await output(b"some,json\n")
+        await output(b"valid,bits\n")
+
+    app.db_pool.acquire.return_value.__aenter__.return_value.copy_from_query = CoroutineMock(
+        side_effect=copy_from_query
+    )
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={"Authorization": f"Bearer {get_result_token}", "Accept": "text/csv"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv"
+    assert b"some,json\nvalid,bits\n" == await response.get_data()
+    app.db_pool.acquire.return_value.__aenter__.return_value.copy_from_query.assert_called_once_with(
+        "SELECT 1;", output=ANY, format="csv", header=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_csv_copy_stops_when_stream_closed_with_full_queue(app):
+    """
+    Test that the copy producing CSV finishes if the stream is closed while the copy is waiting for space in the queue.
+    """
+
+    async def copy_from_query(sql, *, output, **kwargs):
+        for _ in range(100):
+            await output(b"row\n")
+
+    app.db_pool.acquire.return_value.__aenter__.return_value.copy_from_query = CoroutineMock(
+        side_effect=copy_from_query
+    )
+    async with app.app.test_request_context(method="GET", path="/"):
+        request.request_id = "DUMMY_REQUEST_ID"
+        chunks = stream_result_as_csv("SELECT 1;")
+        assert await chunks.__anext__() == b"row\n"
+        await asyncio.sleep(0.1)  # Let the copy fill the queue
+        await chunks.aclose()
+        await asyncio.sleep(0.1)
+    assert not any(
+        "stream_result_as_csv.<locals>.copy" in repr(task)
+        for task in asyncio.all_tasks()
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_query_as_arrow(app, get_result_token, dummy_zmq_server):
+    """
+    Test that an Arrow IPC stream is returned when requested with the format parameter.
+    """
+    pa = pytest.importorskip("pyarrow")
+    connection = app.db_pool.acquire.return_value.__aenter__.return_value
+    statement = MagicMock()
+    statement.get_attributes.return_value = [
+        Mock(type=Mock()),
+        Mock(type=Mock()),
+    ]
+    statement.get_attributes.return_value[0].name = "subscriber"
+    statement.get_attributes.return_value[0].type.name = "text"
+    statement.get_attributes.return_value[1].name = "value"
+    statement.get_attributes.return_value[1].type.name = "numeric"
+    statement.cursor.return_value.__aiter__.return_value = [
+        ("a", Decimal("1.5")),
+        ("b", None),
+    ]
+    connection.prepare = CoroutineMock(return_value=statement)
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID?format=arrow",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(await response.get_data()).read_all()
+    assert table.to_pydict() == {"subscriber": ["a", "b"], "value": [1.5, None]}
+
+
+@pytest.mark.asyncio
+async def test_get_query_unsupported_format(app, get_result_token, dummy_zmq_server):
+    """
+    Test that asking for an unsupported format gives a 400 error.
+    """
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID?format=xlsx",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_query_gzipped(app, get_result_token, dummy_zmq_server):
+    """
+    Test that the result is gzip compressed if the client accepts it.
+    """
+    rows = [{"some": "valid"}, {"json": "bits"}]
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = (
+        rows
+    )
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={
+            "Authorization": f"Bearer {get_result_token}",
+            "Accept-Encoding": "gzip",
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    json_data = loads(gzip.decompress(await response.get_data()))
+    assert rows == json_data["query_result"]
+
+
+@pytest.mark.asyncio
+async def test_stream_compressed_closes_results_streamer():
+    """
+    Test that closing a compressed stream early closes the stream of results it compresses.
+    """
+    closed = []
+
+    async def results_streamer():
+        try:
+            for _ in range(10):
+                yield os.urandom(100000)
+        finally:
+            closed.append(True)
+
+    compressed = stream_compressed(results_streamer(), "gzip", 6)
+    assert len(await compressed.__anext__()) > 0
+    await compressed.aclose()
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_get_query_zstd_compressed(app, get_result_token, dummy_zmq_server):
+    """
+    Test that the result is zstd compressed in preference to gzip if the client accepts it.
+    """
+    zstandard = pytest.importorskip("zstandard")
+    rows = [{"some": "valid"}, {"json": "bits"}]
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = (
+        rows
+    )
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={
+            "Authorization": f"Bearer {get_result_token}",
+            "Accept-Encoding": "gzip, zstd",
+        },
+    )
+    assert response.headers["content-encoding"] == "zstd"
+    data = (
+        zstandard.ZstdDecompressor()
+        .decompressobj()
+        .decompress(await response.get_data())
+    )
+    assert rows == loads(data)["query_result"]
+
+
+@pytest.mark.asyncio
+async def test_get_query_not_compressed_by_default(
+    app, get_result_token, dummy_zmq_server
+):
+    """
+    Test that the result isn't compressed if the client doesn't ask for it.
+    """
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = [
+        {"some": "valid"}
+    ]
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert "content-encoding" not in response.headers
+
+
+def _get_cached_result_replies():
+    """
+    Replies from FlowMachine for the messages sent when getting a completed query's
+    result, including the time the result was cached.
+    """
+    params_reply, sql_reply = _get_result_replies()
+    return (
+        params_reply,
+        {
+            **sql_reply,
+            "payload": {**sql_reply["payload"], "created": "2016-01-01T00:00:00"},
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_query_etag(app, get_result_token, dummy_zmq_server):
+    """
+    Test that a query result is returned with an entity tag and caching headers.
+    """
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = [
+        {"some": "valid"}
+    ]
+    dummy_zmq_server.side_effect = _get_cached_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith('"')
+    assert response.headers["cache-control"] == "private, max-age=86400, immutable"
+
+
+@pytest.mark.asyncio
+async def test_get_query_etag_differs_by_format(
+    app, get_result_token, dummy_zmq_server
+):
+    """
+    Test that the same result has a different entity tag in each format.
+    """
+    etags = set()
+    for result_format in ("json", "ndjson"):
+        dummy_zmq_server.side_effect = _get_cached_result_replies()
+        response = await app.client.get(
+            f"/api/0/get/DUMMY_QUERY_ID?format={result_format}",
+            headers={"Authorization": f"Bearer {get_result_token}"},
+        )
+        etags.add(response.headers["etag"])
+    assert len(etags) == 2
+
+
+@pytest.mark.parametrize(
+    "if_none_match", ["{etag}", "W/{etag}", '"SOME_OTHER_TAG", {etag}', "*"]
+)
+@pytest.mark.asyncio
+async def test_get_query_not_modified(
+    if_none_match, app, get_result_token, dummy_zmq_server
+):
+    """
+    Test that a 304 is returned without querying the database if the client has the current result.
+    """
+    dummy_zmq_server.side_effect = _get_cached_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    etag = response.headers["etag"]
+    app.db_pool.acquire.reset_mock()
+    dummy_zmq_server.side_effect = _get_cached_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={
+            "Authorization": f"Bearer {get_result_token}",
+            "If-None-Match": if_none_match.format(etag=etag),
+        },
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert await response.get_data() == b""
+    app.db_pool.acquire.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_query_modified(app, get_result_token, dummy_zmq_server):
+    """
+    Test that the result is returned if the client's copy doesn't match.
+    """
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = [
+        {"some": "valid"}
+    ]
+    dummy_zmq_server.side_effect = _get_cached_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID",
+        headers={
+            "Authorization": f"Bearer {get_result_token}",
+            "If-None-Match": '"SOME_OLD_TAG"',
+        },
+    )
+    assert response.status_code == 200
+    assert [{"some": "valid"}] == loads(await response.get_data())["query_result"]
+
+
+@pytest.mark.asyncio
+async def test_get_query_page(app, get_result_token, dummy_zmq_server):
+    """
+    Test that page parameters are passed to FlowMachine.
+    """
+    app.db_pool.acquire.return_value.__aenter__.return_value.cursor.return_value.__aiter__.return_value = [
+        {"pcod": "DUMMY_PCOD"}
+    ]
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID?columns=pcod,value&filter=value:gt:10&filter=pcod:eq:a:b&order_by=-value&limit=5&offset=10",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 200
+    socket = zmq.asyncio.Context.instance.return_value.socket.return_value
+    _, _, msg = socket.send_multipart.call_args_list[-1][0][0]
+    assert loads(msg)["params"] == {
+        "query_id": "DUMMY_QUERY_ID",
+        "columns": ["pcod", "value"],
+        "filters": [["value", "gt", "10"], ["pcod", "eq", "a:b"]],
+        "order_by": ["-value"],
+        "limit": 5,
+        "offset": 10,
+    }
+
+
+@pytest.mark.parametrize(
+    "page_params", ["limit=ten", "offset=1.5", "filter=value:10", "filter=value"]
+)
+@pytest.mark.asyncio
+async def test_get_query_bad_page(page_params, app, get_result_token, dummy_zmq_server):
+    """
+    Test that malformed page parameters are rejected.
+    """
+    dummy_zmq_server.side_effect = _get_result_replies()
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID?{page_params}",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_query_invalid_page(app, get_result_token, dummy_zmq_server):
+    """
+    Test that pages FlowMachine rejects, e.g. with unknown columns, are a bad request.
+    """
+    params_reply, _ = _get_result_replies()
+    dummy_zmq_server.side_effect = (
+        params_reply,
+        {
+            "status": "error",
+            "msg": "'NOT_A_COLUMN' is not a column of this query.",
+            "payload": {"query_id": "DUMMY_QUERY_ID", "query_state": "completed"},
+        },
+    )
+    response = await app.client.get(
+        f"/api/0/get/DUMMY_QUERY_ID?columns=NOT_A_COLUMN",
+        headers={"Authorization": f"Bearer {get_result_token}"},
+    )
+    assert response.status_code == 400
+    assert (await response.get_json())["msg"] == (
+        "'NOT_A_COLUMN' is not a column of this query."
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_query_etag_differs_by_page(app, get_result_token, dummy_zmq_server):
+    """
+    Test that each page of a result has a different entity tag.
+    """
+    etags = set()
+    for page_params in ("", "limit=5", "limit=5&offset=5"):
+        dummy_zmq_server.side_effect = _get_cached_result_replies()
+        response = await app.client.get(
+            f"/api/0/get/DUMMY_QUERY_ID?{page_params}",
+            headers={"Authorization": f"Bearer {get_result_token}"},
+        )
+        etags.add(response.headers["etag"])
+    assert len(etags) == 3
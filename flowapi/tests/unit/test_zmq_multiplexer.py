@@ -0,0 +1,71 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import json
+
+import pytest
+from asynctest import Mock
+
+from flowapi.zmq_multiplexer import ZMQMultiplexer
+
+
+@pytest.mark.asyncio
+async def test_replies_matched_to_requests(app):
+    """
+    Test that replies arriving out of order are returned to the requests which sent the messages.
+    """
+    socket = Mock()
+    replies = asyncio.Queue()
+
+    async def recv_multipart():
+        return await replies.get()
+
+    socket.recv_multipart = recv_multipart
+    multiplexer = ZMQMultiplexer(socket)
+    first = multiplexer.for_request("first")
+    second = multiplexer.for_request("second")
+    first.send_json({"request_id": "first", "action": "ping"})
+    second.send_json({"request_id": "second", "action": "ping"})
+    assert [call[0][0][0] for call in socket.send_multipart.call_args_list] == [
+        b"first",
+        b"second",
+    ]
+    waiting = asyncio.gather(first.recv_json(), second.recv_json())
+    await replies.put([b"second", b"", json.dumps({"msg": "second"}).encode()])
+    await replies.put([b"first", b"", json.dumps({"msg": "first"}).encode()])
+    assert await waiting == [{"msg": "first"}, {"msg": "second"}]
+
+
+@pytest.mark.asyncio
+async def test_reply_for_forgotten_request_ignored(app):
+    """
+    Test that a reply for a request which is no longer waiting doesn't prevent other requests getting their replies.
+    """
+    socket = Mock()
+    replies = [
+        [b"gone", b"", json.dumps({"msg": "gone"}).encode()],
+        [b"waiting", b"", json.dumps({"msg": "waiting"}).encode()],
+    ]
+
+    async def recv_multipart():
+        return replies.pop(0)
+
+    socket.recv_multipart = recv_multipart
+    multiplexer = ZMQMultiplexer(socket)
+    multiplexer.send_json("gone", {})
+    multiplexer.forget("gone")
+    multiplexer.send_json("waiting", {})
+    assert await multiplexer.recv_json("waiting") == {"msg": "waiting"}
+
+
+@pytest.mark.asyncio
+async def test_one_message_at_a_time_per_request(app):
+    """
+    Test that a request can't send a second message before receiving the reply to the first.
+    """
+    multiplexer = ZMQMultiplexer(Mock())
+    multiplexer.send_json("DUMMY_ID", {})
+    with pytest.raises(ValueError):
+        multiplexer.send_json("DUMMY_ID", {})
@@ -11,5 +11,6 @@ UpdateETLTableOperator = fixed_sql_operator(
         INSERT INTO available_tables (table_name, has_locations, has_subscribers{% if params.cdr_type in ['calls', 'sms']  %}, has_counterparts {% endif %}) VALUES ('{{ params.cdr_type }}', true, true{% if params.cdr_type in ['calls', 'sms']  %}, true {% endif %})
             ON conflict (table_name)
             DO UPDATE SET has_locations=EXCLUDED.has_locations, has_subscribers=EXCLUDED.has_subscribers{% if params.cdr_type in ['calls', 'sms']  %}, has_counterparts=EXCLUDED.has_counterparts {% endif %};
+        SELECT pg_notify('etl_records_updated', '{{ params.cdr_type }}');
         """,
 )
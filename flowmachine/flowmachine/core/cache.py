@@ -8,12 +8,32 @@
 Functions which deal with inspecting and managing the query cache.
 """
 import asyncio
+import atexit
+import datetime
+import heapq
+import logging
+import math
 import pickle
+import threading
+import weakref
+from abc import ABCMeta, abstractmethod
 from concurrent.futures import Executor, TimeoutError
 from functools import partial
 
-from typing import TYPE_CHECKING, Tuple, List, Callable, Optional
+import pandas as pd
+import rapidjson
+from typing import (
+    TYPE_CHECKING,
+    Tuple,
+    List,
+    Callable,
+    Optional,
+    Dict,
+    NamedTuple,
+    Iterable,
+)
 
+from cachetools import LRUCache
 from psycopg2 import InternalError
 
 from redis import StrictRedis
@@ -25,8 +45,9 @@ from flowmachine.core.errors.flowmachine_errors import (
     QueryErroredException,
     StoreFailedException,
 )
-from flowmachine.core.query_state import QueryStateMachine, QueryEvent
+from flowmachine.core.query_state import QueryStateMachine, QueryEvent, QueryState
 from flowmachine import __version__
+from flowmachine.utils import get_page_sql
 
 if TYPE_CHECKING:
     from .query import Query
@@ -35,6 +56,17 @@ if TYPE_CHECKING:
 import structlog
 
 logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
+cache_trace_log = structlog.get_logger("flowmachine.cache_trace")
+
+# Touches waiting to be written, by connection. Weakly keyed, so that buffers
+# (and their threads) don't keep connections alive.
+_cache_touch_buffers = weakref.WeakKeyDictionary()
+_cache_touch_buffers_lock = threading.Lock()
+
+# SQL to fetch the results of stored queries, when they were cached, and the
+# column and index metadata needed to page through them, by query id
+_result_sql_cache = LRUCache(maxsize=1024)
+_result_sql_cache_lock = threading.Lock()
 
 
 def write_query_to_cache(
@@ -124,6 +156,7 @@ def write_query_to_cache(
                     q_state_machine.raise_error()
                     logger.error(f"Error writing cache metadata. Error was {exc}")
                     raise exc
+        connection.invalidate_table_metadata(name=name, schema=schema)
         q_state_machine.finish()
 
     q_state_machine.wait_until_complete(sleep_duration=sleep_duration)
@@ -208,6 +241,7 @@ def write_cache_metadata(
                 logger.debug(f"{query.fully_qualified_table_name} added to cache.")
             else:
                 logger.debug(f"Touched cache for {query.fully_qualified_table_name}.")
+        _record_cache_access(connection, query.query_id)
     except NotImplementedError:
         logger.debug("Table has no standard name.")
 
@@ -227,10 +261,185 @@ def touch_cache(connection: "Connection", query_id: str) -> float:
     float
         The new cache score
     """
+    flush_cache_touches(connection)
     try:
-        return float(connection.fetch(f"SELECT touch_cache('{query_id}')")[0][0])
+        score = float(connection.fetch(f"SELECT touch_cache('{query_id}')")[0][0])
     except (IndexError, InternalError):
         raise ValueError(f"Query id '{query_id}' is not in cache on this connection.")
+    _record_cache_access(connection, query_id)
+    return score
+
+
+class _CacheTouchBuffer:
+    """
+    Touches of cache records on one connection, waiting to be written.
+    A daemon thread writes pending touches in order, in one round trip,
+    every `flush_interval` seconds or as soon as `max_pending` are waiting.
+    Only a weak reference to the connection is kept, and the thread stops
+    once the connection has been garbage collected.
+
+    Parameters
+    ----------
+    connection : Connection
+    flush_interval : float
+        Maximum number of seconds a touch waits before being written
+    max_pending : int
+        Number of touches which trigger an immediate write
+    """
+
+    def __init__(
+        self, connection: "Connection", flush_interval: float, max_pending: int
+    ):
+        self._connection_ref = weakref.ref(connection)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._thread = threading.Thread(
+            target=self._flush_periodically, name="cache-touch-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, query_id: str) -> None:
+        with self._pending_lock:
+            self._pending.append(query_id)
+            if len(self._pending) >= self.max_pending:
+                self._flush_requested.set()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            connection = self._connection_ref()
+            if not pending or connection is None:
+                return
+            # The ORDER BY ... OFFSET 0 subquery makes touches apply in the order
+            # they happened, which matters for the score multipliers. Records removed
+            # since they were touched are skipped. touch_cache writes, so this needs
+            # an explicit transaction to be committed.
+            with connection.engine.begin() as trans:
+                touched = trans.execute(
+                    """
+                    SELECT touched_id, touch_cache(touched_id) FROM
+                        (SELECT touched_id FROM unnest(%s::text[]) WITH ORDINALITY AS t(touched_id, touch_order)
+                         WHERE touched_id IN (SELECT query_id FROM cache.cached)
+                         ORDER BY touch_order OFFSET 0) AS touches
+                    """,
+                    (pending,),
+                ).fetchall()
+            logger.debug(
+                f"Wrote {len(touched)} cache touches.",
+                skipped=len(pending) - len(touched),
+            )
+            for query_id, _ in touched:
+                _record_cache_access(connection, query_id)
+
+    def _flush_periodically(self) -> None:
+        while self._connection_ref() is not None:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.error(
+                    f"Failed to write cache touches: {type(exc).__name__}: {exc}"
+                )
+
+
+def queue_cache_touch(
+    connection: "Connection",
+    query_id: str,
+    flush_interval: float = 1.0,
+    max_pending: int = 1000,
+) -> None:
+    """
+    'Touch' a cache record without waiting for the cache score to be updated. Touches are
+    written in batches by a background thread, in the order they were queued. Touches of
+    queries which are no longer in cache when the batch is written are ignored.
+
+    Parameters
+    ----------
+    connection : Connection
+    query_id : str
+        Unique id of the query to touch
+    flush_interval : float, default 1.0
+        Maximum number of seconds before touches on this connection are written. Only
+        used for the first touch on a connection.
+    max_pending : int, default 1000
+        Number of queued touches on this connection which cause them to be written immediately.
+        Only used for the first touch on a connection.
+
+    See Also
+    --------
+    touch_cache, flush_cache_touches
+    """
+    with _cache_touch_buffers_lock:
+        try:
+            buffer = _cache_touch_buffers[connection]
+        except KeyError:
+            buffer = _cache_touch_buffers[connection] = _CacheTouchBuffer(
+                connection, flush_interval=flush_interval, max_pending=max_pending
+            )
+    buffer.add(query_id)
+
+
+def flush_cache_touches(connection: "Connection") -> None:
+    """
+    Write any queued cache touches for this connection, and wait for them to be written.
+
+    Parameters
+    ----------
+    connection : Connection
+    """
+    with _cache_touch_buffers_lock:
+        buffer = _cache_touch_buffers.get(connection)
+    if buffer is None:
+        return  # Nothing has been queued on this connection
+    buffer.flush()
+
+
+@atexit.register
+def _flush_all_cache_touches() -> None:
+    with _cache_touch_buffers_lock:
+        buffers = list(_cache_touch_buffers.values())
+    for buffer in buffers:
+        try:
+            buffer.flush()
+        except Exception as exc:
+            logger.error(f"Failed to write cache touches: {type(exc).__name__}: {exc}")
+
+
+def _record_cache_access(connection: "Connection", query_id: str) -> None:
+    """
+    Log an access to a cached query to the 'flowmachine.cache_trace' logger, if that
+    logger is enabled at INFO level. Does nothing (and doesn't touch the database)
+    otherwise.
+
+    Parameters
+    ----------
+    connection : Connection
+    query_id : str
+        Unique id of the query which was accessed
+    """
+    if not logging.getLogger("flowmachine.cache_trace").isEnabledFor(logging.INFO):
+        return
+    try:
+        class_name, compute_time, table_size = connection.fetch(
+            f"""SELECT class, compute_time, table_size(tablename, schema)
+            FROM cache.cached WHERE query_id='{query_id}'"""
+        )[0]
+    except IndexError:
+        return  # Not visible from this connection yet
+    if class_name == "Table":
+        return  # Table records are never evicted, so aren't of interest
+    cache_trace_log.info(
+        "cache_access",
+        query_id=query_id,
+        table_size=0 if table_size is None else int(table_size),
+        compute_time=0 if compute_time is None else float(compute_time) / 1000,
+    )
 
 
 def reset_cache(
@@ -272,6 +481,8 @@ def reset_cache(
             trans.execute(f"DELETE FROM cache.cached WHERE schema='cache'")
         else:
             trans.execute("TRUNCATE cache.cached CASCADE")
+    forget_result_sql()
+    connection.invalidate_table_metadata(schema="cache")
     resync_redis_with_cache(connection=connection, redis=redis)
 
 
@@ -364,6 +575,213 @@ def get_query_object_by_id(connection: "Connection", query_id: str) -> "Query":
         raise ValueError(f"Query id '{query_id}' is not in cache on this connection.")
 
 
+def get_result_sql(connection: "Connection", query_id: str) -> str:
+    """
+    Get the SQL which fetches the result of a stored query. The SQL is remembered
+    in a bounded in-process LRU cache, so that repeat requests for the same result
+    don't need to fetch and unpickle the query object.
+
+    Parameters
+    ----------
+    connection : Connection
+    query_id : str
+        Unique id of the query, which should be stored
+
+    Returns
+    -------
+    str
+        SQL string
+
+    Notes
+    -----
+    A cache touch is queued for the query on every call. Remembered SQL is only
+    returned after checking that the query is still in cache.
+
+    See Also
+    --------
+    get_result_sql_and_created
+    """
+    return get_result_sql_and_created(connection, query_id)[0]
+
+
+def get_result_sql_and_created(
+    connection: "Connection", query_id: str
+) -> Tuple[str, datetime.datetime]:
+    """
+    Get the SQL which fetches the result of a stored query, and the time the
+    query was added to the cache. Together, these identify a version of the
+    result which won't change until the query is removed from cache.
+
+    Parameters
+    ----------
+    connection : Connection
+    query_id : str
+        Unique id of the query, which should be stored
+
+    Returns
+    -------
+    str
+        SQL string
+    datetime.datetime
+        Time the query was added to the cache
+
+    Notes
+    -----
+    As for `get_result_sql`, the SQL is remembered in this process. The time the
+    query was cached is read from cache.cached on every call, so it can be used to
+    answer conditional requests even if another process has re-cached the query.
+    """
+    return _get_result_sql_record(connection, query_id)[:2]
+
+
+def get_result_page_sql(
+    connection: "Connection",
+    query_id: str,
+    *,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, str]]] = None,
+    order_by: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Tuple[str, datetime.datetime]:
+    """
+    Get SQL which fetches a page of the result of a stored query, and the time the
+    query was added to the cache. Uses the same in-process cache as
+    `get_result_sql_and_created`, so the query object only needs to be fetched and
+    unpickled on the first request.
+
+    Parameters
+    ----------
+    connection : Connection
+    query_id : str
+        Unique id of the query, which should be stored
+    columns, filters, order_by, limit, offset
+        Page to fetch, as for `Query.get_page_query`
+
+    Returns
+    -------
+    str
+        SQL string
+    datetime.datetime
+        Time the query was added to the cache
+
+    Raises
+    ------
+    ValueError
+        If the query is not in cache, or the page is not valid
+
+    See Also
+    --------
+    flowmachine.utils.get_page_sql
+    """
+    sql, created, table, column_names, index_columns = _get_result_sql_record(
+        connection, query_id
+    )
+    page_sql = get_page_sql(
+        f"({sql})" if table is None else table,
+        column_names=column_names,
+        index_columns=index_columns,
+        unique_column=None if table is None else "ctid",
+        columns=columns,
+        filters=filters,
+        order_by=order_by,
+        limit=limit,
+        offset=offset,
+    )
+    return page_sql, created
+
+
+def _get_result_sql_record(
+    connection: "Connection", query_id: str
+) -> Tuple[str, datetime.datetime, Optional[str], List[str], List[str]]:
+    """
+    Get the result SQL of a stored query, when it was cached, the table the result
+    is stored in (or None if the SQL doesn't just read a cache table), its columns
+    and the columns of the index used to order pages of it.
+
+    Parameters
+    ----------
+    connection : Connection
+    query_id : str
+        Unique id of the query, which should be stored
+
+    Returns
+    -------
+    tuple
+    """
+    with _result_sql_cache_lock:
+        cached = _result_sql_cache.get(query_id)
+    if cached is not None:
+        # The remembered SQL is only valid while the query is still in cache, which
+        # may have been changed by another process. The query may also have been
+        # removed and stored again since, so the time it was cached is always re-read.
+        try:
+            created = connection.fetch(
+                f"SELECT created FROM cache.cached WHERE query_id='{query_id}'"
+            )[0][0]
+        except IndexError:
+            forget_result_sql(query_id)
+            raise ValueError(
+                f"Query id '{query_id}' is not in cache on this connection."
+            )
+        if created != cached[1]:
+            cached = (cached[0], created, *cached[2:])
+            with _result_sql_cache_lock:
+                _result_sql_cache[query_id] = cached
+        queue_cache_touch(connection, query_id)
+        return cached
+    try:
+        obj, created = connection.fetch(
+            f"SELECT obj, created FROM cache.cached WHERE query_id='{query_id}'"
+        )[0]
+    except IndexError:
+        raise ValueError(f"Query id '{query_id}' is not in cache on this connection.")
+    query = pickle.loads(obj)
+    sql = query.get_query()
+    try:
+        table = query.fully_qualified_table_name
+    except NotImplementedError:
+        table = None
+    if sql != f"SELECT * FROM {table}":
+        table = None
+    record = (sql, created, table, query.column_names, query._page_index_columns)
+    if table is not None:
+        with _result_sql_cache_lock:
+            _result_sql_cache[query_id] = record
+    return record
+
+
+def forget_result_sql(query_id: Optional[str] = None) -> None:
+    """
+    Remove a query's result SQL from this process's cache of result SQL.
+
+    Parameters
+    ----------
+    query_id : str, optional
+        Unique id of the query to forget. If not given, all queries are forgotten.
+    """
+    with _result_sql_cache_lock:
+        if query_id is None:
+            _result_sql_cache.clear()
+        else:
+            _result_sql_cache.pop(query_id, None)
+
+
+def set_result_sql_cache_size(max_entries: int) -> None:
+    """
+    Set the maximum number of queries for which to remember result SQL in this process.
+    Clears the cache.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries
+    """
+    global _result_sql_cache
+    with _result_sql_cache_lock:
+        _result_sql_cache = LRUCache(maxsize=max_entries)
+
+
 def get_cached_query_objects_ordered_by_score(
     connection: "Connection", protected_period: Optional[int] = None,
 ) -> List[Tuple["Query", int]]:
@@ -399,11 +817,219 @@ def get_cached_query_objects_ordered_by_score(
     return [(pickle.loads(obj), table_size) for obj, table_size in cache_queries]
 
 
+class CacheRecord(NamedTuple):
+    """
+    Metadata about a cached query, sufficient to evict it from cache without
+    unpickling the query object.
+
+    Attributes
+    ----------
+    query_id : str
+        Unique id of the cached query
+    class_name : str
+        Name of the class of the cached query
+    schema : str
+        Schema of the cache table
+    tablename : str
+        Name of the cache table
+    table_size : int
+        Size on disk in bytes of the cache table
+    """
+
+    query_id: str
+    class_name: str
+    schema: str
+    tablename: str
+    table_size: int
+
+    @property
+    def fully_qualified_table_name(self) -> str:
+        return f"{self.schema}.{self.tablename}"
+
+
+def get_cache_records_ordered_by_score(
+    connection: "Connection", protected_period: Optional[int] = None,
+) -> List[CacheRecord]:
+    """
+    Get metadata for all cached queries in ascending cache score order, without
+    loading the query objects.
+
+    Parameters
+    ----------
+    connection : Connection
+    protected_period : int, default None
+        Optionally specify a number of seconds within which cache entries are excluded. If None,
+        the value stored in cache.cache_config will be used.Set to a negative number to ignore cache protection
+        completely.
+
+    Returns
+    -------
+    list of CacheRecord
+        Cache records, lowest scoring first
+
+    """
+    protected_period_clause = (
+        (f" AND NOW()-created > INTERVAL '{protected_period} seconds'")
+        if protected_period is not None
+        else " AND NOW()-created > (cache_protected_period()*INTERVAL '1 seconds')"
+    )
+    qry = f"""SELECT query_id, class, schema, tablename, table_size
+        FROM (
+            SELECT query_id, class, schema, tablename, cache_score_multiplier, compute_time,
+                table_size(tablename, schema) as table_size
+            FROM cache.cached
+            WHERE NOT cached.class='Table'
+            {protected_period_clause}
+        ) _
+        ORDER BY cache_score(cache_score_multiplier, compute_time, table_size) ASC
+        """
+    return [
+        CacheRecord(
+            query_id=query_id,
+            class_name=class_name,
+            schema=schema,
+            tablename=tablename,
+            table_size=0 if table_size is None else int(table_size),
+        )
+        for query_id, class_name, schema, tablename, table_size in connection.fetch(qry)
+    ]
+
+
+def plan_cache_eviction(
+    connection: "Connection",
+    size_threshold: Optional[int] = None,
+    protected_period: Optional[int] = None,
+) -> List[CacheRecord]:
+    """
+    Choose the cache records to remove to bring the cache below a size threshold, lowest
+    scoring first. Only cache metadata is used, so no query objects are loaded.
+
+    Parameters
+    ----------
+    connection : "Connection"
+    size_threshold : int, default None
+        Optionally override the maximum cache size set in flowdb.
+    protected_period : int, default None
+        Optionally specify a number of seconds within which cache entries are excluded. If None,
+        the value stored in cache.cache_config will be used.Set to a negative number to ignore cache protection
+        completely.
+
+    Returns
+    -------
+    list of CacheRecord
+        Cache records which should be removed, in the order they should be removed in
+    """
+    flush_cache_touches(connection)
+    if size_threshold is None:
+        size_threshold = get_max_size_of_cache(connection)
+    current_cache_size = get_size_of_cache(connection)
+    victims = []
+    for record in get_cache_records_ordered_by_score(
+        connection, protected_period=protected_period
+    ):
+        if current_cache_size <= size_threshold:
+            break
+        victims.append(record)
+        current_cache_size -= record.table_size
+    return victims
+
+
+def evict_cache_records(
+    connection: "Connection",
+    redis: StrictRedis,
+    records: List[CacheRecord],
+    batch_size: int = 100,
+) -> List[CacheRecord]:
+    """
+    Remove cache records and drop their tables, in batches which each use a single transaction,
+    and update the state of the removed queries in redis. Any Table records which point to the
+    removed tables are also removed.
+
+    Queries which cannot be reset (for example because they are being reset elsewhere) are skipped.
+
+    Parameters
+    ----------
+    connection : "Connection"
+    redis : StrictRedis
+    records : list of CacheRecord
+        Records to remove
+    batch_size : int, default 100
+        Maximum number of records to remove in each transaction
+
+    Returns
+    -------
+    list of CacheRecord
+        The records which were removed
+    """
+    evicted = []
+    for batch_start in range(0, len(records), batch_size):
+        batch = []
+        for record in records[batch_start : batch_start + batch_size]:
+            q_state_machine = QueryStateMachine(redis, record.query_id)
+            previous_state = q_state_machine.current_query_state
+            current_state, this_thread_is_owner = q_state_machine.reset()
+            if this_thread_is_owner:
+                if previous_state not in (
+                    QueryState.CANCELLED,
+                    QueryState.ERRORED,
+                    QueryState.COMPLETED,
+                ):
+                    # Finished running between checking the state and resetting
+                    previous_state = QueryState.COMPLETED
+                batch.append((record, q_state_machine, previous_state))
+            else:
+                logger.debug(
+                    f"Not removing '{record.query_id}', which {current_state.description}."
+                )
+        if not batch:
+            continue
+        try:
+            with connection.engine.begin() as trans:
+                removed_query_ids = trans.execute(
+                    """DELETE FROM cache.cached WHERE query_id = ANY(%s)
+                    OR (class='Table' AND schema || '.' || tablename = ANY(%s))
+                    RETURNING query_id""",
+                    (
+                        [record.query_id for record, _, _ in batch],
+                        [record.fully_qualified_table_name for record, _, _ in batch],
+                    ),
+                ).fetchall()
+                for record, _, _ in batch:
+                    trans.execute(
+                        f"DROP TABLE IF EXISTS {record.fully_qualified_table_name}"
+                    )
+        except Exception:
+            # Nothing was removed, so put the queries back as they were
+            for record, q_state_machine, previous_state in batch:
+                q_state_machine.cancel_resetting(previous_state)
+            raise
+        for record, q_state_machine, _ in batch:
+            forget_result_sql(record.query_id)
+            connection.invalidate_table_metadata(
+                name=record.tablename, schema=record.schema
+            )
+            q_state_machine.finish_resetting()
+        batch_query_ids = {record.query_id for record, _, _ in batch}
+        for (query_id,) in removed_query_ids:
+            if query_id not in batch_query_ids:
+                # A Table pointing to one of the removed tables
+                q_state_machine = QueryStateMachine(redis, query_id)
+                q_state_machine.reset()
+                q_state_machine.finish_resetting()
+        evicted += [record for record, _, _ in batch]
+        logger.debug(
+            f"Removed {len(batch)} cache records.",
+            removed=[record.query_id for record, _, _ in batch],
+        )
+    return evicted
+
+
 def shrink_one(
     connection: "Connection",
     dry_run: bool = False,
     protected_period: Optional[int] = None,
-) -> "Query":
+    redis: Optional[StrictRedis] = None,
+) -> Tuple[CacheRecord, int]:
     """
     Remove the lowest scoring cached query from cache and return it and size of it
     in bytes.
@@ -417,26 +1043,30 @@ def shrink_one(
         Optionally specify a number of seconds within which cache entries are excluded. If None,
         the value stored in cache.cache_config will be used.Set to a negative number to ignore cache protection
         completely.
+    redis : StrictRedis, default None
+        Redis connection to update query states with. Defaults to the one flowmachine is connected to.
 
     Returns
     -------
-    tuple of "Query", int
-        The "Query" object that was removed from cache and the size of it
+    tuple of CacheRecord, int
+        The cache record that was removed and the size of it
     """
-    obj_to_remove, obj_size = get_cached_query_objects_ordered_by_score(
+    record_to_remove = get_cache_records_ordered_by_score(
         connection, protected_period=protected_period
     )[0]
 
     logger.info(
-        f"{'Would' if dry_run else 'Will'} remove cache record for {obj_to_remove.query_id} of type {obj_to_remove.__class__}"
+        f"{'Would' if dry_run else 'Will'} remove cache record for {record_to_remove.query_id} of type {record_to_remove.class_name}"
     )
     logger.info(
-        f"Table {obj_to_remove.fully_qualified_table_name} ({obj_size} bytes) {'would' if dry_run else 'will'} be removed."
+        f"Table {record_to_remove.fully_qualified_table_name} ({record_to_remove.table_size} bytes) {'would' if dry_run else 'will'} be removed."
     )
 
     if not dry_run:
-        obj_to_remove.invalidate_db_cache(cascade=False, drop=True)
-    return obj_to_remove, obj_size
+        evict_cache_records(
+            connection, _get_redis(redis), [record_to_remove],
+        )
+    return record_to_remove, record_to_remove.table_size
 
 
 def shrink_below_size(
@@ -444,7 +1074,9 @@ def shrink_below_size(
     size_threshold: int = None,
     dry_run: bool = False,
     protected_period: Optional[int] = None,
-) -> "Query":
+    redis: Optional[StrictRedis] = None,
+    batch_size: int = 100,
+) -> List[CacheRecord]:
     """
     Remove queries from the cache until it is below a specified size threshold.
 
@@ -459,16 +1091,19 @@ def shrink_below_size(
         Optionally specify a number of seconds within which cache entries are excluded. If None,
         the value stored in cache.cache_config will be used.Set to a negative number to ignore cache protection
         completely.
+    redis : StrictRedis, default None
+        Redis connection to update query states with. Defaults to the one flowmachine is connected to.
+    batch_size : int, default 100
+        Maximum number of cache records to remove in each transaction
 
     Returns
     -------
-    list of "Query"
-        List of the queries that were removed
+    list of CacheRecord
+        List of the cache records that were removed
     """
     initial_cache_size = get_size_of_cache(connection)
     if size_threshold is None:
         size_threshold = get_max_size_of_cache(connection)
-    removed = []
     logger.info(
         f"Shrinking cache from {initial_cache_size} to below {size_threshold}{' (dry run)' if dry_run else ''}.",
         initial_cache_size=initial_cache_size,
@@ -476,37 +1111,27 @@ def shrink_below_size(
         dry_run=dry_run,
     )
 
-    if dry_run:
-        cached_queries = iter(
-            get_cached_query_objects_ordered_by_score(
-                connection, protected_period=protected_period
-            )
+    removed = plan_cache_eviction(
+        connection, size_threshold=size_threshold, protected_period=protected_period
+    )
+    for record in removed:
+        logger.info(
+            f"{'Would' if dry_run else 'Will'} remove cache record for {record.query_id} of type {record.class_name}"
         )
-
-        def dry_run_shrink(connection, protected_period):
-            obj, obj_size = cached_queries.__next__()
-            logger.info(
-                f"Would remove cache record for {obj.query_id} of type {obj.__class__}"
-            )
-            logger.info(
-                f"Table {obj.fully_qualified_table_name} ({obj_size} bytes) would be removed."
-            )
-            return obj, obj_size
-
-        shrink = dry_run_shrink
-    else:
-        shrink = shrink_one
-
-    current_cache_size = initial_cache_size
-    while current_cache_size > size_threshold:
-        obj_removed, cache_reduction = shrink(
-            connection, protected_period=protected_period
+        logger.info(
+            f"Table {record.fully_qualified_table_name} ({record.table_size} bytes) {'would' if dry_run else 'will'} be removed."
         )
-        removed.append(obj_removed)
-        current_cache_size -= cache_reduction
+    if not dry_run:
+        removed = evict_cache_records(
+            connection, _get_redis(redis), removed, batch_size=batch_size
+        )
+
+    current_cache_size = initial_cache_size - sum(
+        record.table_size for record in removed
+    )
     logger.info(
         f"New cache size {'would' if dry_run else 'will'} be {current_cache_size}.",
-        removed=[q.query_id for q in removed],
+        removed=[record.query_id for record in removed],
         dry_run=dry_run,
         initial_cache_size=initial_cache_size,
         current_cache_size=current_cache_size,
@@ -515,6 +1140,17 @@ def shrink_below_size(
     return removed
 
 
+def _get_redis(redis: Optional[StrictRedis]) -> StrictRedis:
+    """
+    Return the given redis client, or the one flowmachine is connected to if it is None.
+    """
+    if redis is None:
+        from .query import Query
+
+        return Query.redis
+    return redis
+
+
 def get_size_of_table(
     connection: "Connection", table_name: str, table_schema: str
 ) -> int:
@@ -700,6 +1336,103 @@ def get_compute_time(connection: "Connection", query_id: str) -> float:
         raise ValueError(f"Query id '{query_id}' is not in cache on this connection.")
 
 
+def get_mean_compute_time_by_class(connection: "Connection") -> Dict[str, float]:
+    """
+    Get the mean time in seconds that cached queries of each class took to compute.
+
+    Parameters
+    ----------
+    connection : "Connection"
+
+    Returns
+    -------
+    dict
+        Mapping from query class name to mean compute time in seconds
+
+    """
+    return {
+        class_name: float(mean_compute_time) / 1000
+        for class_name, mean_compute_time in connection.fetch(
+            """SELECT class, avg(compute_time) FROM cache.cached
+            WHERE compute_time IS NOT NULL GROUP BY class"""
+        )
+    }
+
+
+class ClassReuseStatistics(NamedTuple):
+    """
+    Statistics about how often cached queries of one class have been reused
+    as dependencies of other queries.
+
+    Attributes
+    ----------
+    class_name : str
+        Name of the query class
+    intermediates : int
+        Number of cached queries of this class which other cached queries depend on
+    reused : int
+        Number of those which more than one cached query depends on
+    mean_access_count : float
+        Mean number of times those queries have been accessed
+    mean_compute_time : float
+        Mean time in seconds that those queries took to compute
+    """
+
+    class_name: str
+    intermediates: int
+    reused: int
+    mean_access_count: float
+    mean_compute_time: float
+
+    @property
+    def reuse_rate(self) -> float:
+        return self.reused / self.intermediates
+
+
+def get_class_reuse_statistics(
+    connection: "Connection",
+) -> Dict[str, ClassReuseStatistics]:
+    """
+    Get statistics about the reuse of cached queries of each class as dependencies
+    of other queries, from the cache's dependency records, access counts and compute times.
+
+    Parameters
+    ----------
+    connection : "Connection"
+
+    Returns
+    -------
+    dict
+        Mapping from query class name to reuse statistics for that class
+
+    Notes
+    -----
+    Only cached queries which at least one other cached query depends on are
+    included. A cached query is counted as reused if more than one cached query
+    depends on it. Access counts are not used for this, because a query is
+    accessed several times while each of its dependents is being stored.
+    """
+    flush_cache_touches(connection)
+    return {
+        class_name: ClassReuseStatistics(
+            class_name=class_name,
+            intermediates=int(intermediates),
+            reused=int(reused),
+            mean_access_count=float(mean_access_count),
+            mean_compute_time=float(mean_compute_time or 0) / 1000,
+        )
+        for class_name, intermediates, reused, mean_access_count, mean_compute_time in connection.fetch(
+            """SELECT class, count(*), count(*) FILTER (WHERE dependents > 1),
+                avg(access_count), avg(compute_time)
+            FROM cache.cached
+            JOIN (SELECT depends_on, count(*) AS dependents FROM cache.dependencies
+                  GROUP BY depends_on) AS dependents
+            ON query_id = depends_on
+            GROUP BY class"""
+        )
+    }
+
+
 def get_score(connection: "Connection", query_id: str) -> float:
     """
     Get the current cache score for a cached query.
@@ -716,6 +1449,7 @@ def get_score(connection: "Connection", query_id: str) -> float:
         Current cache score of this query
 
     """
+    flush_cache_touches(connection)
     try:
         return float(
             connection.fetch(
@@ -811,3 +1545,407 @@ async def watch_and_shrink_cache(
         if not loop:
             break
         await asyncio.sleep(sleep_time)
+
+
+class CacheAccess(NamedTuple):
+    """
+    A single access to a cached query, as recorded in a cache access trace.
+
+    Attributes
+    ----------
+    query_id : str
+        Unique id of the query accessed
+    timestamp : datetime.datetime
+        Time of the access
+    table_size : int
+        Size on disk in bytes of the query's cache table
+    compute_time : float
+        Time in seconds the query took to compute
+    """
+
+    query_id: str
+    timestamp: datetime.datetime
+    table_size: int
+    compute_time: float
+
+
+def read_cache_access_trace(log_lines: Iterable[str]) -> List[CacheAccess]:
+    """
+    Read a cache access trace from the JSON log lines written by the 'flowmachine.cache_trace'
+    logger. Lines which are not cache access records are ignored, so the output of
+    a FlowMachine server can be passed directly.
+
+    Parameters
+    ----------
+    log_lines : iterable of str
+        Lines of log output, e.g. an open log file
+
+    Returns
+    -------
+    list of CacheAccess
+
+    Examples
+    --------
+    Record a trace by enabling the cache trace logger, which writes to stdout:
+
+    >>> from flowmachine.core.logging import set_log_level
+    >>> set_log_level("flowmachine.cache_trace", "info")
+
+    then read it back from the captured output:
+
+    >>> with open("flowmachine.log") as fin:
+    ...     trace = read_cache_access_trace(fin)
+    """
+    trace = []
+    for line in log_lines:
+        try:
+            record = rapidjson.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or record.get("event") != "cache_access":
+            continue
+        trace.append(
+            CacheAccess(
+                query_id=record["query_id"],
+                timestamp=datetime.datetime.fromisoformat(
+                    record["timestamp"].replace("Z", "+00:00")
+                ),
+                table_size=int(record["table_size"]),
+                compute_time=float(record["compute_time"]),
+            )
+        )
+    return trace
+
+
+class CacheEvictionPolicy(metaclass=ABCMeta):
+    """
+    Base class for cache eviction policies, which decide which cached query should be
+    removed next. Policies are told about every query added to the cache and every
+    subsequent access to it, and must be able to name a victim at any time.
+    """
+
+    name = None
+
+    @abstractmethod
+    def add(self, access: CacheAccess) -> None:
+        """
+        Record that a query has been added to the cache.
+
+        Parameters
+        ----------
+        access : CacheAccess
+            The access which caused the query to be cached
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def touch(self, access: CacheAccess) -> None:
+        """
+        Record an access to a query which is already cached.
+
+        Parameters
+        ----------
+        access : CacheAccess
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def pop_victim(self) -> str:
+        """
+        Choose the next query to evict, and stop tracking it.
+
+        Returns
+        -------
+        str
+            Query id of the query to evict
+        """
+        raise NotImplementedError
+
+
+class _PriorityEvictionPolicy(CacheEvictionPolicy):
+    """
+    Base class for policies which evict the query with the lowest priority, where
+    priorities only change when queries are accessed.
+    """
+
+    def __init__(self):
+        self._priorities = {}
+        self._heap = []
+
+    def _set_priority(self, query_id: str, priority: Tuple) -> None:
+        self._priorities[query_id] = priority
+        heapq.heappush(self._heap, (priority, query_id))
+
+    def pop_victim(self) -> str:
+        while True:
+            priority, query_id = heapq.heappop(self._heap)
+            if self._priorities.get(query_id) == priority:
+                del self._priorities[query_id]
+                self._evicted(query_id, priority)
+                return query_id
+
+    def _evicted(self, query_id: str, priority: Tuple) -> None:
+        pass
+
+
+class LRUPolicy(_PriorityEvictionPolicy):
+    """
+    Evict the least recently used query.
+    """
+
+    name = "lru"
+
+    def __init__(self):
+        super().__init__()
+        self._clock = 0
+
+    def add(self, access: CacheAccess) -> None:
+        self.touch(access)
+
+    def touch(self, access: CacheAccess) -> None:
+        self._clock += 1
+        self._set_priority(access.query_id, (self._clock,))
+
+
+class LFUPolicy(_PriorityEvictionPolicy):
+    """
+    Evict the least frequently used query, breaking ties by least recent use.
+    """
+
+    name = "lfu"
+
+    def __init__(self):
+        super().__init__()
+        self._clock = 0
+        self._counts = {}
+
+    def add(self, access: CacheAccess) -> None:
+        self._counts[access.query_id] = 0
+        self.touch(access)
+
+    def touch(self, access: CacheAccess) -> None:
+        self._clock += 1
+        self._counts[access.query_id] += 1
+        self._set_priority(
+            access.query_id, (self._counts[access.query_id], self._clock)
+        )
+
+    def _evicted(self, query_id: str, priority: Tuple) -> None:
+        del self._counts[query_id]
+
+
+class GreedyDualSizeFrequencyPolicy(_PriorityEvictionPolicy):
+    """
+    GreedyDual-Size-Frequency: evict the query with the lowest
+    `inflation + access_count * compute_time / table_size`, where the inflation value
+    is raised to the priority of each evicted query so that entries which are not accessed
+    age out.
+    """
+
+    name = "gdsf"
+
+    def __init__(self):
+        super().__init__()
+        self._inflation = 0.0
+        self._counts = {}
+
+    def add(self, access: CacheAccess) -> None:
+        self._counts[access.query_id] = 0
+        self.touch(access)
+
+    def touch(self, access: CacheAccess) -> None:
+        self._counts[access.query_id] += 1
+        self._set_priority(
+            access.query_id,
+            (
+                self._inflation
+                + self._counts[access.query_id]
+                * access.compute_time
+                / max(access.table_size, 1),
+            ),
+        )
+
+    def _evicted(self, query_id: str, priority: Tuple) -> None:
+        self._inflation = priority[0]
+        del self._counts[query_id]
+
+
+class CacheScorePolicy(_PriorityEvictionPolicy):
+    """
+    FlowDB's cache score: each access adds `(1 + ln(2) / half_life) ** n` to a query's
+    multiplier, where `n` counts all cache accesses so far, and the score is
+    `multiplier * compute_time / table_size`. This is the policy used by `shrink_below_size`.
+
+    Parameters
+    ----------
+    half_life : float, default 1000
+        Cache half-life, as set in cache.cache_config
+
+    Notes
+    -----
+    Scores are tracked as logarithms, so long traces don't overflow.
+    """
+
+    name = "cache_score"
+
+    def __init__(self, half_life: float = 1000.0):
+        super().__init__()
+        self._log_growth = math.log(1 + math.log(2) / half_life)
+        self._touches = 0
+        self._log_multipliers = {}
+
+    def add(self, access: CacheAccess) -> None:
+        self._log_multipliers[access.query_id] = -math.inf
+        self.touch(access)
+
+    def touch(self, access: CacheAccess) -> None:
+        # Adds (1 + ln(2) / half_life) ** touches to the multiplier, in log space
+        log_increment = self._touches * self._log_growth
+        self._touches += 1
+        log_multiplier = self._log_multipliers[access.query_id]
+        if log_multiplier > -math.inf:
+            log_multiplier = max(log_multiplier, log_increment) + math.log1p(
+                math.exp(-abs(log_multiplier - log_increment))
+            )
+        else:
+            log_multiplier = log_increment
+        self._log_multipliers[access.query_id] = log_multiplier
+        self._set_priority(
+            access.query_id,
+            (
+                log_multiplier
+                + _safe_log(access.compute_time)
+                - _safe_log(max(access.table_size, 1)),
+            ),
+        )
+
+    def _evicted(self, query_id: str, priority: Tuple) -> None:
+        del self._log_multipliers[query_id]
+
+
+def _safe_log(x: float) -> float:
+    return math.log(x) if x > 0 else -math.inf
+
+
+class CacheSimulationResult(NamedTuple):
+    """
+    Outcome of replaying a cache access trace against an eviction policy.
+
+    Attributes
+    ----------
+    policy : str
+        Name of the policy
+    hits : int
+        Number of accesses to queries which were in cache
+    misses : int
+        Number of accesses to queries which were not in cache
+    evictions : int
+        Number of queries evicted
+    compute_time_saved : float
+        Total compute time in seconds of the accesses which were hits
+    """
+
+    policy: str
+    hits: int
+    misses: int
+    evictions: int
+    compute_time_saved: float
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+def simulate_cache_policy(
+    policy: CacheEvictionPolicy, trace: Iterable[CacheAccess], cache_size: int
+) -> CacheSimulationResult:
+    """
+    Replay a cache access trace against a cache of limited size managed by an eviction policy.
+
+    Every access to a query which isn't in the simulated cache is counted as a miss and
+    adds the query to cache, evicting queries chosen by the policy until the cache fits
+    within `cache_size`. Queries larger than the whole cache are never cached.
+
+    Parameters
+    ----------
+    policy : CacheEvictionPolicy
+        Policy to simulate. Should not have been used for a previous simulation.
+    trace : iterable of CacheAccess
+        Cache accesses, in the order they happened
+    cache_size : int
+        Maximum size of the cache in bytes
+
+    Returns
+    -------
+    CacheSimulationResult
+    """
+    cached_sizes = {}
+    current_size = 0
+    hits, misses, evictions, compute_time_saved = 0, 0, 0, 0.0
+    for access in trace:
+        if access.query_id in cached_sizes:
+            hits += 1
+            compute_time_saved += access.compute_time
+            policy.touch(access)
+            continue
+        misses += 1
+        if access.table_size > cache_size:
+            continue
+        policy.add(access)
+        cached_sizes[access.query_id] = access.table_size
+        current_size += access.table_size
+        while current_size > cache_size:
+            current_size -= cached_sizes.pop(policy.pop_victim())
+            evictions += 1
+    return CacheSimulationResult(
+        policy=policy.name,
+        hits=hits,
+        misses=misses,
+        evictions=evictions,
+        compute_time_saved=compute_time_saved,
+    )
+
+
+def compare_cache_policies(
+    trace: Iterable[CacheAccess],
+    cache_size: int,
+    policies: Optional[List[CacheEvictionPolicy]] = None,
+) -> pd.DataFrame:
+    """
+    Replay the same cache access trace against several eviction policies.
+
+    Parameters
+    ----------
+    trace : iterable of CacheAccess
+        Cache accesses, in the order they happened
+    cache_size : int
+        Maximum size of the cache in bytes
+    policies : list of CacheEvictionPolicy, optional
+        Policies to compare. Defaults to LRU, LFU, GreedyDual-Size-Frequency, and
+        FlowDB's cache score with the default half-life.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per policy with the simulation results, best hit rate first
+    """
+    trace = list(trace)
+    if policies is None:
+        policies = [
+            LRUPolicy(),
+            LFUPolicy(),
+            GreedyDualSizeFrequencyPolicy(),
+            CacheScorePolicy(),
+        ]
+    results = [
+        simulate_cache_policy(policy, trace, cache_size=cache_size)
+        for policy in policies
+    ]
+    return (
+        pd.DataFrame(
+            [dict(result._asdict(), hit_rate=result.hit_rate) for result in results]
+        )
+        .sort_values("hit_rate", ascending=False)
+        .reset_index(drop=True)
+    )
@@ -9,10 +9,13 @@ regarding the database.
 """
 import os
 import datetime
+import select
+import threading
 import warnings
+import weakref
 from collections import defaultdict
 
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import sqlalchemy
 
@@ -23,8 +26,13 @@ from cachetools import cached, TTLCache
 
 from structlog import get_logger
 
+from flowmachine.core.sqlalchemy_utils import get_sqlalchemy_table_definition
+
 logger = get_logger(__name__)
 
+# Channel FlowETL notifies when etl.etl_records is updated
+ETL_RECORDS_NOTIFICATION_CHANNEL = "etl_records_updated"
+
 
 class Connection:
     """
@@ -40,6 +48,9 @@ class Connection:
         Number of connections to the db to use
     overflow : int, optional
         Number of connections to the db to open temporarily
+    metadata_cache_ttl : float, default 60
+        Number of seconds to remember table metadata (whether a table exists, its columns,
+        its SQLAlchemy definition, its comment and its checksum) for. Set to 0 to always look up metadata from the database.
 
     Notes
     -----
@@ -47,6 +58,11 @@ class Connection:
     and requests for more will time out rapidly. sqlalchemy will not immediately
     open `pool_size` connections, but will always keep that many open once they
     have been. You will, ordinarily be OK to ignore this setting.
+
+    Table metadata is forgotten immediately when flowmachine writes or drops a table
+    using this connection, so `metadata_cache_ttl` only limits how long changes made
+    elsewhere can go unnoticed. Whether tables in the cache schema exist is never remembered,
+    because they are routinely created and dropped by other flowmachine instances.
     """
 
     def __init__(
@@ -60,6 +76,7 @@ class Connection:
         pool_size: int = 5,
         overflow: int = 10,
         conn_str: Optional[str] = None,
+        metadata_cache_ttl: float = 60,
     ) -> None:
         if conn_str is None:
             if any(arg is None for arg in (port, user, password, host, database)):
@@ -94,6 +111,13 @@ class Connection:
             connect_args=connect_args,
         )
 
+        self._metadata_cache = TTLCache(maxsize=4096, ttl=metadata_cache_ttl)
+        self._metadata_cache_lock = threading.Lock()
+        self._available_dates_index = None
+        self._etl_records_watch_lock = threading.Lock()
+        self._etl_records_watch_started = False
+
+        self.pool_size = pool_size
         self.max_connections = pool_size + overflow
         if self.max_connections > os.cpu_count():
             warnings.warn(
@@ -138,6 +162,59 @@ class Connection:
                 rs = curs.fetchall()
         return rs
 
+    def _get_cached_metadata(self, key: tuple, lookup: Callable[[], Any]) -> Any:
+        """
+        Get table metadata from the metadata cache, or look it up and remember it.
+
+        Parameters
+        ----------
+        key : tuple
+            Key of the form (kind, schema, name)
+        lookup : Callable
+            Function to call to get the metadata from the database if it isn't
+            in the cache. Returning None means the result will not be cached.
+
+        Returns
+        -------
+        Any
+        """
+        with self._metadata_cache_lock:
+            try:
+                return self._metadata_cache[key]
+            except KeyError:
+                pass
+        value = lookup()
+        if value is not None and self._metadata_cache.ttl > 0:
+            with self._metadata_cache_lock:
+                self._metadata_cache[key] = value
+        return value
+
+    def invalidate_table_metadata(
+        self, name: Optional[str] = None, schema: Optional[str] = None
+    ) -> None:
+        """
+        Forget any cached metadata about a table, for example because it has
+        been created or dropped.
+
+        Parameters
+        ----------
+        name : str, optional
+            Name of the table. If not given, metadata about all tables in `schema` is forgotten.
+        schema : str, optional
+            Schema of the table. If neither `name` nor `schema` is given, all
+            cached table metadata is forgotten.
+        """
+        with self._metadata_cache_lock:
+            if name is None and schema is None:
+                self._metadata_cache.clear()
+                return
+            for key in list(self._metadata_cache.keys()):
+                _, key_schema, key_name = key
+                if (name is None or key_name == name) and (
+                    schema is None or key_schema in (schema, None)
+                ):
+                    self._metadata_cache.pop(key, None)
+
     def has_table(self, name: str, schema: Optional[str] = None) -> bool:
         """
         Check if a table exists in the database.
@@ -155,17 +232,130 @@ class Connection:
         bool
          true if the given table exists, otherwise false.
         """
-        exists_query = """
-        SELECT * FROM information_schema.tables 
-            WHERE table_name='{}'
-        """.format(
-            name
+
+        def lookup():
+            exists_query = """
+            SELECT * FROM information_schema.tables 
+                WHERE table_name='{}'
+            """.format(
+                name
+            )
+            if schema is not None:
+                exists_query = "{} AND table_schema='{}'".format(exists_query, schema)
+            exists_query = "SELECT EXISTS({})".format(exists_query)
+            with self.engine.begin():
+                return self.engine.execute(exists_query).fetchall()[0][0]
+
+        if schema in ("cache", None):
+            # Tables in the cache schema are created and dropped by other flowmachine
+            # instances, so whether they exist is always looked up.
+            return bool(lookup())
+        return bool(self._get_cached_metadata(("has_table", schema, name), lookup))
+
+    def get_columns(self, name: str, schema: str) -> List[str]:
+        """
+        Get the names of the columns of a table, in order.
+
+        Parameters
+        ----------
+        name : str
+            Name of the table
+        schema : str
+            Schema of the table
+
+        Returns
+        -------
+        list of str
+            Column names, which will be empty if the table doesn't exist
+        """
+
+        def lookup():
+            columns = [
+                column_name
+                for column_name, in self.fetch(
+                    f"""SELECT column_name from INFORMATION_SCHEMA.COLUMNS
+                    WHERE table_name = '{name}' AND table_schema='{schema}'
+                    ORDER BY ordinal_position"""
+                )
+            ]
+            return columns if len(columns) > 0 else None
+
+        return list(self._get_cached_metadata(("columns", schema, name), lookup) or [])
+
+    def get_sqlalchemy_table(self, fully_qualified_table_name: str) -> sqlalchemy.Table:
+        """
+        Get the SQLAlchemy definition of a table, reflected from the database.
+
+        Parameters
+        ----------
+        fully_qualified_table_name : str
+            Fully qualified table name, for example: "events.calls"
+
+        Returns
+        -------
+        sqlalchemy.Table
+        """
+        schema, _, name = fully_qualified_table_name.partition(".")
+        return self._get_cached_metadata(
+            ("sqlalchemy_table", schema, name),
+            lambda: get_sqlalchemy_table_definition(
+                fully_qualified_table_name, engine=self.engine
+            ),
         )
-        if schema is not None:
-            exists_query = "{} AND table_schema='{}'".format(exists_query, schema)
-        exists_query = "SELECT EXISTS({})".format(exists_query)
-        with self.engine.begin():
-            return self.engine.execute(exists_query).fetchall()[0][0]
+
+    def get_table_checksum(self, name: str, schema: str) -> str:
+        """
+        Get a checksum of the contents of a table, which changes if any row is
+        inserted, updated or deleted. This reads the whole table, so should only be
+        used for small tables (e.g. infrastructure tables).
+
+        Parameters
+        ----------
+        name : str
+            Name of the table
+        schema : str
+            Schema of the table
+
+        Returns
+        -------
+        str
+            md5 checksum of the table's rows
+        """
+
+        def lookup():
+            return self.fetch(
+                f"""SELECT coalesce(md5(string_agg(row_hash, ',' ORDER BY row_hash)), '')
+                FROM (SELECT md5(t::text) AS row_hash FROM {schema}.{name} AS t) _"""
+            )[0][0]
+
+        return self._get_cached_metadata(("checksum", schema, name), lookup)
+
+    def get_table_comment(self, name: str, schema: str) -> Optional[str]:
+        """
+        Get the comment on a table.
+
+        Parameters
+        ----------
+        name : str
+            Name of the table
+        schema : str
+            Schema of the table
+
+        Returns
+        -------
+        str or None
+            The comment, or None if the table has no comment or doesn't exist
+        """
+
+        def lookup():
+            comment = self.fetch(
+                f"""SELECT obj_description(c.oid, 'pg_class') FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relname = '{name}' AND n.nspname = '{schema}'"""
+            )
+            return comment[0][0] if len(comment) > 0 else None
+
+        return self._get_cached_metadata(("comment", schema, name), lookup)
 
     @property
     def available_dates(self) -> Dict[str, List[datetime.date]]:
@@ -175,8 +365,50 @@ class Connection:
         defaultdict of lists
             Dict with tables as keys, containing lists of dates which are present
 
+        Notes
+        -----
+        The dates are kept up to date by listening for notifications from FlowETL, so
+        no query is needed. If notifications can't be listened for, the dates are
+        refreshed from the database at most every two minutes.
+        """
+        index = self._available_dates_index
+        if index is None and not self._etl_records_watch_started:
+            self._start_watching_etl_records()
+            index = self._available_dates_index
+        if index is None:
+            return self._available_dates()
+        return index
+
+    def _start_watching_etl_records(self) -> None:
+        """
+        Listen for notifications that etl.etl_records has changed in a background
+        thread, and load the available dates. If listening isn't possible, the
+        available dates are left to the TTL cache.
         """
-        return self._available_dates()
+        with self._etl_records_watch_lock:
+            if self._etl_records_watch_started:
+                return
+            self._etl_records_watch_started = True
+            try:
+                listening_connection = self.engine.raw_connection()
+                listening_connection.detach()  # Not returned to the pool
+                pg_connection = listening_connection.connection
+                pg_connection.autocommit = True
+                with pg_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {ETL_RECORDS_NOTIFICATION_CHANNEL};")
+            except Exception as exc:
+                logger.info(
+                    f"Couldn't listen for ETL notifications, available dates will be refreshed periodically instead. Error was {exc}"
+                )
+                return
+            # Load after listening starts, so no updates can be missed
+            self._available_dates_index = self._fetch_available_dates()
+            threading.Thread(
+                target=_watch_etl_records,
+                args=(weakref.ref(self), pg_connection),
+                name="etl-records-watcher",
+                daemon=True,
+            ).start()
 
     @cached(
         TTLCache(256, 120)
@@ -189,6 +421,16 @@ class Connection:
         defaultdict of lists
             Dict with tables as keys, containing lists of dates which are present
 
+        """
+        return self._fetch_available_dates()
+
+    def _fetch_available_dates(self) -> Dict[str, List[datetime.date]]:
+        """
+        Returns
+        -------
+        defaultdict of lists
+            Dict with tables as keys, containing lists of dates which are present
+
         """
 
         return defaultdict(
@@ -270,3 +512,47 @@ class Connection:
         Close the connection
         """
         self.engine.close()
+
+
+def _watch_etl_records(
+    connection_ref: "weakref.ReferenceType[Connection]",
+    pg_connection: "psycopg2.extensions.connection",
+    poll_interval: float = 5,
+) -> None:
+    """
+    Reload a connection's available dates whenever FlowETL notifies that etl.etl_records
+    has been updated. Stops, and closes the listening connection, once the flowmachine
+    connection has been garbage collected or if listening fails.
+
+    Parameters
+    ----------
+    connection_ref : weakref to Connection
+        Connection to update the available dates of
+    pg_connection : psycopg2.extensions.connection
+        Database connection which is listening for notifications
+    poll_interval : float, default 5
+        Number of seconds to wait for notifications before checking the connection is still in use
+    """
+    try:
+        while connection_ref() is not None:
+            if select.select([pg_connection], [], [], poll_interval) == ([], [], []):
+                continue
+            pg_connection.poll()
+            if not pg_connection.notifies:
+                continue
+            updated = sorted({notify.payload for notify in pg_connection.notifies})
+            pg_connection.notifies.clear()
+            connection = connection_ref()
+            if connection is not None:
+                connection._available_dates_index = connection._fetch_available_dates()
+                logger.debug("Reloaded available dates.", updated_cdr_types=updated)
+            del connection
+    except Exception as exc:
+        logger.error(
+            f"Stopped listening for ETL notifications. Error was {type(exc).__name__}: {exc}"
+        )
+        connection = connection_ref()
+        if connection is not None:
+            connection._available_dates_index = None  # Fall back to the TTL cache
+    finally:
+        pg_connection.close()
@@ -0,0 +1,171 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Utilities for reading query results into pandas using postgres' COPY,
+which avoids creating python objects for each row.
+"""
+
+import io
+import threading
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from cachetools import LRUCache
+from sqlalchemy.engine import Connection, Engine
+
+import structlog
+
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
+
+# Postgres type names, grouped by how they should be parsed from CSV
+_NUMERIC_TYPES = {"int2", "int4", "int8", "float4", "float8", "numeric", "oid"}
+_TEXT_TYPES = {"text", "varchar", "bpchar", "name", "char", "geometry", "geography"}
+_TYPES_SUPPORTED_BY_COPY = (
+    _NUMERIC_TYPES | _TEXT_TYPES | {"bool", "date", "timestamp", "timestamptz"}
+)
+
+# Column names and types of query results, by database and SQL, so that
+# reading the same result again doesn't need to describe the query first
+_column_types_cache = LRUCache(maxsize=1024)
+_column_types_cache_lock = threading.Lock()
+
+
+def _get_column_names_and_types(
+    sql: str, connection: Connection
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Get the names of the columns returned by a query, and their postgres types,
+    without running it. The result is remembered, so only the first call for a
+    given query needs to ask the database.
+
+    Parameters
+    ----------
+    sql : str
+        SQL query
+    connection : Connection
+        SQLAlchemy connection to use
+
+    Returns
+    -------
+    list of tuple
+        Column name and type name pairs, in column order
+    """
+    key = (str(connection.engine.url), sql)
+    with _column_types_cache_lock:
+        columns = _column_types_cache.get(key)
+    if columns is not None:
+        return columns
+    description = connection.execute(
+        f"SELECT * FROM ({sql}) _ LIMIT 0"
+    ).cursor.description
+    type_names = dict(
+        connection.execute(
+            "SELECT oid, typname FROM pg_type WHERE oid = ANY(%s)",
+            ([column.type_code for column in description],),
+        ).fetchall()
+    )
+    columns = [
+        (column.name, type_names.get(column.type_code)) for column in description
+    ]
+    with _column_types_cache_lock:
+        _column_types_cache[key] = columns
+    return columns
+
+
+def _quote_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def read_sql_via_copy(sql: str, engine: Engine) -> Optional[pd.DataFrame]:
+    """
+    Read the result of a query into a dataframe by streaming it from postgres
+    as CSV using `COPY ... TO STDOUT`, and parsing it in bulk.
+
+    The result has the same dtypes and values as `pandas.read_sql_query`. Text and
+    geometry columns (as hex-encoded WKB) become object columns with None for nulls,
+    numeric columns become floats or integers, dates become `datetime.date` objects,
+    and timestamps become datetimes. Timestamps with time zone are read in the
+    connection's time zone, and converted to UTC if they all have the same offset
+    from UTC, as `read_sql_query` does.
+
+    Parameters
+    ----------
+    sql : str
+        SQL query
+    engine : Engine
+        SQLAlchemy engine to use
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        The query result, or None if the query has column types which can't be read from CSV
+        in the same way as `pandas.read_sql_query` (or duplicate column names), in
+        which case that should be used instead.
+    """
+    buffer = io.BytesIO()
+    with engine.connect() as con:
+        with con.begin():
+            columns = _get_column_names_and_types(sql, con)
+            column_names = [name for name, _ in columns]
+            unsupported_types = {
+                column_type
+                for _, column_type in columns
+                if column_type not in _TYPES_SUPPORTED_BY_COPY
+            }
+            if len(unsupported_types) > 0 or len(set(column_names)) < len(column_names):
+                logger.debug(
+                    "Can't read query result using COPY.",
+                    unsupported_types=sorted(str(t) for t in unsupported_types),
+                )
+                return None
+            # NULL is written as an empty field. Text values are prefixed with a
+            # character, so that no value (not even an empty string) can be
+            # mistaken for NULL, and other types can't be empty.
+            copied_columns = ", ".join(
+                f"CASE WHEN {_quote_identifier(name)} IS NOT NULL THEN concat('_', {_quote_identifier(name)}) END"
+                if column_type in _TEXT_TYPES
+                else _quote_identifier(name)
+                for name, column_type in columns
+            )
+            cursor = con.connection.cursor()
+            cursor.copy_expert(
+                f"COPY (SELECT {copied_columns} FROM ({sql}) _) TO STDOUT WITH (FORMAT CSV, HEADER)",
+                buffer,
+            )
+    buffer.seek(0)
+
+    # Numeric columns are parsed by pandas, everything else is read as strings and
+    # converted afterwards so that the result matches read_sql_query.
+    df = pd.read_csv(
+        buffer,
+        header=0,
+        names=column_names,
+        dtype={
+            name: float if column_type == "numeric" else object
+            for name, column_type in columns
+            if column_type not in _NUMERIC_TYPES or column_type == "numeric"
+        },
+        na_values=[""],
+        keep_default_na=False,
+        encoding="utf-8",
+    )
+    for name, column_type in columns:
+        if column_type in _TEXT_TYPES:
+            df[name] = df[name].str[1:]
+        elif column_type == "bool":
+            df[name] = df[name].map({"t": True, "f": False})
+        elif column_type == "date":
+            df[name] = pd.to_datetime(df[name]).dt.date
+        elif column_type == "timestamp":
+            df[name] = pd.to_datetime(df[name])
+        elif column_type == "timestamptz":
+            # COPY writes these in the connection's time zone, with their offsets.
+            # Like read_sql_query, only convert to UTC if there is one offset.
+            df[name] = pd.to_datetime(df[name])
+            if pd.api.types.is_datetime64tz_dtype(df[name]):
+                df[name] = df[name].dt.tz_convert("UTC")
+        if df[name].dtype == object:
+            df[name] = df[name].where(df[name].notna(), None)
+    return df
@@ -3,17 +3,31 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
+import heapq
+import threading
+from functools import partial
+
 import networkx as nx
 import sys
 import structlog
 from io import BytesIO
-from typing import Union, Tuple, Dict, Sequence, Callable, Any, Optional
-from concurrent.futures import wait
+from typing import Union, Tuple, Dict, Sequence, Callable, Any, Optional, List
+from concurrent.futures import Future, wait
+
+from flowmachine.core.cache import (
+    get_mean_compute_time_by_class,
+    write_query_to_cache,
+)
 from flowmachine.core.errors import UnstorableQueryError
+from flowmachine.core.materialisation_advisor import get_materialisation_advisor
 from flowmachine.core.query_state import QueryStateMachine
 
 logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
 
+# Minimum estimated cost of the repeated evaluations of a shared subquery
+# before it is worth materialising.
+COMMON_SUBEXPRESSION_MIN_COST = 100000.0
+
 
 def print_dependency_tree(
     query_obj: "Query",
@@ -124,8 +138,10 @@ def calculate_dependency_graph(query_obj: "Query", analyse: bool = False) -> nx.
     for visualisation in a Jupyter notebook.
 
     The dependency graph includes the estimated cost of the query in the 'cost' attribute,
-    the query object the node represents in the 'query_object' attribute, and with the analyse
-    parameter set to true, the actual running time of the query in the `runtime` attribute.
+    the query object the node represents in the 'query_object' attribute, the number of times
+    the query's SQL will be evaluated when running this query in the 'references' attribute,
+    and with the analyse parameter set to true, the actual running time of the query in the
+    `runtime` attribute.
 
     Parameters
     ----------
@@ -188,7 +204,153 @@ def calculate_dependency_graph(query_obj: "Query", analyse: bool = False) -> nx.
             attrs["style"] = "filled"
         return attrs
 
-    return _assemble_dependency_graph(dependencies=deps, attrs_func=get_node_attrs)
+    graph = _assemble_dependency_graph(dependencies=deps, attrs_func=get_node_attrs)
+    references = _count_references(
+        graph,
+        {f"x{query_obj.query_id}": 1},
+        # Stored queries are read from their cache table, so their dependencies are not evaluated
+        lambda node, count: 0 if graph.nodes[node]["stored"] else count,
+    )
+    nx.set_node_attributes(graph, references, "references")
+    return graph
+
+
+def _count_references(
+    dependency_graph: nx.DiGraph,
+    initial_references: Dict[str, int],
+    references_passed_on: Callable[[str, int], int],
+) -> Dict[str, int]:
+    """
+    Count the number of times the SQL of each query in a dependency graph
+    is evaluated, allowing for queries which are referenced by more than
+    one of the queries which depend on them.
+
+    Parameters
+    ----------
+    dependency_graph : networkx.DiGraph
+        Dependency graph of query objects
+    initial_references : dict
+        Mapping from query nodes to the number of times they are referenced
+        from outside the graph.
+    references_passed_on : function
+        Function taking a node and the number of times it is evaluated, and
+        returning the number of times each of its dependencies is evaluated
+        as part of it (e.g. 1 if the node is materialised first).
+
+    Returns
+    -------
+    dict
+        Mapping from query nodes to number of references
+    """
+    references = {node: initial_references.get(node, 0) for node in dependency_graph}
+    # Edges point from a query to its dependencies, so a topological sort
+    # visits every dependent before the queries it depends on.
+    for node in nx.topological_sort(dependency_graph):
+        passed_on = references_passed_on(node, references[node])
+        for dependency in dependency_graph.successors(node):
+            references[dependency] += passed_on
+    return references
+
+
+def common_subexpressions(
+    query_obj: "Query", min_cost: float = COMMON_SUBEXPRESSION_MIN_COST
+) -> List["Query"]:
+    """
+    Find the unstored dependencies of a query which are referenced more than
+    once while running it, and which are expensive enough that calculating
+    them once up front is likely to be cheaper than evaluating them every time.
+
+    Parameters
+    ----------
+    query_obj : Query
+        Query object to find common subexpressions of.
+    min_cost : float, default COMMON_SUBEXPRESSION_MIN_COST
+        Minimum total estimated cost (in postgres planner units) of the repeated
+        evaluations of a dependency for it to be returned.
+
+    Returns
+    -------
+    list of Query
+        Dependencies worth materialising, ordered so that each query comes
+        after any of the others which it depends on.
+
+    Notes
+    -----
+    Where a query is materialised, the dependencies it references are only
+    evaluated once to produce it, so are only returned if they are also shared
+    by other unmaterialised queries.
+    """
+    dependencies_graph = unstored_dependencies_graph(query_obj)
+    shared = []
+
+    def references_passed_on(node: str, count: int) -> int:
+        if count > 1:
+            query = dependencies_graph.nodes[node]["query_object"]
+            cost = query.explain(format="json")[0]["Plan"]["Total Cost"]
+            if cost * (count - 1) >= min_cost:
+                logger.debug(
+                    f"Query '{query.query_id}' is referenced {count} times by '{query_obj.query_id}'.",
+                    cost=cost,
+                )
+                shared.append(query)
+                return 1
+        return count
+
+    _count_references(
+        dependencies_graph,
+        {
+            f"x{dep.query_id}": 1
+            for dep in query_obj.dependencies
+            if f"x{dep.query_id}" in dependencies_graph
+        },
+        references_passed_on,
+    )
+    return shared[::-1]
+
+
+def store_common_subexpressions(
+    query_obj: "Query", min_cost: float = COMMON_SUBEXPRESSION_MIN_COST
+) -> None:
+    """
+    Store the common subexpressions of a query (see `common_subexpressions`),
+    so that running the query reads each of them from the cache rather than
+    evaluating it several times.
+
+    Parameters
+    ----------
+    query_obj : Query
+        Query object whose common subexpressions will be stored.
+    min_cost : float, default COMMON_SUBEXPRESSION_MIN_COST
+        Minimum total estimated cost of the repeated evaluations of a
+        dependency for it to be stored.
+
+    Notes
+    -----
+    This is a blocking function, which will not return until the common
+    subexpressions are stored. They are stored in the calling thread, rather
+    than by submitting them to the thread pool, so that a worker storing a
+    query never waits for another task queued behind it.
+    """
+    from flowmachine.core.query import write_query
+
+    for query in common_subexpressions(query_obj, min_cost=min_cost):
+        try:
+            schema, name = query.fully_qualified_table_name.split(".")
+        except NotImplementedError:
+            continue  # Unstorable
+        logger.debug(
+            f"Storing common subexpression '{query.query_id}' of '{query_obj.query_id}'."
+        )
+        QueryStateMachine(query.redis, query.query_id).enqueue()
+        write_query_to_cache(
+            name=name,
+            schema=schema,
+            query=query,
+            connection=query.connection,
+            redis=query.redis,
+            ddl_ops_func=query._make_sql,
+            write_func=write_query,
+        )
 
 
 def unstored_dependencies_graph(query_obj: "Query") -> nx.DiGraph:
@@ -308,33 +470,270 @@ def plot_dependency_graph(
     return result
 
 
-def store_queries_in_order(dependency_graph: nx.DiGraph) -> Dict[str, "Future"]:
+def _estimate_store_costs(dependency_graph: nx.DiGraph) -> Dict[str, float]:
+    """
+    Estimate the time in seconds it will take to store each query in a dependency graph,
+    based on the mean compute time of cached queries of the same class.
+
+    Parameters
+    ----------
+    dependency_graph : networkx.DiGraph
+        Dependency graph of query objects
+
+    Returns
+    -------
+    dict
+        Mapping from query nodes to estimated cost. Queries of classes which have never
+        been cached are given the mean cost of all classes (or 1 if nothing has been cached).
+    """
+    if len(dependency_graph) == 0:
+        return {}
+    connection = next(iter(dependency_graph.nodes.values()))["query_object"].connection
+    mean_compute_times = get_mean_compute_time_by_class(connection)
+    default_cost = (
+        sum(mean_compute_times.values()) / len(mean_compute_times)
+        if mean_compute_times
+        else 1.0
+    )
+    return {
+        node: mean_compute_times.get(
+            attrs["query_object"].__class__.__name__, default_cost
+        )
+        for node, attrs in dependency_graph.nodes.items()
+    }
+
+
+def _critical_path_lengths(
+    dependency_graph: nx.DiGraph, costs: Dict[str, float]
+) -> Dict[str, float]:
+    """
+    Calculate, for each node in a dependency graph, the total cost of the most expensive
+    chain of queries from that node up to a query which nothing else depends on.
+
+    Parameters
+    ----------
+    dependency_graph : networkx.DiGraph
+        Dependency graph of query objects
+    costs : dict
+        Mapping from query nodes to estimated cost
+
+    Returns
+    -------
+    dict
+        Mapping from query nodes to critical path length
+    """
+    lengths = {}
+    # Edges point from a query to its dependencies, so a topological sort
+    # visits every dependent before the queries it depends on.
+    for node in nx.topological_sort(dependency_graph):
+        lengths[node] = costs[node] + max(
+            (lengths[dependent] for dependent in dependency_graph.predecessors(node)),
+            default=0,
+        )
+    return lengths
+
+
+class _DependencyGraphStoreScheduler:
+    """
+    Stores the queries in a dependency graph, dispatching each store only once all of
+    the query's dependencies have finished, and never running more than a fixed number
+    of stores at once. Where there is a choice, the query on the most expensive remaining
+    path is dispatched first.
+
+    Parameters
+    ----------
+    dependency_graph : networkx.DiGraph
+        Dependency graph of query objects to be stored
+    max_concurrent_stores : int
+        Maximum number of store operations to have running at once
+    """
+
+    def __init__(self, dependency_graph: nx.DiGraph, max_concurrent_stores: int):
+        self.dependency_graph = dependency_graph
+        self.max_concurrent_stores = max_concurrent_stores
+        self.priorities = _critical_path_lengths(
+            dependency_graph, _estimate_store_costs(dependency_graph)
+        )
+        self.futures = {node: Future() for node in dependency_graph}
+        self.remaining_dependencies = {
+            node: set(dependency_graph.successors(node)) for node in dependency_graph
+        }
+        self.ready = []
+        for node, dependencies in self.remaining_dependencies.items():
+            if not dependencies:
+                heapq.heappush(self.ready, (-self.priorities[node], node))
+        self.running = 0
+        self.failed = set()
+        self._lock = threading.RLock()
+        self._dispatching = False
+
+    def start(self) -> Dict[str, Future]:
+        """
+        Begin storing the queries.
+
+        Returns
+        -------
+        dict
+            Mapping from query nodes to Future objects which complete when the corresponding
+            store does. For queries which cannot be stored, the Future's result is None.
+        """
+        with self._lock:
+            self._dispatch()
+        return self.futures
+
+    def _dispatch(self) -> None:
+        """
+        Dispatch as many ready queries as the concurrency limit allows. Must be called
+        with the lock held.
+        """
+        if self._dispatching:
+            # A store which completed immediately; the outer loop will pick up its dependents
+            return
+        self._dispatching = True
+        try:
+            while self.ready and self.running < self.max_concurrent_stores:
+                _, node = heapq.heappop(self.ready)
+                query_obj = self.dependency_graph.nodes[node]["query_object"]
+                try:
+                    store_future = query_obj.store()
+                except UnstorableQueryError:
+                    # Some queries cannot be stored
+                    self._mark_done(node)
+                    self.futures[node].set_result(None)
+                    continue
+                except Exception as exc:
+                    for failed in self._mark_failed(node):
+                        self.futures[failed].set_exception(exc)
+                    continue
+                self.running += 1
+                store_future.add_done_callback(partial(self._store_done, node))
+        finally:
+            self._dispatching = False
+
+    def _store_done(self, node: str, store_future: Future) -> None:
+        """
+        Callback for a finished store, which releases its dependents and dispatches more work.
+        If the store failed, its dependents are never stored, and fail with the same exception.
+        """
+        exc = store_future.exception()
+        with self._lock:
+            self.running -= 1
+            if exc is None:
+                self._mark_done(node)
+                failed = []
+            else:
+                failed = self._mark_failed(node)
+            self._dispatch()
+        if exc is None:
+            self.futures[node].set_result(store_future.result())
+        else:
+            for failed_node in failed:
+                self.futures[failed_node].set_exception(exc)
+
+    def _mark_done(self, node: str) -> None:
+        """
+        Record that a query has been dealt with, and queue up any dependents which are now ready.
+        """
+        logger.debug(f"Finished storing '{node}'.")
+        for dependent in self.dependency_graph.predecessors(node):
+            self.remaining_dependencies[dependent].discard(node)
+            if (
+                not self.remaining_dependencies[dependent]
+                and dependent not in self.failed
+            ):
+                heapq.heappush(self.ready, (-self.priorities[dependent], dependent))
+
+    def _mark_failed(self, node: str) -> List[str]:
+        """
+        Record that a query failed to store, so neither it nor anything which depends on
+        it will be dispatched.
+
+        Returns
+        -------
+        list of str
+            The failed query and all of its not yet failed dependents, whose futures should be failed
+        """
+        logger.debug(f"Failed to store '{node}'.")
+        failed = [node] + [
+            dependent
+            for dependent in nx.ancestors(self.dependency_graph, node)
+            if dependent not in self.failed
+        ]
+        self.failed.update(failed)
+        return failed
+
+
+def store_queries_in_order(
+    dependency_graph: nx.DiGraph, max_concurrent_stores: Optional[int] = None
+) -> Dict[str, "Future"]:
     """
     Execute queries in an order that ensures each query store is triggered after its dependencies.
 
+    Each query's store is only started once all of its dependencies have finished storing, so
+    no threads are tied up waiting on dependencies. Queries on the most expensive path through
+    the graph (estimated from the compute times of previously cached queries) are started first.
+
     Parameters
     ----------
     dependency_graph : networkx.DiGraph
         Dependency graph of query objects to be stored
-    
+    max_concurrent_stores : int, optional
+        Maximum number of queries to store at once. Defaults to one less than the
+        connection pool size of the queries' FlowDB connection, so that stores can't
+        use every pooled connection.
+
     Returns
     -------
     dict
-        Mapping from query nodes to Future objects representing the store tasks
+        Mapping from query nodes to Future objects representing the store tasks. If a
+        query fails to store, the queries which depend on it are not stored and their
+        futures fail with the same exception.
     """
-    ordered_list_of_queries = list(nx.topological_sort(dependency_graph))[::-1]
-    logger.debug(f"Storing queries with IDs: {ordered_list_of_queries}")
-    store_futures = {}
-    for query in ordered_list_of_queries:
-        try:
-            store_futures[query] = dependency_graph.nodes[query]["query_object"].store()
-        except UnstorableQueryError:
-            # Some queries cannot be stored
-            pass
-    return store_futures
+    if len(dependency_graph) == 0:
+        return {}
+    if max_concurrent_stores is None:
+        max_concurrent_stores = max(
+            1,
+            next(iter(dependency_graph.nodes.values()))[
+                "query_object"
+            ].connection.pool_size
+            - 1,
+        )
+    if max_concurrent_stores < 1:
+        raise ValueError("max_concurrent_stores must be at least 1.")
+    logger.debug(
+        f"Storing queries with IDs: {list(dependency_graph)}",
+        max_concurrent_stores=max_concurrent_stores,
+    )
+    return _DependencyGraphStoreScheduler(
+        dependency_graph, max_concurrent_stores=max_concurrent_stores
+    ).start()
+
+
+def _restrict_dependency_graph(
+    dependency_graph: nx.DiGraph, nodes: Sequence[str]
+) -> nx.DiGraph:
+    """
+    Restrict a dependency graph to some of its nodes, keeping an edge between
+    any two of them where one depends on the other through nodes which were removed.
 
+    Parameters
+    ----------
+    dependency_graph : networkx.DiGraph
+        Dependency graph of query objects
+    nodes : list of str
+        Nodes to keep
 
-def store_all_unstored_dependencies(query_obj: "Query") -> None:
+    Returns
+    -------
+    networkx.DiGraph
+    """
+    return nx.transitive_closure_dag(dependency_graph).subgraph(nodes).copy()
+
+
+def store_all_unstored_dependencies(
+    query_obj: "Query", max_concurrent_stores: Optional[int] = None
+) -> None:
     """
     Store all of the unstored dependencies of a query.
 
@@ -342,18 +741,52 @@ def store_all_unstored_dependencies(query_obj: "Query") -> None:
     ----------
     query_obj : Query
         Query object whose dependencies will be stored.
+    max_concurrent_stores : int, optional
+        Maximum number of dependencies to store at once. Defaults to one less than
+        the connection pool size of the query's FlowDB connection.
     
     Notes
     -----
     This function stores only the unstored dependencies of a query, and not the
     query itself.
+    If a materialisation advisor has been set (see `set_materialisation_advisor`),
+    only those dependencies it advises storing are stored, along with any
+    common subexpressions of the query (see `common_subexpressions`).
     This is a blocking function. Storing the dependencies happens in background threads,
     but this function will not return until all the dependencies are stored.
     """
     logger.debug(
         f"Creating background threads to store dependencies of query '{query_obj.query_id}'."
     )
-    dependency_futures = store_queries_in_order(unstored_dependencies_graph(query_obj))
+    dependencies_graph = unstored_dependencies_graph(query_obj)
+    # Give queries a chance to store several of their dependencies at once, which
+    # may be cheaper than storing them individually.
+    precomputed = [
+        query._precompute_dependencies()
+        for query in [query_obj]
+        + [
+            dependencies_graph.nodes[node]["query_object"]
+            for node in dependencies_graph.nodes
+        ]
+    ]
+    if any(precomputed):
+        dependencies_graph = unstored_dependencies_graph(query_obj)
+    advisor = get_materialisation_advisor()
+    if advisor is not None:
+        # Whatever the advisor says, expensive dependencies which this query
+        # references more than once are worth storing.
+        shared = {f"x{query.query_id}" for query in common_subexpressions(query_obj)}
+        dependencies_graph = _restrict_dependency_graph(
+            dependencies_graph,
+            [
+                node
+                for node, query in dependencies_graph.nodes(data="query_object")
+                if node in shared or advisor.should_store(query)
+            ],
+        )
+    dependency_futures = store_queries_in_order(
+        dependencies_graph, max_concurrent_stores=max_concurrent_stores
+    )
 
     logger.debug(f"Waiting for dependencies to finish executing...")
     wait(list(dependency_futures.values()))
@@ -6,6 +6,8 @@ A dummy query class, primarily useful for testing.
 """
 
 import structlog
+from concurrent.futures import Future
+
 from .query import Query
 from .query_state import QueryStateMachine
 
@@ -41,7 +43,7 @@ class DummyQuery(Query):
         q_state_machine = QueryStateMachine(self.redis, self.query_id)
         return q_state_machine.is_completed
 
-    def store(self, store_dependencies=False):
+    def store(self, store_dependencies=False, *, store_shared_dependencies=False):
         logger.debug(
             "Storing dummy query by marking the query state as 'finished' (but without actually writing to the database)."
         )
@@ -49,6 +51,9 @@ class DummyQuery(Query):
         q_state_machine.enqueue()
         q_state_machine.execute()
         q_state_machine.finish()
+        store_future = Future()
+        store_future.set_result(self)
+        return store_future
 
     def explain(self, format="json", analyse=False):
         """
@@ -39,6 +39,14 @@ def init_logging():
     ch.setLevel(logging.INFO)
     query_run_log.addHandler(ch)
 
+    # Logger for cache accesses, used to record traces for cache policy simulation.
+    # Disabled unless its level is lowered to INFO.
+    cache_trace_log = logging.getLogger("flowmachine").getChild("cache_trace")
+    cache_trace_log.setLevel(logging.ERROR)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setLevel(logging.ERROR)
+    cache_trace_log.addHandler(ch)
+
     structlog.configure(
         processors=[
             structlog.stdlib.filter_by_level,
@@ -0,0 +1,147 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# -*- coding: utf-8 -*-
+"""
+Decides which of a query's dependencies are worth storing when it is run,
+based on how often cached queries of the same class have been reused.
+"""
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+import structlog
+
+from flowmachine.core.cache import ClassReuseStatistics, get_class_reuse_statistics
+
+if TYPE_CHECKING:
+    from .query import Query
+    from .connection import Connection
+
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
+
+# Advisor used when storing the dependencies of a query, if any
+_materialisation_advisor = None
+
+
+class MaterialisationAdvisor:
+    """
+    Advises whether to store a dependency of a query, based on the history of
+    cached queries of the same class. A dependency is worth storing if queries
+    of its class are usually reused by more than one query, and are expensive
+    enough that recomputing them would cost more than storing them.
+
+    Classes without enough history are always stored, so that the advisor can
+    learn about them. Because the history of classes which are no longer stored
+    shrinks as the cache is pruned, these are eventually tried again.
+
+    Parameters
+    ----------
+    min_reuse_rate : float, default 0.1
+        Minimum proportion of cached queries of a class which were reused for
+        queries of that class to be stored.
+    min_compute_time : float, default 1.0
+        Minimum mean compute time in seconds of cached queries of a class for
+        queries of that class to be stored.
+    min_observations : int, default 5
+        Minimum number of cached queries of a class needed to advise against
+        storing it.
+    refresh_interval : float, default 300
+        Number of seconds for which to reuse the statistics fetched from the cache.
+    """
+
+    def __init__(
+        self,
+        min_reuse_rate: float = 0.1,
+        min_compute_time: float = 1.0,
+        min_observations: int = 5,
+        refresh_interval: float = 300,
+    ):
+        self.min_reuse_rate = min_reuse_rate
+        self.min_compute_time = min_compute_time
+        self.min_observations = min_observations
+        self.refresh_interval = refresh_interval
+        self._statistics = {}
+        self._lock = threading.Lock()
+
+    def statistics(self, connection: "Connection") -> Dict[str, ClassReuseStatistics]:
+        """
+        Get the reuse statistics for each query class, fetching them from the
+        cache if they are more than `refresh_interval` seconds old.
+
+        Parameters
+        ----------
+        connection : Connection
+
+        Returns
+        -------
+        dict
+            Mapping from query class name to reuse statistics for that class
+        """
+        with self._lock:
+            fetched_at, statistics = self._statistics.get(connection, (None, None))
+            if (
+                fetched_at is None
+                or time.monotonic() - fetched_at > self.refresh_interval
+            ):
+                statistics = get_class_reuse_statistics(connection)
+                self._statistics[connection] = (time.monotonic(), statistics)
+            return statistics
+
+    def should_store(self, query_obj: "Query") -> bool:
+        """
+        Decide whether a dependency should be stored.
+
+        Parameters
+        ----------
+        query_obj : Query
+            Dependency to decide about
+
+        Returns
+        -------
+        bool
+            True if the query should be stored
+        """
+        class_name = query_obj.__class__.__name__
+        stats = self.statistics(query_obj.connection).get(class_name)
+        if stats is None or stats.intermediates < self.min_observations:
+            return True
+        store = (
+            stats.reuse_rate >= self.min_reuse_rate
+            and stats.mean_compute_time >= self.min_compute_time
+        )
+        if not store:
+            logger.debug(
+                f"Not storing '{query_obj.query_id}', because {class_name} queries are rarely reused or cheap.",
+                reuse_rate=stats.reuse_rate,
+                mean_compute_time=stats.mean_compute_time,
+            )
+        return store
+
+
+def set_materialisation_advisor(advisor: Optional[MaterialisationAdvisor]) -> None:
+    """
+    Set the advisor used to decide which dependencies to store when storing
+    the dependencies of a query in this process.
+
+    Parameters
+    ----------
+    advisor : MaterialisationAdvisor or None
+        Advisor to use, or None to store all dependencies.
+    """
+    global _materialisation_advisor
+    _materialisation_advisor = advisor
+
+
+def get_materialisation_advisor() -> Optional[MaterialisationAdvisor]:
+    """
+    Get the advisor used to decide which dependencies to store when storing
+    the dependencies of a query in this process.
+
+    Returns
+    -------
+    MaterialisationAdvisor or None
+        None if all dependencies are stored.
+    """
+    return _materialisation_advisor
@@ -145,6 +145,8 @@ class ModelResult(Query):
         name: str,
         schema: Union[str, None] = None,
         store_dependencies: bool = False,
+        *,
+        store_shared_dependencies: bool = False,
     ) -> Future:
         """
         Store the result of the calculation back into the database.
@@ -10,12 +10,13 @@ defines methods that returns the query as a string and as a pandas dataframe.
 """
 import rapidjson as json
 import pickle
+import uuid
 import weakref
 from concurrent.futures import Future
 
 
 import structlog
-from typing import List, Union
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
 
 import psycopg2
 import pandas as pd
@@ -25,7 +26,8 @@ from hashlib import md5
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import ResourceClosedError
 
-from flowmachine.core.cache import touch_cache
+from flowmachine.core.cache import queue_cache_touch, forget_result_sql
+from flowmachine.core.copy_utils import read_sql_via_copy
 from flowmachine.core.errors.flowmachine_errors import QueryResetFailedException
 from flowmachine.core.query_state import QueryStateMachine
 from abc import ABCMeta, abstractmethod
@@ -37,10 +39,13 @@ from flowmachine.core.errors import (
 )
 
 import flowmachine
-from flowmachine.utils import _sleep
-from flowmachine.core.dependency_graph import store_all_unstored_dependencies
+from flowmachine.utils import _sleep, get_page_sql
+from flowmachine.core.dependency_graph import (
+    store_all_unstored_dependencies,
+    store_common_subexpressions,
+)
 
-from flowmachine.core.cache import write_query_to_cache
+from flowmachine.core.cache import get_compute_time, write_query_to_cache
 
 logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
 
@@ -50,6 +55,98 @@ logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
 MAX_POSTGRES_NAME_LENGTH = 63
 
 
+def write_query(query_ddl_ops: List[str], connection: Engine) -> float:
+    """
+    Execute a list of DDL statements which write a query to cache, as
+    produced by `Query._make_sql`.
+
+    Parameters
+    ----------
+    query_ddl_ops : list of str
+        SQL statements to execute
+    connection : Engine
+        SQLAlchemy engine to execute them with
+
+    Returns
+    -------
+    float
+        Total execution time of the statements which returned query plans, in ms
+    """
+    plan_time = 0
+    ddl_op_results = []
+    for ddl_op in query_ddl_ops:
+        try:
+            ddl_op_result = connection.execute(ddl_op)
+        except Exception as e:
+            logger.error(f"Error executing SQL: '{ddl_op}'. Error was {e}")
+            raise e
+        try:
+            ddl_op_results.append(ddl_op_result.fetchall())
+        except ResourceClosedError:
+            pass  # Nothing to do here
+        for ddl_op_result in ddl_op_results:
+            try:
+                plan = ddl_op_result[0][0][0]  # Should be a query plan
+                plan_time += plan["Execution Time"]
+            except (IndexError, KeyError):
+                pass  # Not an explain result
+    logger.debug("Executed queries.")
+    return plan_time
+
+
+def write_derived_queries_to_cache(
+    source: "Query",
+    derived: List[Tuple["Query", str]],
+    *,
+    compute_time: Optional[float] = None,
+) -> None:
+    """
+    Store queries whose results can be selected from the result of another
+    query, instead of calculating each of them from scratch.
+
+    Parameters
+    ----------
+    source : Query
+        Query which the others are derived from
+    derived : list of tuple of (Query, str)
+        Queries to store, each with an SQL query which selects its result
+        from a table holding the result of `source`
+    compute_time : float, optional
+        Seconds taken to compute `source`. Defaults to the compute time recorded
+        when `source` was stored.
+
+    Notes
+    -----
+    This is a blocking function. The time taken to compute `source` is shared
+    equally between the derived queries in the cache metadata.
+    """
+    if compute_time is None:
+        compute_time = get_compute_time(source.connection, source.query_id)
+    compute_time_share = compute_time * 1000 / len(derived)
+
+    def write_func(query_ddl_ops: List[str], connection: Engine) -> float:
+        return write_query(query_ddl_ops, connection) + compute_time_share
+
+    for query, sql in derived:
+
+        def ddl_ops_func(name: str, schema: str, query=query, sql=sql) -> List[str]:
+            if query.connection.has_table(name, schema=schema):
+                logger.info("Table already exists")
+                return []
+            return query._make_create_table_sql(f"{schema}.{name}", sql)
+
+        QueryStateMachine(query.redis, query.query_id).enqueue()
+        write_query_to_cache(
+            name=query.table_name,
+            schema="cache",
+            query=query,
+            connection=query.connection,
+            redis=query.redis,
+            ddl_ops_func=ddl_ops_func,
+            write_func=write_func,
+        )
+
+
 class Query(metaclass=ABCMeta):
     """
     The core base class of the flowmachine module. This should handle
@@ -177,6 +274,68 @@ class Query(metaclass=ABCMeta):
         else:
             raise StopIteration
 
+    def iter_batches(self, batch_size: int = 10000) -> Iterator[List[Tuple]]:
+        """
+        Execute the query and iterate over the result in batches of rows, using a
+        server-side cursor so that only one batch at a time is held in memory.
+
+        Parameters
+        ----------
+        batch_size : int, default 10000
+            Maximum number of rows in each batch
+
+        Yields
+        ------
+        list of tuple
+            Rows of the result, with values in the same order as `column_names`
+
+        Notes
+        -----
+        A database connection is held open until iteration finishes or the iterator
+        is discarded.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        qur = f"SELECT {self.column_names_as_string_list} FROM ({self.get_query()}) _"
+        with self.connection.engine.connect() as con:
+            with con.begin():
+                # A named cursor is a server-side cursor, so rows are only
+                # sent when they are fetched.
+                with con.connection.cursor(
+                    name=f"flowmachine_{uuid.uuid4().hex}"
+                ) as cursor:
+                    cursor.itersize = batch_size
+                    cursor.execute(qur)
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if len(rows) == 0:
+                            break
+                        yield rows
+
+    def iter_dataframes(self, chunk_rows: int = 10000) -> Iterator[pd.DataFrame]:
+        """
+        Execute the query and iterate over the result as a sequence of dataframes,
+        using a server-side cursor so that only one chunk at a time is held in memory.
+
+        Parameters
+        ----------
+        chunk_rows : int, default 10000
+            Maximum number of rows in each dataframe
+
+        Yields
+        ------
+        pandas.DataFrame
+            A chunk of the result
+
+        See Also
+        --------
+        iter_batches
+        """
+        for rows in self.iter_batches(batch_size=chunk_rows):
+            yield pd.DataFrame.from_records(
+                rows, columns=self.column_names, coerce_float=True
+            )
+
     def __len__(self):
 
         try:
@@ -269,13 +428,7 @@ class Query(metaclass=ABCMeta):
             if state_machine.is_completed and self.connection.has_table(
                 schema=schema, name=name
             ):
-                try:
-                    touch_cache(self.connection, self.query_id)
-                except ValueError:
-                    pass  # Cache record not written yet, which can happen for Models
-                    # which will call through to this method from their `_make_query` method while writing metadata.
-                # In that scenario, the table _is_ written, but won't be visible from the connection touch_cache uses
-                # as the cache metadata transaction isn't complete!
+                queue_cache_touch(self.connection, self.query_id)
                 return "SELECT * FROM {}".format(table_name)
         except NotImplementedError:
             pass
@@ -298,20 +451,25 @@ class Query(metaclass=ABCMeta):
 
         """
 
+        def read_dataframe():
+            qur = (
+                f"SELECT {self.column_names_as_string_list} FROM ({self.get_query()}) _"
+            )
+            df = read_sql_via_copy(qur, self.connection.engine)
+            if df is None:  # Not all column types can be read using COPY
+                with self.connection.engine.begin():
+                    df = pd.read_sql_query(qur, con=self.connection.engine)
+            return df
+
         def do_get():
             if self._cache:
                 try:
                     return self._df.copy()
                 except AttributeError:
-                    qur = f"SELECT {self.column_names_as_string_list} FROM ({self.get_query()}) _"
-                    with self.connection.engine.begin():
-                        self._df = pd.read_sql_query(qur, con=self.connection.engine)
-
+                    self._df = read_dataframe()
                     return self._df.copy()
             else:
-                qur = f"SELECT {self.column_names_as_string_list} FROM ({self.get_query()}) _"
-                with self.connection.engine.begin():
-                    return pd.read_sql_query(qur, con=self.connection.engine)
+                return read_dataframe()
 
         df_future = self.thread_pool_executor.submit(do_get)
         return df_future
@@ -378,6 +536,95 @@ class Query(metaclass=ABCMeta):
                 df = pd.read_sql_query(Q, con=con)
                 return df
 
+    def get_page_query(
+        self,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Sequence[Tuple[str, str, str]]] = None,
+        order_by: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> str:
+        """
+        Get SQL which returns a page of the result of this query, optionally
+        restricted to some of its columns and to rows matching some filters.
+
+        If `order_by`, `limit` or `offset` is given, rows are ordered by the given
+        columns, followed by the columns of one of the indexes this query has when
+        stored and a unique tie-breaker, so that the order is the same every time
+        and, when the query is stored, pages can be read using the index.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to return. Defaults to all columns.
+        filters : list of (str, str, str), optional
+            Filters to apply, each a (column, operator, value) triple, where the
+            operator is one of 'eq', 'ne', 'lt', 'le', 'gt' and 'ge'. Values are
+            compared as literals of the column's type.
+        order_by : list of str, optional
+            Columns to order rows by. Prefix a column with '-' to sort it in
+            descending order.
+        limit : int, optional
+            Maximum number of rows to return. Defaults to all rows.
+        offset : int, default 0
+            Number of rows to skip before the start of the page.
+
+        Returns
+        -------
+        str
+            SQL string
+
+        Raises
+        ------
+        ValueError
+            If any of the columns or operators are not valid, or if the limit or
+            offset is negative.
+
+        Examples
+        --------
+        >>> daily_location("2016-01-01").get_page_query(
+        ...     columns=["subscriber"], filters=[("pcod", "eq", "524 3 08 44")], limit=10
+        ... )
+
+        See Also
+        --------
+        flowmachine.utils.get_page_sql
+        """
+        sql = self.get_query()
+        try:
+            table = self.fully_qualified_table_name
+        except NotImplementedError:
+            table = None
+        if sql != f"SELECT * FROM {table}":
+            table = None
+        return get_page_sql(
+            f"({sql})" if table is None else table,
+            column_names=self.column_names,
+            index_columns=self._page_index_columns,
+            unique_column=None if table is None else "ctid",
+            columns=columns,
+            filters=filters,
+            order_by=order_by,
+            limit=limit,
+            offset=offset,
+        )
+
+    @property
+    def _page_index_columns(self) -> List[str]:
+        """
+        Columns of the first of this query's indexes which only contains plain
+        columns, used to order pages of the result.
+        """
+        column_names = self.column_names
+        for ix in self.index_cols:
+            ix_columns = [
+                col.strip('"') for col in (ix if isinstance(ix, list) else [ix])
+            ]
+            if all(col in column_names for col in ix_columns):
+                return ix_columns
+        return []
+
     def get_table(self):
         """
         If this Query is stored, return a Table object referencing
@@ -524,15 +771,38 @@ class Query(metaclass=ABCMeta):
             full_name = "{}.{}".format(schema, name)
         else:
             full_name = name
-        queries = []
         # Deal with the table already existing potentially
         if self.connection.has_table(name, schema=schema):
             logger.info("Table already exists")
             return []
+        # Large subscriber subsets are read from their own table, which has to
+        # exist before this query's SQL is made.
+        from flowmachine.core.subscriber_subsetter import store_subset_tables
+
+        store_subset_tables(self)
+        return self._make_create_table_sql(full_name, self._make_query())
+
+    def _make_create_table_sql(self, full_name: str, sql: str) -> List[str]:
+        """
+        Create the SQL necessary to store the result of an SQL query, which
+        must produce the same result as this query, as this query's table.
 
-        Q = f"""EXPLAIN (ANALYZE TRUE, TIMING FALSE, FORMAT JSON) CREATE TABLE {full_name} AS 
-        (SELECT {self.column_names_as_string_list} FROM ({self._make_query()}) _)"""
-        queries.append(Q)
+        Parameters
+        ----------
+        full_name : str
+            Schema qualified name of the table to create
+        sql : str
+            SQL query whose result should be stored
+
+        Returns
+        -------
+        list
+            Ordered list of SQL strings to execute.
+        """
+        queries = [
+            f"""EXPLAIN (ANALYZE TRUE, TIMING FALSE, FORMAT JSON) CREATE TABLE {full_name} AS 
+        (SELECT {self.column_names_as_string_list} FROM ({sql}) _)"""
+        ]
         for ix in self.index_cols:
             queries.append(
                 "CREATE INDEX ON {tbl} ({ixen})".format(
@@ -546,6 +816,8 @@ class Query(metaclass=ABCMeta):
         name: str,
         schema: Union[str, None] = None,
         store_dependencies: bool = False,
+        *,
+        store_shared_dependencies: bool = False,
     ) -> Future:
         """
         Store the result of the calculation back into the database.
@@ -559,6 +831,11 @@ class Query(metaclass=ABCMeta):
             see postgres docs for more info.
         store_dependencies : bool, default False
             If True, store the dependencies of this query.
+        store_shared_dependencies : bool, default False
+            If True (and `store_dependencies` is False), first store those
+            dependencies which are expensive and referenced more than once
+            (see `flowmachine.core.dependency_graph.common_subexpressions`).
+            They are stored by the same worker thread which stores this query.
 
         Returns
         -------
@@ -577,36 +854,22 @@ class Query(metaclass=ABCMeta):
             ).format(name, len(name), MAX_POSTGRES_NAME_LENGTH)
             raise NameTooLongError(err_msg)
 
-        def write_query(query_ddl_ops: List[str], connection: Engine) -> float:
-            plan_time = 0
-            ddl_op_results = []
-            for ddl_op in query_ddl_ops:
-                try:
-                    ddl_op_result = connection.execute(ddl_op)
-                except Exception as e:
-                    logger.error(f"Error executing SQL: '{ddl_op}'. Error was {e}")
-                    raise e
-                try:
-                    ddl_op_results.append(ddl_op_result.fetchall())
-                except ResourceClosedError:
-                    pass  # Nothing to do here
-                for ddl_op_result in ddl_op_results:
-                    try:
-                        plan = ddl_op_result[0][0][0]  # Should be a query plan
-                        plan_time += plan["Execution Time"]
-                    except (IndexError, KeyError):
-                        pass  # Not an explain result
-            logger.debug("Executed queries.")
-            return plan_time
-
         if store_dependencies:
 
             def ddl_ops_func(name: str, schema: Union[str, None] = None) -> List[str]:
                 store_all_unstored_dependencies(self)
                 return self._make_sql(name, schema)
 
+        elif store_shared_dependencies:
+
+            def ddl_ops_func(name: str, schema: Union[str, None] = None) -> List[str]:
+                store_common_subexpressions(self)
+                return self._make_sql(name, schema)
+
         else:
-            ddl_ops_func = self._make_sql
+
+            def ddl_ops_func(name: str, schema: Union[str, None] = None) -> List[str]:
+                return self._make_sql(name, schema)
 
         current_state, changed_to_queue = QueryStateMachine(
             self.redis, self.query_id
@@ -704,7 +967,12 @@ class Query(metaclass=ABCMeta):
         except NotImplementedError:
             return False
 
-    def store(self, store_dependencies: bool = False) -> Future:
+    def store(
+        self,
+        store_dependencies: bool = False,
+        *,
+        store_shared_dependencies: bool = False,
+    ) -> Future:
         """
         Store the results of this computation with the correct table
         name using a background thread.
@@ -713,6 +981,9 @@ class Query(metaclass=ABCMeta):
         ----------
         store_dependencies : bool, default False
             If True, store the dependencies of this query.
+        store_shared_dependencies : bool, default False
+            If True (and `store_dependencies` is False), first store those
+            dependencies which are expensive and referenced more than once.
 
         Returns
         -------
@@ -729,10 +1000,30 @@ class Query(metaclass=ABCMeta):
         schema, name = table_name.split(".")
 
         store_future = self.to_sql(
-            name, schema=schema, store_dependencies=store_dependencies
+            name,
+            schema=schema,
+            store_dependencies=store_dependencies,
+            store_shared_dependencies=store_shared_dependencies,
         )
         return store_future
 
+    def _precompute_dependencies(self) -> bool:
+        """
+        Hook which is called before the unstored dependencies of a query
+        are stored one at a time, to allow queries which can compute several
+        of their dependencies more efficiently together to do so.
+
+        Returns
+        -------
+        bool
+            True if any dependencies were stored.
+
+        Notes
+        -----
+        This is a blocking method. The default implementation does nothing.
+        """
+        return False
+
     @property
     def dependencies(self):
         """
@@ -818,6 +1109,7 @@ class Query(metaclass=ABCMeta):
         q_state_machine = QueryStateMachine(self.redis, self.query_id)
         current_state, this_thread_is_owner = q_state_machine.reset()
         if this_thread_is_owner:
+            forget_result_sql(self.query_id)
             con = self.connection.engine
             try:
                 table_reference_to_this_query = self.get_table()
@@ -855,6 +1147,14 @@ class Query(metaclass=ABCMeta):
                                 self.fully_qualified_table_name
                             )
                         )
+                if drop:
+                    (
+                        dropped_schema,
+                        dropped_name,
+                    ) = self.fully_qualified_table_name.split(".")
+                    self.connection.invalidate_table_metadata(
+                        name=dropped_name, schema=dropped_schema
+                    )
 
                 if cascade:
                     for rec in deps:
@@ -877,6 +1177,8 @@ class Query(metaclass=ABCMeta):
             logger.debug("Dropping {}".format(full_name))
             with con.begin():
                 con.execute("DROP TABLE IF EXISTS {}".format(full_name))
+            if name is not None:
+                self.connection.invalidate_table_metadata(name=name, schema=schema)
             q_state_machine.finish_resetting()
         elif q_state_machine.is_resetting:
             logger.debug(
@@ -9,12 +9,14 @@ waiting for a query to finish running, and reporting status to the user.
 """
 
 import logging
+from contextlib import contextmanager
 from enum import Enum
 
-from finist import Finist
-from typing import Tuple
+from typing import Optional, Tuple
 
 from redis import StrictRedis
+from redis.client import PubSub
+from redis.exceptions import RedisError
 
 from flowmachine.utils import _sleep
 
@@ -66,6 +68,59 @@ class QueryEvent(str, Enum):
     QUEUE = "queue"
 
 
+# Maps each event to the state transitions it can trigger, as {current_state: next_state}
+_TRANSITIONS = {
+    QueryEvent.QUEUE: {QueryState.KNOWN: QueryState.QUEUED},
+    QueryEvent.EXECUTE: {QueryState.QUEUED: QueryState.EXECUTING},
+    QueryEvent.ERROR: {QueryState.EXECUTING: QueryState.ERRORED},
+    QueryEvent.FINISH: {QueryState.EXECUTING: QueryState.COMPLETED},
+    QueryEvent.CANCEL: {
+        QueryState.QUEUED: QueryState.CANCELLED,
+        QueryState.EXECUTING: QueryState.CANCELLED,
+    },
+    QueryEvent.RESET: {
+        QueryState.CANCELLED: QueryState.RESETTING,
+        QueryState.ERRORED: QueryState.RESETTING,
+        QueryState.COMPLETED: QueryState.RESETTING,
+    },
+    QueryEvent.FINISH_RESET: {QueryState.RESETTING: QueryState.KNOWN},
+}
+
+# Looks up and applies a transition atomically, publishing the new state if the
+# transition happens.
+# KEYS[1] is the state key, ARGV[1] the initial state, ARGV[2] the notification
+# channel, and the remaining ARGV are (current_state, next_state) pairs for the event.
+_TRANSITION_SCRIPT = """
+local curr = redis.call("GET", KEYS[1]) or ARGV[1]
+for i = 3, #ARGV, 2 do
+  if ARGV[i] == curr then
+    redis.call("SET", KEYS[1], ARGV[i + 1])
+    redis.call("PUBLISH", ARGV[2], ARGV[i + 1])
+    return { ARGV[i + 1], 1 }
+  end
+end
+return { curr, 0 }
+"""
+
+
+def _wait_for_state_change(subscription: Optional[PubSub], timeout: float) -> None:
+    """
+    Block until a state change notification arrives, or until `timeout` seconds
+    have passed. If no subscription is available, just sleeps for `timeout` seconds.
+
+    Parameters
+    ----------
+    subscription : PubSub or None
+        Subscription to a query's state change notification channel
+    timeout : float
+        Maximum number of seconds to wait
+    """
+    if subscription is None:
+        _sleep(timeout)
+    else:
+        subscription.get_message(timeout=timeout)
+
+
 class QueryStateMachine:
     """
     Implements a state machine for a query's lifecycle, backed by redis.
@@ -83,6 +138,11 @@ class QueryStateMachine:
     to use the results of the query should wait. The `wait_until_complete` method
     will block while the query is in any of these states.
 
+    Each transition is a single atomic call to a redis script, which looks up the
+    transition for the event and current state, applies it, and publishes the new
+    state on the channel given by `notification_channel` so that waiters are woken
+    as soon as the state changes rather than having to poll.
+
     The initial state for the query is 'known'.
 
     Parameters
@@ -95,47 +155,16 @@ class QueryStateMachine:
     Notes
     -----
     Creating a new instance of a state machine for a query will not alter the state, as
-    the state is persisted in redis.
+    the state is persisted in redis. Queries with no state recorded in redis are 'known'.
 
     """
 
     def __init__(self, redis_client: StrictRedis, query_id: str):
         self.redis_client = redis_client
         self.query_id = query_id
-        must_populate = redis_client.get(f"finist:{query_id}-state") is None
-        self.state_machine = Finist(redis_client, f"{query_id}-state", QueryState.KNOWN)
-        if must_populate:  # Need to create the state machine for this query
-            self.state_machine.on(QueryEvent.QUEUE, QueryState.KNOWN, QueryState.QUEUED)
-            self.state_machine.on(
-                QueryEvent.EXECUTE, QueryState.QUEUED, QueryState.EXECUTING
-            )
-            self.state_machine.on(
-                QueryEvent.ERROR, QueryState.EXECUTING, QueryState.ERRORED
-            )
-            self.state_machine.on(
-                QueryEvent.FINISH, QueryState.EXECUTING, QueryState.COMPLETED
-            )
-            self.state_machine.on(
-                QueryEvent.CANCEL, QueryState.QUEUED, QueryState.CANCELLED
-            )
-            self.state_machine.on(
-                QueryEvent.CANCEL, QueryState.EXECUTING, QueryState.CANCELLED
-            )
-            self.state_machine.on(
-                QueryEvent.RESET, QueryState.CANCELLED, QueryState.RESETTING
-            )
-            self.state_machine.on(
-                QueryEvent.RESET, QueryState.ERRORED, QueryState.RESETTING
-            )
-            self.state_machine.on(
-                QueryEvent.RESET, QueryState.COMPLETED, QueryState.RESETTING
-            )
-            self.state_machine.on(
-                QueryEvent.RESET, QueryState.COMPLETED, QueryState.RESETTING
-            )
-            self.state_machine.on(
-                QueryEvent.FINISH_RESET, QueryState.RESETTING, QueryState.KNOWN
-            )
+        self.state_key = f"finist:{query_id}-state"
+        self.notification_channel = f"finist:{query_id}-state-notifications"
+        self._transition_script = redis_client.register_script(_TRANSITION_SCRIPT)
 
     @property
     def current_query_state(self) -> QueryState:
@@ -146,7 +175,10 @@ class QueryStateMachine:
         QueryState
             Current state of the query this state machine refers to
         """
-        return QueryState(self.state_machine.state().decode())
+        state = self.redis_client.get(self.state_key)
+        if state is None:
+            return QueryState.KNOWN
+        return QueryState(state.decode())
 
     @property
     def is_executing(self) -> bool:
@@ -253,8 +285,41 @@ class QueryStateMachine:
             call caused a transition to that state
 
         """
-        state, trigger_success = self.state_machine.trigger(event)
-        return QueryState(state.decode()), trigger_success
+        transitions = [
+            state.value
+            for transition in _TRANSITIONS.get(event, {}).items()
+            for state in transition
+        ]
+        new_state, trigger_success = self._transition_script(
+            keys=[self.state_key],
+            args=[QueryState.KNOWN.value, self.notification_channel, *transitions],
+        )
+        return QueryState(new_state.decode()), bool(trigger_success)
+
+    @contextmanager
+    def _subscribe_to_state_changes(self):
+        """
+        Context manager which subscribes to state change notifications for this query.
+        Yields None if subscribing is not possible, in which case callers should fall
+        back to polling.
+
+        Yields
+        ------
+        PubSub or None
+        """
+        try:
+            subscription = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            subscription.subscribe(self.notification_channel)
+        except (AttributeError, RedisError) as exc:
+            logger.debug(
+                f"Unable to subscribe to state changes for '{self.query_id}', falling back to polling. Error was {exc}"
+            )
+            subscription = None
+        try:
+            yield subscription
+        finally:
+            if subscription is not None:
+                subscription.close()
 
     def cancel(self):
         """
@@ -347,14 +412,56 @@ class QueryStateMachine:
         """
         return self.trigger_event(QueryEvent.FINISH_RESET)
 
+    def cancel_resetting(self, previous_state: QueryState) -> Tuple[QueryState, bool]:
+        """
+        Attempt to return a query which is being reset to the state it was in before
+        the reset began, for use when the reset could not be carried out.
+
+        Parameters
+        ----------
+        previous_state : QueryState
+            State the query was in before it was reset
+
+        Returns
+        -------
+        tuple of QueryState, bool
+            Returns a tuple of the new query state, and a bool indicating whether the caller
+            returned the query to its previous state with this call.
+
+        """
+        new_state, trigger_success = self._transition_script(
+            keys=[self.state_key],
+            args=[
+                QueryState.KNOWN.value,
+                self.notification_channel,
+                QueryState.RESETTING.value,
+                previous_state.value,
+            ],
+        )
+        return QueryState(new_state.decode()), bool(trigger_success)
+
     def wait_until_complete(self, sleep_duration=1):
         """
         Blocks until the query is in a state where its result is determinate
         (i.e., one of "know", "errored", "completed", "cancelled").
 
+        Parameters
+        ----------
+        sleep_duration : int, default 1
+            Maximum number of seconds to wait for a state change notification before
+            checking the state again.
+
+        Notes
+        -----
+        Waiting is driven by the notifications published on `notification_channel`.
+        The state is re-checked at least every `sleep_duration` seconds, so a missed
+        notification only delays the wake-up rather than blocking forever.
+
         """
         if self.is_executing or self.is_queued or self.is_resetting:
-            while not (
-                self.is_finished_executing or self.is_cancelled or self.is_known
-            ):
-                _sleep(sleep_duration)
+            # Subscribe before re-checking the state so no transition can be missed
+            with self._subscribe_to_state_changes() as subscription:
+                while not (
+                    self.is_finished_executing or self.is_cancelled or self.is_known
+                ):
+                    _wait_for_state_change(subscription, sleep_duration)
@@ -17,12 +17,15 @@ import asyncio
 from functools import partial
 import json
 import textwrap
-from typing import Callable, Union
+from typing import Callable, List, Optional, Union
 
 from marshmallow import ValidationError
 
 from flowmachine.core import Query
-from flowmachine.core.cache import get_query_object_by_id
+from flowmachine.core.cache import (
+    get_result_page_sql,
+    get_result_sql_and_created,
+)
 from flowmachine.core.query_info_lookup import (
     QueryInfoLookup,
     UnkownQueryIdError,
@@ -232,13 +235,22 @@ async def action_handler__get_query_params(
 
 
 async def action_handler__get_sql(
-    config: "FlowmachineServerConfig", query_id: str
+    config: "FlowmachineServerConfig",
+    query_id: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[List[str]]] = None,
+    order_by: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
 ) -> ZMQReply:
     """
     Handler for the 'get_sql' action.
 
     Returns a SQL string which can be run against flowdb to obtain
-    the result of the query with given `query_id`.
+    the result of the query with given `query_id`, and the time the
+    result was added to the cache. If any of `columns`, `filters`,
+    `order_by`, `limit` or `offset` are given, the SQL returns only
+    that page of the result (see `flowmachine.utils.get_page_sql`).
     """
     # TODO: currently we can't use QueryStateMachine to determine whether
     # the query_id belongs to a valid query object, so we need to check it
@@ -253,9 +265,30 @@ async def action_handler__get_sql(
     query_state = QueryStateMachine(Query.redis, query_id).current_query_state
 
     if query_state == QueryState.COMPLETED:
-        q = get_query_object_by_id(Query.connection, query_id)
-        sql = q.get_query()
-        payload = {"query_id": query_id, "query_state": query_state, "sql": sql}
+        if any(param is not None for param in (columns, filters, order_by, limit)) or (
+            offset != 0
+        ):
+            try:
+                sql, created = get_result_page_sql(
+                    Query.connection,
+                    query_id,
+                    columns=columns,
+                    filters=filters,
+                    order_by=order_by,
+                    limit=limit,
+                    offset=offset,
+                )
+            except ValueError as exc:
+                payload = {"query_id": query_id, "query_state": query_state}
+                return ZMQReply(status="error", msg=str(exc), payload=payload)
+        else:
+            sql, created = get_result_sql_and_created(Query.connection, query_id)
+        payload = {
+            "query_id": query_id,
+            "query_state": query_state,
+            "sql": sql,
+            "created": created.isoformat(),
+        }
         return ZMQReply(status="success", payload=payload)
     else:
         msg = f"Query with id '{query_id}' {query_state.description}."
@@ -14,14 +14,19 @@ import signal
 import structlog
 import zmq
 from functools import partial
-from typing import NoReturn
+from typing import NoReturn, Sequence
 
 from marshmallow import ValidationError
 from zmq.asyncio import Context
 
 import flowmachine
 from flowmachine.core import Query, Connection
-from flowmachine.core.cache import watch_and_shrink_cache
+from flowmachine.core.cache import watch_and_shrink_cache, set_result_sql_cache_size
+from flowmachine.core.spatial_unit import watch_for_infrastructure_changes
+from flowmachine.core.materialisation_advisor import (
+    MaterialisationAdvisor,
+    set_materialisation_advisor,
+)
 from flowmachine.utils import convert_dict_keys_to_strings
 from .exceptions import FlowmachineServerError
 from .zmq_helpers import ZMQReply
@@ -111,9 +116,11 @@ async def receive_next_zmq_message_and_send_back_reply(
     Listen on the given zmq socket for the next multipart message, .
 
     Note that the only responsibility of this function is to ensure
-    that the incoming zmq message has the expected structure (three
-    parts of the form `return_address, empty_delimiter, msg`) and to
-    send back the reply. The responsibility for actually processing
+    that the incoming zmq message has the expected structure (at least
+    three parts of the form `return_address, [request_frames...], empty_delimiter, msg`)
+    and to send back the reply. Any frames between the return address and the
+    empty delimiter (e.g. the request id used by FlowAPI to match up replies)
+    are sent back with the reply. The responsibility for actually processing
     the message and calculating the reply lies with other functions.
 
     Parameters
@@ -131,14 +138,14 @@ async def receive_next_zmq_message_and_send_back_reply(
     # Check structural integrity of the zmq multipart message.
     # Ignore it if it doesn't have the expected structure.
     #
-    if len(multipart_msg) != 3:
+    if len(multipart_msg) < 3:
         logger.error(
-            "Multipart message did not contain the expected three parts. Ignoring this message "
+            "Multipart message did not contain at least the expected three parts. Ignoring this message "
             "as it cannot have come from FlowAPI and we cannot determine a return address."
         )
         return
 
-    return_address, empty_delimiter, msg_contents = multipart_msg
+    return_address, *request_frames, empty_delimiter, msg_contents = multipart_msg
 
     if empty_delimiter != b"":
         logger.error(
@@ -159,6 +166,7 @@ async def receive_next_zmq_message_and_send_back_reply(
             return_address=return_address,
             msg_contents=msg_contents,
             config=config,
+            request_frames=request_frames,
         )
     )
 
@@ -169,6 +177,7 @@ async def calculate_and_send_reply_for_message(
     return_address: bytes,
     msg_contents: str,
     config: "FlowmachineServerConfig",
+    request_frames: Sequence[bytes] = (),
 ) -> None:
     """
     Calculate the reply to a zmq message and return the result to the sender.
@@ -185,6 +194,9 @@ async def calculate_and_send_reply_for_message(
         JSON string with the message contents.
     config : FlowmachineServerConfig
         Server config options
+    request_frames : list of bytes, optional
+        Frames from the message's envelope to send back with the reply, so the
+        sender can identify which message it is a reply to.
     """
     try:
         reply_json = await get_reply_for_message(msg_str=msg_contents, config=config)
@@ -197,7 +209,7 @@ async def calculate_and_send_reply_for_message(
         )
         reply_json = ZMQReply(status="error", msg="Could not get reply for message")
     await socket.send_multipart(
-        [return_address, b"", rapidjson.dumps(reply_json).encode()]
+        [return_address, *request_frames, b"", rapidjson.dumps(reply_json).encode()]
     )
     logger.debug("Sent reply", reply=reply_json, msg=msg_contents)
 
@@ -250,6 +262,13 @@ async def recv(
             timeout=config.cache_pruning_timeout,
         )
     )
+    main_loop.create_task(
+        watch_for_infrastructure_changes(
+            flowdb_connection=flowdb_connection,
+            pool=Query.thread_pool_executor,
+            sleep_time=config.cache_pruning_frequency,
+        )
+    )
     try:
         while True:
             await receive_next_zmq_message_and_send_back_reply(
@@ -272,8 +291,12 @@ def main():
 
     if not config.store_dependencies:
         logger.info("Dependency caching is disabled.")
+    elif not config.store_all_dependencies:
+        logger.info("Only caching dependencies which are likely to be reused.")
+        set_materialisation_advisor(MaterialisationAdvisor())
     if config.debug_mode:
         logger.info("Enabling asyncio's debugging mode.")
+    set_result_sql_cache_size(config.result_sql_cache_size)
 
     # Run receive loop which receives zmq messages and sends back replies
     asyncio.run(
@@ -41,20 +41,27 @@ class FlowmachineServerConfig(NamedTuple):
         True to enable asyncio's debugging mode
     store_dependencies : bool
         If True, store a query's dependencies when running the query
+    store_all_dependencies : bool
+        If True, store every dependency of a query, rather than only those
+        which queries of the same class suggest will be reused
     cache_pruning_frequency : int
         Number of seconds to wait between cache shrinks (if negative, no shrinks will ever be done).
     cache_pruning_timeout : int
         Maximum number of seconds to wait for a cache pruning operation to complete.
     server_thread_pool : ThreadPoolExecutor
         Server's threadpool for managing blocking tasks
+    result_sql_cache_size : int
+        Maximum number of queries for which to remember the SQL to fetch results
     """
 
     port: int
     debug_mode: bool
     store_dependencies: bool
+    store_all_dependencies: bool
     cache_pruning_frequency: int
     cache_pruning_timeout: int
     server_thread_pool: ThreadPoolExecutor
+    result_sql_cache_size: int
 
 
 def get_server_config() -> FlowmachineServerConfig:
@@ -71,6 +78,9 @@ def get_server_config() -> FlowmachineServerConfig:
     store_dependencies = not get_env_as_bool(
         "FLOWMACHINE_SERVER_DISABLE_DEPENDENCY_CACHING"
     )
+    store_all_dependencies = get_env_as_bool(
+        "FLOWMACHINE_SERVER_STORE_ALL_DEPENDENCIES"
+    )
     cache_pruning_frequency = int(
         os.getenv("FLOWMACHINE_CACHE_PRUNING_FREQUENCY", 86400)
     )
@@ -80,12 +90,17 @@ def get_server_config() -> FlowmachineServerConfig:
         thread_pool_size = int(thread_pool_size)
     except (TypeError, ValueError):
         pass  # Not an int
+    result_sql_cache_size = int(
+        os.getenv("FLOWMACHINE_SERVER_RESULT_SQL_CACHE_SIZE", 1024)
+    )
 
     return FlowmachineServerConfig(
         port=port,
         debug_mode=debug_mode,
         store_dependencies=store_dependencies,
+        store_all_dependencies=store_all_dependencies,
         cache_pruning_frequency=cache_pruning_frequency,
         cache_pruning_timeout=cache_pruning_timeout,
         server_thread_pool=ThreadPoolExecutor(max_workers=thread_pool_size),
+        result_sql_cache_size=result_sql_cache_size,
     )
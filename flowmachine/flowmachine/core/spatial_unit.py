@@ -7,13 +7,22 @@ Classes that map cell (or tower or site) IDs to a spatial unit.
 
 The helper function 'make_spatial_unit' can be used to create spatial unit objects.
 """
+import asyncio
+from concurrent.futures import Executor
+from hashlib import md5
 from typing import Union, List, Iterable, Optional
 
+import structlog
+
 from flowmachine.utils import get_name_and_alias
 from flowmachine.core.errors import InvalidSpatialUnitError
 from . import Query, Table
+from .cache import get_query_object_by_id
+from .query_state import QueryStateMachine
 from .grid import Grid
 
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
+
 # TODO: Currently most spatial units require a FlowDB connection at init time.
 # It would be useful to remove this requirement wherever possible, and instead
 # implement a method to check whether the required data can be found in the DB.
@@ -247,6 +256,15 @@ class GeomSpatialUnit(SpatialUnitMixin, Query):
     location_table_join_on : str, optional
         Name of the column from connection.location_table to join on.
         Required if geom_table != connection.location_table.
+
+    Notes
+    -----
+    When stored, a spatial unit is a lookup table from location ID and service
+    dates to spatial unit, indexed by location ID, so that queries joined to it
+    need only an equality join instead of a spatial join. The stored table is
+    labelled with a checksum of the infrastructure and geography tables it was
+    built from. `invalidate_stale_spatial_units` removes it from cache (along with
+    any cached queries which depend on it) once those tables have changed.
     """
 
     def __init__(
@@ -302,6 +320,65 @@ class GeomSpatialUnit(SpatialUnitMixin, Query):
         # Must define this because we explicitly define self.__eq__
         return hash(self.query_id)
 
+    @property
+    def index_cols(self) -> List[List[str]]:
+        return [["location_id", "date_of_first_service", "date_of_last_service"]]
+
+    @property
+    def infrastructure_version(self) -> str:
+        """
+        Checksum of the contents of the infrastructure and geography tables this
+        spatial unit is built from, which changes when those tables change.
+        """
+        tables = {self.connection.location_table}
+        if isinstance(self.geom_table, Table) and self.geom_table.schema in (
+            "infrastructure",
+            "geography",
+        ):
+            tables.add(self.geom_table.fully_qualified_table_name)
+        checksums = []
+        for table in sorted(tables):
+            schema, name = table.split(".")
+            checksums.append(self.connection.get_table_checksum(name, schema))
+        return md5(",".join(checksums).encode()).hexdigest()
+
+    def _make_sql(self, name: str, schema: Union[str, None] = None) -> List[str]:
+        # Computed before the table is created, so that a concurrent change to the
+        # infrastructure tables can only cause an unnecessary rebuild.
+        infrastructure_version = self.infrastructure_version
+        queries = super()._make_sql(name, schema=schema)
+        if len(queries) > 0:
+            full_name = name if schema is None else f"{schema}.{name}"
+            queries.append(
+                f"COMMENT ON TABLE {full_name} IS '{infrastructure_version}'"
+            )
+        return queries
+
+    def invalidate_if_infrastructure_changed(self) -> bool:
+        """
+        Remove this spatial unit, and any queries which depend on it, from cache if
+        the infrastructure or geography tables have changed since it was stored.
+
+        Returns
+        -------
+        bool
+            True if the spatial unit was removed from cache
+        """
+        if not QueryStateMachine(self.redis, self.query_id).is_completed:
+            return False
+        schema, name = self.fully_qualified_table_name.split(".")
+        if not self.connection.has_table(name, schema=schema):
+            return False
+        stored_version = self.connection.get_table_comment(name, schema)
+        if stored_version == self.infrastructure_version:
+            return False
+        logger.info(
+            "Infrastructure tables have changed since spatial unit was stored. Removing from cache.",
+            query_id=self.query_id,
+        )
+        self.invalidate_db_cache(cascade=True)
+        return True
+
     def _get_aliased_geom_table_cols(self, table_alias: str) -> List[str]:
         return [f"{table_alias}.{c}" for c in self._geom_table_cols]
 
@@ -829,3 +906,89 @@ def make_spatial_unit(
         )
     else:
         raise ValueError(f"Unrecognised spatial unit type: {spatial_unit_type}.")
+
+
+def invalidate_stale_spatial_units(connection: "Connection") -> List[str]:
+    """
+    Remove every stored spatial unit whose infrastructure or geography tables have
+    changed since it was stored from cache, along with any cached queries which
+    depend on it. Checksumming the tables reads them in full, so this is run as
+    periodic maintenance rather than whenever a spatial unit is used.
+
+    Parameters
+    ----------
+    connection : Connection
+        FlowDB connection to check the cache of
+
+    Returns
+    -------
+    list of str
+        Query ids of the spatial units which were removed
+    """
+    class_names = []
+    subclasses = [GeomSpatialUnit]
+    while subclasses:
+        cls = subclasses.pop()
+        class_names.append(cls.__name__)
+        subclasses.extend(cls.__subclasses__())
+    query_ids = [
+        query_id
+        for query_id, in connection.fetch(
+            f"""SELECT query_id FROM cache.cached
+            WHERE class IN ({", ".join(f"'{name}'" for name in class_names)})"""
+        )
+    ]
+    # Don't compare against checksums remembered from before the tables changed
+    for schema in ("infrastructure", "geography"):
+        connection.invalidate_table_metadata(schema=schema)
+    invalidated = []
+    for query_id in query_ids:
+        try:
+            spatial_unit = get_query_object_by_id(connection, query_id)
+        except ValueError:
+            continue  # Already removed as a dependent of another spatial unit
+        if spatial_unit.invalidate_if_infrastructure_changed():
+            invalidated.append(query_id)
+    return invalidated
+
+
+async def watch_for_infrastructure_changes(
+    *,
+    flowdb_connection: "Connection",
+    pool: Executor,
+    sleep_time: int = 86400,
+    loop: bool = True,
+) -> None:
+    """
+    Background task to periodically remove stored spatial units built from
+    infrastructure or geography tables which have since changed.
+
+    Parameters
+    ----------
+    flowdb_connection : Connection
+        Flowdb connection to check the spatial units of
+    pool : Executor
+        Executor to run the check with
+    sleep_time : int, default 86400
+        Number of seconds to sleep for between checks
+    loop : bool, default True
+        Set to false to return after the first check
+
+    Returns
+    -------
+    None
+
+    """
+    while True:
+        logger.debug("Checking if stored spatial units are out of date.")
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                pool, invalidate_stale_spatial_units, flowdb_connection
+            )
+        except Exception as exc:
+            logger.error(
+                f"Failed to check stored spatial units. Error was {type(exc).__name__}: {exc}"
+            )
+        if not loop:
+            break
+        await asyncio.sleep(sleep_time)
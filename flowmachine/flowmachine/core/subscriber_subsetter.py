@@ -2,20 +2,33 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import csv
+import io
+import time
+
 import numpy as np
 import pandas as pd
+from concurrent.futures import Future
 from hashlib import md5
-from typing import List
+from typing import List, Optional, Union
 
 from abc import abstractmethod
+from sqlalchemy import Column, MetaData, Table, Text
 from sqlalchemy.sql import ClauseElement, select, text, column
+from .cache import queue_cache_touch, write_query_to_cache
 from .query import Query
+from .query_state import QueryStateMachine
+
+import structlog
+
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
 
 __all__ = [
     "make_subscriber_subsetter",
     "SubscriberSubsetterForAllSubscribers",
     "SubscriberSubsetterForExplicitSubset",
     "SubscriberSubsetterForFlowmachineQuery",
+    "SubscriberSubsetTable",
 ]
 
 
@@ -169,22 +182,202 @@ class SubscriberSubsetterForFlowmachineQuery(SubscriberSubsetterBase):
         return res
 
 
+class SubscriberSubsetTable(Query):
+    """
+    Table holding an explicit subset of subscribers, which is stored in the
+    cache like any other query. It is identified by a hash of the (deduplicated
+    and sorted) subscribers, and is written using COPY when stored.
+
+    Only the hash is pickled, so that the queries which use a large subset do
+    not carry the list of subscribers in their cache metadata. An unpickled subset
+    table can't be stored again once it has been removed from the cache.
+
+    Parameters
+    ----------
+    subscribers : list, tuple, numpy.ndarray or pandas.Series
+        Subscriber identifiers in the subset
+    """
+
+    def __init__(self, subscribers):
+        self._subscribers = sorted({str(subscriber) for subscriber in subscribers})
+        self.subscribers_hash = md5("\n".join(self._subscribers).encode()).hexdigest()
+        super().__init__()
+
+    @property
+    def column_names(self) -> List[str]:
+        return ["subscriber"]
+
+    @property
+    def subscribers(self) -> List[str]:
+        """
+        The subscribers in the subset. Not available for unpickled subset tables.
+        """
+        try:
+            return self._subscribers
+        except AttributeError:
+            raise ValueError(
+                f"The subscribers of subset '{self.query_id}' are not available."
+            )
+
+    def _make_query(self) -> str:
+        subscribers = ", ".join(
+            "'{}'".format(subscriber.replace("'", "''"))
+            for subscriber in self.subscribers
+        )
+        return f"SELECT unnest(ARRAY[{subscribers}]::text[]) AS subscriber"
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("_subscribers", None)
+        return state
+
+    def to_sql(
+        self,
+        name: str,
+        schema: Union[str, None] = None,
+        store_dependencies: bool = False,
+        *,
+        store_shared_dependencies: bool = False,
+    ) -> Future:
+        """
+        Store the subset in the database, using a background thread.
+
+        Parameters
+        ----------
+        name : str
+            name of the table
+        schema : str, default None
+            Name of an existing schema. If none will use the postgres default,
+            see postgres docs for more info.
+        store_dependencies, store_shared_dependencies : bool, default False
+            Ignored, because a subset table has no dependencies.
+
+        Returns
+        -------
+        Future
+            Future object, containing this query and any result information.
+        """
+        QueryStateMachine(self.redis, self.query_id).enqueue()
+        return self.thread_pool_executor.submit(self._write_to_cache, name, schema)
+
+    def _write_to_cache(self, name: str, schema: Union[str, None] = None) -> Query:
+        """
+        Blocking implementation of `to_sql`, which writes the subset in the
+        calling thread.
+        """
+        full_name = name if schema is None else f"{schema}.{name}"
+        QueryStateMachine(self.redis, self.query_id).enqueue()
+        return write_query_to_cache(
+            name=name,
+            schema=schema,
+            query=self,
+            connection=self.connection,
+            redis=self.redis,
+            ddl_ops_func=lambda name, schema: [],
+            write_func=lambda query_ddl_ops, engine: self._write_subset_table(
+                full_name, engine
+            ),
+        )
+
+    def _write_subset_table(self, full_name: str, engine) -> float:
+        """
+        Write the subscribers to a table using COPY.
+
+        Parameters
+        ----------
+        full_name : str
+            Schema qualified name of the table to write
+        engine : sqlalchemy.engine.Engine
+
+        Returns
+        -------
+        float
+            Time taken to write the table, in ms
+        """
+        start = time.perf_counter()
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([subscriber] for subscriber in self.subscribers)
+        buffer.seek(0)
+        with engine.connect() as con:
+            with con.begin():
+                cursor = con.connection.cursor()
+                cursor.execute(f"DROP TABLE IF EXISTS {full_name}")
+                cursor.execute(
+                    f"CREATE TABLE {full_name} (subscriber TEXT PRIMARY KEY)"
+                )
+                cursor.copy_expert(
+                    f"COPY {full_name} (subscriber) FROM STDIN WITH (FORMAT CSV)",
+                    buffer,
+                )
+                cursor.execute(f"ANALYZE {full_name}")
+        logger.debug(
+            "Stored subscriber subset.",
+            table=full_name,
+            n_subscribers=len(self.subscribers),
+        )
+        return (time.perf_counter() - start) * 1000
+
+
+def store_subset_tables(query_obj: Query) -> None:
+    """
+    Store any unstored subset tables which a query depends on, in the calling
+    thread, so that the query's SQL reads the subset from a table rather than
+    inlining the list of subscribers. This is called before a query is stored.
+
+    Parameters
+    ----------
+    query_obj : Query
+        Query which is about to be stored
+    """
+    from .dependency_graph import unstored_dependencies_graph
+
+    for _, query in unstored_dependencies_graph(query_obj).nodes(data="query_object"):
+        if isinstance(query, SubscriberSubsetTable):
+            schema, name = query.fully_qualified_table_name.split(".")
+            query._write_to_cache(name, schema)
+
+
 class SubscriberSubsetterForExplicitSubset(SubscriberSubsetterBase):
     """
     Represents a subset given by an explicit list of subscribers.
+
+    Small subsets are applied by inlining the list of subscribers in the query
+    (``subscriber IN (...)``). Subsets with more than `table_threshold` subscribers
+    are instead held in a `SubscriberSubsetTable`, which is a dependency of the
+    queries using the subset, and the query id is derived from a hash of the
+    subscribers. The table is stored before any query which uses it is stored,
+    and the query is then restricted to subscribers in that table. The list of
+    subscribers is not pickled with the queries which use a subset table.
+
+    Parameters
+    ----------
+    subscribers : list, tuple, numpy.ndarray or pandas.Series
+        Subscriber identifiers in the subset
+    use_table : bool, optional
+        Set to True to always use a subset table, or to False to always
+        inline the list of subscribers. By default, a table is used if there are
+        more than `table_threshold` subscribers.
     """
 
     is_proper_subset = True
+    table_threshold = 1000
 
-    def __init__(self, subscribers):
+    def __init__(self, subscribers, *, use_table: Optional[bool] = None):
         valid_input_types = (list, tuple, np.ndarray, pd.Series)
         if not isinstance(subscribers, valid_input_types):
             raise TypeError(
                 f"Invalid input type: {type(subscribers)}. Must be one of: {valid_input_types}"
             )
 
-        self.subscribers = subscribers
-        self._md5 = md5(str(self.subscribers).encode()).hexdigest()
+        if use_table is None:
+            use_table = len(subscribers) > self.table_threshold
+        self.use_table = use_table
+        if self.use_table:
+            self.subset_table = SubscriberSubsetTable(subscribers)
+            self._md5 = self.subset_table.subscribers_hash
+        else:
+            self.subscribers = subscribers
+            self._md5 = md5(str(self.subscribers).encode()).hexdigest()
         super().__init__()
 
     def apply_subset_if_needed(self, sql, *, subscriber_identifier):
@@ -206,7 +399,20 @@ class SubscriberSubsetterForExplicitSubset(SubscriberSubsetterBase):
         assert isinstance(sql, ClauseElement)
         assert len(sql.froms) == 1
         parent_table = sql.froms[0]
-        return sql.where(parent_table.c[subscriber_identifier].in_(self.subscribers))
+        if not self.use_table:
+            subscribers = self.subscribers
+        elif self.subset_table.is_stored:
+            queue_cache_touch(self.subset_table.connection, self.subset_table.query_id)
+            schema, name = self.subset_table.fully_qualified_table_name.split(".")
+            subset_table = Table(
+                name, MetaData(), Column("subscriber", Text), schema=schema
+            )
+            subscribers = select([subset_table.c.subscriber])
+        else:
+            # Not stored yet, which only happens when the query using the subset
+            # isn't being stored either.
+            subscribers = self.subset_table.subscribers
+        return sql.where(parent_table.c[subscriber_identifier].in_(subscribers))
 
 
 def make_subscriber_subsetter(subset):
@@ -86,14 +86,7 @@ class Table(Query):
             raise ValueError("{} is not a known table.".format(self.fqn))
 
         # Get actual columns of this table from the database
-        db_columns = list(
-            zip(
-                *self.connection.fetch(
-                    f"""SELECT column_name from INFORMATION_SCHEMA.COLUMNS
-             WHERE table_name = '{self.name}' AND table_schema='{self.schema}'"""
-                )
-            )
-        )[0]
+        db_columns = tuple(self.connection.get_columns(self.name, self.schema))
         if (
             columns is None or columns == []
         ):  # No columns specified, setting them from the database
@@ -34,6 +34,8 @@ subs = [
     "CallDays",
     "ModalLocation",
     "daily_location",
+    "precompute_daily_locations",
+    "store_daily_locations_batch",
     "DayTrajectories",
     "LocationVisits",
     "NewSubscribers",
@@ -57,6 +59,7 @@ subs = [
     "PairedPerLocationSubscriberCallDurations",
     "MostFrequentLocation",
     "LastLocation",
+    "PerDayLocations",
     "PeriodicEntropy",
     "LocationEntropy",
     "ContactEntropy",
@@ -95,6 +98,8 @@ spat = [
 ut = [
     "GroupValues",
     "feature_collection",
+    "FusedFeatureCollection",
+    "FusedSubscriberFeatures",
     "SubscriberLocations",
     "EventTableSubset",
     "UniqueSubscribers",
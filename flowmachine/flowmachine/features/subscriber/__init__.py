@@ -14,6 +14,10 @@ from .modal_location import ModalLocation
 from .first_location import FirstLocation
 from .entropy import PeriodicEntropy, LocationEntropy, ContactEntropy
 from .daily_location import daily_location
+from .daily_location_batch import (
+    precompute_daily_locations,
+    store_daily_locations_batch,
+)
 from .nocturnal_events import NocturnalEvents
 from .location_visits import LocationVisits
 from .day_trajectories import DayTrajectories
@@ -25,6 +29,7 @@ from .subscriber_degree import SubscriberDegree
 from .hartigan_cluster import HartiganCluster
 from .most_frequent_location import MostFrequentLocation
 from .last_location import LastLocation
+from .per_day_locations import PerDayLocations
 
 from .unique_location_counts import UniqueLocationCounts
 from .total_active_periods import TotalActivePeriodsSubscriber
@@ -0,0 +1,309 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# -*- coding: utf-8 -*-
+"""
+Stores many daily locations at once, sharing a single scan of the
+events for each day between all the spatial units and methods
+being calculated for that day.
+
+
+
+"""
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Dict, Iterable, List
+
+import structlog
+
+from flowmachine.core import CustomQuery, JoinToLocation, Query, location_joined_query
+from flowmachine.core.cache import write_cache_metadata
+from flowmachine.core.errors.flowmachine_errors import (
+    QueryCancelledException,
+    QueryErroredException,
+    StoreFailedException,
+)
+from flowmachine.core.query import write_query
+from flowmachine.core.query_state import QueryStateMachine
+from flowmachine.core.spatial_unit import AnySpatialUnit
+from flowmachine.core.subscriber_subsetter import (
+    make_subscriber_subsetter,
+    store_subset_tables,
+)
+from .daily_location import daily_location
+
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
+
+
+def precompute_daily_locations(
+    dates: Iterable[str],
+    spatial_units: Iterable[AnySpatialUnit],
+    methods: Iterable[str] = ("last", "most-common"),
+    *,
+    hours="all",
+    table="all",
+    subscriber_identifier="msisdn",
+    ignore_nulls=True,
+    subscriber_subset=None,
+) -> Future:
+    """
+    Store the daily location of subscribers for every combination of the
+    given dates, spatial units and methods, scanning the events for each
+    date only once.
+
+    Parameters
+    ----------
+    dates : list of str
+        iso format dates to calculate daily locations for, e.g. 2016-01-01
+    spatial_units : list of flowmachine.core.spatial_unit.*SpatialUnit
+        Spatial units to calculate daily locations at.
+    methods : list of str, default ('last', 'most-common')
+        Methods to calculate daily locations with.
+    hours : tuple of ints, default 'all'
+        Subset the result within certain hours, e.g. (4,17)
+        This will subset the query only with these hours, but
+        across all specified days. Or set to 'all' to include
+        all hours.
+    table : str, default 'all'
+        schema qualified name of the table which the analysis is
+        based upon. If 'all' it will use all tables that contain
+        location data, specified in flowmachine.yml.
+    subscriber_identifier : {'msisdn', 'imei'}, default 'msisdn'
+        Either msisdn, or imei, the column that identifies the subscriber.
+    ignore_nulls : bool, default True
+        ignores those values that are null.
+    subscriber_subset : str, list, flowmachine.core.Query, flowmachine.core.Table, default None
+        If provided, string or list of string which are msisdn or imeis to limit
+        results to; or, a query or table which has a column with a name matching
+        subscriber_identifier (typically, msisdn), to limit results to.
+
+    Returns
+    -------
+    Future
+        Future object which resolves to the list of daily location queries
+        once they are all stored.
+
+    See Also
+    --------
+    store_daily_locations_batch
+
+    Examples
+    --------
+    >>> dls = precompute_daily_locations(
+            ["2016-01-01", "2016-01-02"],
+            [make_spatial_unit("admin", level=2), make_spatial_unit("admin", level=3)],
+        ).result()
+    >>> daily_location("2016-01-02", method="most-common").is_stored
+    True
+    """
+    subscriber_subset = make_subscriber_subsetter(subscriber_subset)
+    return store_daily_locations_batch(
+        [
+            daily_location(
+                date,
+                spatial_unit=spatial_unit,
+                hours=hours,
+                method=method,
+                table=table,
+                subscriber_identifier=subscriber_identifier,
+                ignore_nulls=ignore_nulls,
+                subscriber_subset=subscriber_subset,
+            )
+            for date in dates
+            for spatial_unit in spatial_units
+            for method in methods
+        ]
+    )
+
+
+def store_daily_locations_batch(daily_locations: List[Query]) -> Future:
+    """
+    Store a list of daily locations (or other last or most frequent
+    locations), using a background thread. Daily locations which
+    use the same events are calculated together, from a single scan of
+    the events, and stored under their usual query ids.
+
+    Parameters
+    ----------
+    daily_locations : list of LastLocation or MostFrequentLocation
+        Daily location queries to store
+
+    Returns
+    -------
+    Future
+        Future object which resolves to the list of daily location queries
+        once they are all stored.
+    """
+    return Query.thread_pool_executor.submit(
+        _store_daily_locations_batch, daily_locations
+    )
+
+
+def _store_daily_locations_batch(daily_locations: List[Query]) -> List[Query]:
+    """
+    Blocking implementation of `store_daily_locations_batch`.
+    """
+    by_events = defaultdict(list)
+    for dl in daily_locations:
+        if not dl.is_stored:
+            by_events[_get_events(dl).query_id].append(dl)
+    for dls in by_events.values():
+        _store_sharing_events(dls)
+    return daily_locations
+
+
+def _get_events(dl: Query) -> Query:
+    """
+    Get the events a daily location is calculated from, before they
+    are joined to locations.
+    """
+    unioned = dl.subscriber_locs.unioned
+    if isinstance(unioned, JoinToLocation):
+        return unioned.left
+    return unioned
+
+
+def _store_sharing_events(dls: List[Query]) -> None:
+    """
+    Store daily locations which are all calculated from the same events,
+    using a single scan of the events. Any daily locations which are
+    already being stored elsewhere are waited for.
+
+    Raises
+    ------
+    QueryCancelledException
+        If storing any of the daily locations was cancelled
+    QueryErroredException
+        If storing any of the daily locations failed
+    StoreFailedException
+        If any of the daily locations was not stored for another reason
+
+    Parameters
+    ----------
+    dls : list of LastLocation or MostFrequentLocation
+        Daily locations which share the same events
+    """
+    connection = Query.connection
+    owned = []
+    for dl in dls:
+        q_state_machine = QueryStateMachine(Query.redis, dl.query_id)
+        q_state_machine.enqueue()
+        current_state, this_thread_is_owner = q_state_machine.execute()
+        if this_thread_is_owner:
+            owned.append((dl, q_state_machine))
+    if len(owned) > 0:
+        logger.debug(
+            f"Storing {len(owned)} daily locations from one scan of events.",
+            query_ids=[dl.query_id for dl, _ in owned],
+        )
+        try:
+            store_subset_tables(_get_events(owned[0][0]))
+            compute_times = _write_sharing_events([dl for dl, _ in owned])
+        except Exception as exc:
+            for _, q_state_machine in owned:
+                q_state_machine.raise_error()
+            logger.error(f"Error executing SQL. Error was {exc}")
+            raise exc
+        first_error = None
+        for dl, q_state_machine in owned:
+            try:
+                write_cache_metadata(
+                    connection, dl, compute_time=compute_times[dl.query_id]
+                )
+            except Exception as exc:
+                # Carry on, so that no daily location is left executing
+                q_state_machine.raise_error()
+                logger.error(f"Error writing cache metadata. Error was {exc}")
+                first_error = first_error or exc
+                continue
+            connection.invalidate_table_metadata(name=dl.table_name, schema="cache")
+            q_state_machine.finish()
+        if first_error is not None:
+            raise first_error
+    for dl in dls:
+        q_state_machine = QueryStateMachine(Query.redis, dl.query_id)
+        q_state_machine.wait_until_complete()
+        if q_state_machine.is_completed:
+            continue
+        elif q_state_machine.is_cancelled:
+            logger.error(f"Query '{dl.query_id}' was cancelled.")
+            raise QueryCancelledException(dl.query_id)
+        elif q_state_machine.is_errored:
+            logger.error(f"Query '{dl.query_id}' finished with an error.")
+            raise QueryErroredException(dl.query_id)
+        else:
+            logger.error(
+                f"Query '{dl.query_id}' not stored. State is {q_state_machine.current_query_state}"
+            )
+            raise StoreFailedException(dl.query_id)
+
+
+def _write_sharing_events(dls: List[Query]) -> Dict[str, float]:
+    """
+    Write the cache tables for daily locations calculated from the same
+    events, in one transaction. The events are read once into a temporary
+    table, which is joined to each spatial unit once, and the results
+    for each method are calculated from those.
+
+    Parameters
+    ----------
+    dls : list of LastLocation or MostFrequentLocation
+        Daily locations which share the same events
+
+    Returns
+    -------
+    dict
+        Time taken to compute each daily location, in ms, keyed by query id.
+        The time taken to read the events, and to join them to each spatial unit,
+        is shared out between the daily locations which use them.
+    """
+    events = _get_events(dls[0])
+    events_table = f"events_{events.query_id}"
+    by_subscriber_locs = defaultdict(list)
+    for dl in dls:
+        by_subscriber_locs[dl.subscriber_locs.query_id].append(dl)
+
+    compute_times = {}
+    with Query.connection.engine.begin() as trans:
+        events_time = write_query(
+            [
+                f"""EXPLAIN (ANALYZE TRUE, TIMING FALSE, FORMAT JSON) CREATE TEMPORARY TABLE {events_table}
+                ON COMMIT DROP AS ({events.get_query()})""",
+                f"ANALYZE {events_table}",
+            ],
+            trans,
+        )
+        for subscriber_locs_id, group in by_subscriber_locs.items():
+            subscriber_locs = group[0].subscriber_locs
+            located_events = location_joined_query(
+                CustomQuery(f"SELECT * FROM {events_table}", events.column_names),
+                spatial_unit=subscriber_locs.spatial_unit,
+                time_col="datetime",
+            )
+            subscriber_locs_table = f"subscriber_locs_{subscriber_locs_id}"
+            subscriber_locs_time = write_query(
+                [
+                    f"""EXPLAIN (ANALYZE TRUE, TIMING FALSE, FORMAT JSON) CREATE TEMPORARY TABLE {subscriber_locs_table}
+                    ON COMMIT DROP AS ({subscriber_locs._make_query_from(located_events.get_query())})"""
+                ],
+                trans,
+            )
+            for dl in group:
+                if Query.connection.has_table(dl.table_name, schema="cache"):
+                    logger.info("Table already exists")
+                    dl_time = 0
+                else:
+                    dl_time = write_query(
+                        dl._make_create_table_sql(
+                            f"cache.{dl.table_name}",
+                            dl._make_query_from(
+                                f"SELECT * FROM {subscriber_locs_table}"
+                            ),
+                        ),
+                        trans,
+                    )
+                compute_times[dl.query_id] = (
+                    dl_time + events_time / len(dls) + subscriber_locs_time / len(group)
+                )
+    return compute_times
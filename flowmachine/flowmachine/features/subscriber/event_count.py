@@ -7,7 +7,7 @@
 from typing import List
 
 from ..utilities.sets import EventsTablesUnion
-from .metaclasses import SubscriberFeature
+from .metaclasses import FusableAggregate, SubscriberFeature
 
 valid_stats = {"count", "sum", "avg", "max", "min", "median", "stddev", "variance"}
 
@@ -104,3 +104,12 @@ class EventCount(SubscriberFeature):
         {where_clause}
         GROUP BY subscriber
         """
+
+    @property
+    def _fusable_aggregate(self) -> FusableAggregate:
+        where = None
+        if self.direction != "both":
+            where = f"outgoing = {'TRUE' if self.direction == 'out' else 'FALSE'}"
+        return FusableAggregate(
+            events=self.unioned_query, value="COUNT(*){filter}", where=where
+        )
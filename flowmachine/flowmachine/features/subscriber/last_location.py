@@ -108,6 +108,22 @@ class LastLocation(BaseLocation, Query):
         Default query method implemented in the
         metaclass Query().
         """
+        return self._make_query_from(self.subscriber_locs.get_query())
+
+    def _make_query_from(self, subscriber_locs_sql: str) -> str:
+        """
+        Make the SQL for this query, taking the subscriber locations from
+        the given SQL query instead of from `self.subscriber_locs`.
+
+        Parameters
+        ----------
+        subscriber_locs_sql : str
+            SQL query with the same result as `self.subscriber_locs`
+
+        Returns
+        -------
+        str
+        """
         relevant_columns = ",".join(self.spatial_unit.location_id_columns)
 
         sql = """
@@ -119,7 +135,7 @@ class LastLocation(BaseLocation, Query):
              FROM ({subscriber_locs}) AS subscriber_locs) AS final_time
         WHERE rank = 1
         """.format(
-            subscriber_locs=self.subscriber_locs.get_query(), rc=relevant_columns
+            subscriber_locs=subscriber_locs_sql, rc=relevant_columns
         )
 
         return sql
@@ -7,6 +7,7 @@
 Here you find metaclasses for building subscriber features.
 
 """
+from typing import NamedTuple, Optional
 
 from ...core.query import Query
 from flowmachine.features.location.joined_spatial_aggregate import (
@@ -18,6 +19,31 @@ import structlog
 logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
 
 
+class FusableAggregate(NamedTuple):
+    """
+    Description of a subscriber feature which is a single aggregate over
+    each subscriber's events, so that it can be calculated in the same
+    `GROUP BY subscriber` pass as other features using the same events.
+
+    Attributes
+    ----------
+    events : EventsTablesUnion
+        The events which the feature aggregates.
+    value : str
+        SQL expression over the columns of `events`, using aggregate functions,
+        which gives the value of the feature. Every aggregate function call must
+        be followed by `{filter}`, which will be replaced with a FILTER clause
+        when `where` is given.
+    where : str, optional
+        SQL condition which events must meet to be included in the feature.
+        Subscribers with no such events have no value for the feature.
+    """
+
+    events: Query
+    value: str
+    where: Optional[str] = None
+
+
 class SubscriberFeature(Query):
     """
     Abstract base class for metrics about our subscriber, which
@@ -47,3 +73,16 @@ class SubscriberFeature(Query):
     def __getitem__(self, item):
 
         return self.subset(col="subscriber", subset=item)
+
+    @property
+    def _fusable_aggregate(self) -> Optional[FusableAggregate]:
+        """
+        Describe this feature as a single aggregate over each subscriber's
+        events, if it can be calculated that way.
+
+        Returns
+        -------
+        FusableAggregate or None
+            None if this feature can't be calculated together with other features.
+        """
+        return None
@@ -12,8 +12,6 @@ The modal daily location of a subscriber.
 """
 from typing import List
 
-from functools import reduce
-
 from flowmachine.core import Query
 from flowmachine.features.utilities.subscriber_locations import BaseLocation
 from ..utilities.multilocation import MultiLocation
@@ -40,9 +38,7 @@ class ModalLocation(MultiLocation, BaseLocation, Query):
 
         # This query represents the concatenated locations of the
         # subscribers
-        all_locs = reduce(
-            lambda x, y: x.union(y), (self._append_date(dl) for dl in self._all_dls)
-        )
+        all_locs = self._get_all_locs()
 
         times_visited = f"""
         SELECT all_locs.subscriber, {location_columns_string}, count(*) AS total, max(all_locs.date) as date
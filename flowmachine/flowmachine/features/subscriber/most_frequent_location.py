@@ -111,7 +111,23 @@ class MostFrequentLocation(BaseLocation, Query):
         Default query method implemented in the
         metaclass Query().
         """
-        subscriber_query = "{} ORDER BY time".format(self.subscriber_locs.get_query())
+        return self._make_query_from(self.subscriber_locs.get_query())
+
+    def _make_query_from(self, subscriber_locs_sql: str) -> str:
+        """
+        Make the SQL for this query, taking the subscriber locations from
+        the given SQL query instead of from `self.subscriber_locs`.
+
+        Parameters
+        ----------
+        subscriber_locs_sql : str
+            SQL query with the same result as `self.subscriber_locs`
+
+        Returns
+        -------
+        str
+        """
+        subscriber_query = "{} ORDER BY time".format(subscriber_locs_sql)
 
         relevant_columns = ", ".join(self.spatial_unit.location_id_columns)
 
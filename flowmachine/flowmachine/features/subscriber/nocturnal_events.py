@@ -11,7 +11,7 @@ hour definitions can be specified.
 
 
 """
-from .metaclasses import SubscriberFeature
+from .metaclasses import FusableAggregate, SubscriberFeature
 from ..utilities import EventsTablesUnion
 
 
@@ -122,3 +122,21 @@ class NocturnalEvents(SubscriberFeature):
         """
 
         return sql
+
+    @property
+    def _fusable_aggregate(self) -> FusableAggregate:
+        where = None
+        if self.direction != "both":
+            where = f"outgoing IS {'TRUE' if self.direction == 'out' else 'FALSE'}"
+        return FusableAggregate(
+            events=self.unioned_query,
+            value=f"""
+            AVG(CASE
+                    WHEN extract(hour FROM datetime) >= {self.hours[0]}
+                      OR extract(hour FROM datetime) < {self.hours[1]}
+                    THEN 1
+                ELSE 0
+            END){{filter}}*100
+            """,
+            where=where,
+        )
@@ -0,0 +1,286 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# -*- coding: utf-8 -*-
+"""
+Computes the daily location of every subscriber on every day of a
+date range in a single pass over the events, rather than one query
+per day.
+
+
+
+"""
+import datetime
+import uuid
+from concurrent.futures import Future
+from typing import List, Optional
+
+import structlog
+
+from flowmachine.core import Query, make_spatial_unit
+from flowmachine.core.query import write_derived_queries_to_cache, write_query
+from flowmachine.core.spatial_unit import AnySpatialUnit
+from flowmachine.core.subscriber_subsetter import store_subset_tables
+from flowmachine.utils import list_of_dates, parse_datestring
+from ..utilities.subscriber_locations import SubscriberLocations
+from .daily_location import daily_location
+
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
+
+
+class PerDayLocations(Query):
+    """
+    Class representing the daily location of each subscriber on each day
+    of a date range, computed with a single grouped scan of the subscriber
+    locations for the whole range.
+
+    The location on each day is the same as that given by `daily_location`
+    for that day, and the per-day results can be stored as the cache tables
+    of the equivalent `daily_location` queries using `store_daily_locations`.
+
+    Parameters
+    ----------
+    start : str
+        iso format date for the first day of the range, e.g. 2016-01-01
+    stop : str
+        iso format date for the day after the last day of the range
+    spatial_unit : flowmachine.core.spatial_unit.*SpatialUnit, default admin3
+        Spatial unit to which subscriber locations will be mapped. See the
+        docstring of make_spatial_unit for more information.
+    hours : tuple of ints, default 'all'
+        Subset the result within certain hours, e.g. (4,17)
+        This will subset the query only with these hours, but
+        across all specified days. Or set to 'all' to include
+        all hours.
+    method : str, default 'last'
+        The method by which to calculate the location of the subscriber
+        on each day. This can be either 'most-common' or 'last'.
+    table : str, default 'all'
+        schema qualified name of the table which the analysis is
+        based upon. If 'all' it will use all tables that contain
+        location data, specified in flowmachine.yml.
+    subscriber_identifier : {'msisdn', 'imei'}, default 'msisdn'
+        Either msisdn, or imei, the column that identifies the subscriber.
+    ignore_nulls : bool, default True
+        ignores those values that are null.
+    subscriber_subset : str, list, flowmachine.core.Query, flowmachine.core.Table, default None
+        If provided, string or list of string which are msisdn or imeis to limit
+        results to; or, a query or table which has a column with a name matching
+        subscriber_identifier (typically, msisdn), to limit results to.
+    dates : list of str, optional
+        Only find locations on these days (iso format dates between start and
+        stop). Only the events on these days are read. Defaults to every day from
+        start up to stop.
+
+    Examples
+    --------
+    >>> locs = PerDayLocations("2016-01-01", "2016-01-04")
+    >>> locs.store_daily_locations().result()
+    >>> daily_location("2016-01-02").is_stored
+    True
+    """
+
+    def __init__(
+        self,
+        start,
+        stop,
+        spatial_unit: Optional[AnySpatialUnit] = None,
+        hours="all",
+        method="last",
+        table="all",
+        subscriber_identifier="msisdn",
+        *,
+        ignore_nulls=True,
+        subscriber_subset=None,
+        dates: Optional[List[str]] = None,
+    ):
+        if method not in ("last", "most-common"):
+            raise ValueError(
+                f"Unrecognised method '{method}', must be either 'last' or 'most-common'"
+            )
+        self.start = start
+        self.stop = stop
+        all_dates = list_of_dates(self.start, self.stop)[:-1]
+        if dates is None:
+            self.dates = all_dates
+        else:
+            self.dates = sorted({str(parse_datestring(date).date()) for date in dates})
+            outside_range = set(self.dates).difference(all_dates)
+            if len(outside_range) > 0:
+                raise ValueError(
+                    f"Dates {sorted(outside_range)} are not between {start} and {stop}."
+                )
+        if spatial_unit is None:
+            self.spatial_unit = make_spatial_unit("admin", level=3)
+        else:
+            self.spatial_unit = spatial_unit
+        self.hours = hours
+        self.method = method
+        self.table = table
+        self.subscriber_identifier = subscriber_identifier
+        # One scan of the events for each run of consecutive days
+        runs = []
+        for date in self.dates:
+            if len(runs) > 0 and parse_datestring(date) - parse_datestring(
+                runs[-1][-1]
+            ) == datetime.timedelta(days=1):
+                runs[-1].append(date)
+            else:
+                runs.append([date])
+        self.subscriber_locs = [
+            SubscriberLocations(
+                start=run[0],
+                stop=str(
+                    (parse_datestring(run[-1]) + datetime.timedelta(days=1)).date()
+                ),
+                spatial_unit=self.spatial_unit,
+                hours=self.hours,
+                table=self.table,
+                subscriber_identifier=self.subscriber_identifier,
+                ignore_nulls=ignore_nulls,
+                subscriber_subset=subscriber_subset,
+            )
+            for run in runs
+        ]
+        super().__init__()
+
+    @property
+    def column_names(self) -> List[str]:
+        return ["subscriber"] + self.spatial_unit.location_id_columns + ["date"]
+
+    @property
+    def index_cols(self) -> List:
+        return super().index_cols + ["date"]
+
+    @property
+    def daily_locations(self) -> List[Query]:
+        """
+        Returns
+        -------
+        list of Query
+            The daily location query for each day covered by this query, whose
+            results are the per-day subsets of this one.
+        """
+        return [
+            daily_location(
+                date,
+                spatial_unit=self.spatial_unit,
+                hours=self.hours,
+                method=self.method,
+                table=self.table,
+                subscriber_identifier=self.subscriber_identifier,
+                ignore_nulls=self.subscriber_locs[0].ignore_nulls,
+                subscriber_subset=self.subscriber_locs[0].subscriber_subsetter,
+            )
+            for date in self.dates
+        ]
+
+    def _make_query(self):
+        """
+        Default query method implemented in the
+        metaclass Query().
+        """
+        relevant_columns = ", ".join(self.spatial_unit.location_id_columns)
+        subscriber_locs = " UNION ALL ".join(
+            f"({subscriber_locs.get_query()})"
+            for subscriber_locs in self.subscriber_locs
+        )
+
+        if self.method == "last":
+            ranked = f"""
+            SELECT subscriber_locs.subscriber, {relevant_columns}, time::date AS date,
+            row_number() OVER (PARTITION BY subscriber_locs.subscriber, time::date
+                ORDER BY time DESC) AS rank
+            FROM ({subscriber_locs}) AS subscriber_locs
+            """
+        else:
+            times_visited = f"""
+            SELECT subscriber_locs.subscriber, {relevant_columns},
+                time::date AS date, count(*) AS total
+            FROM ({subscriber_locs}) AS subscriber_locs
+            GROUP BY subscriber_locs.subscriber, {relevant_columns}, time::date
+            """
+            ranked = f"""
+            SELECT times_visited.subscriber, {relevant_columns}, times_visited.date,
+            row_number() OVER (PARTITION BY times_visited.subscriber, times_visited.date
+                ORDER BY total DESC) AS rank
+            FROM ({times_visited}) AS times_visited
+            """
+
+        sql = f"""
+        SELECT ranked.subscriber, {relevant_columns}, ranked.date
+        FROM ({ranked}) AS ranked
+        WHERE rank = 1
+        """
+
+        return sql
+
+    def store_daily_locations(self) -> Future:
+        """
+        Store each of the per-day results which aren't already cached as the cache
+        table of the equivalent daily location query, using a background thread.
+        This query is computed once for all of the days, but is only kept in cache
+        if it was already stored.
+
+        Returns
+        -------
+        Future
+            Future object which resolves to the list of daily location queries
+            once they are all stored.
+        """
+        return self.thread_pool_executor.submit(self._store_daily_locations)
+
+    def _store_daily_locations(self) -> List[Query]:
+        """
+        Blocking implementation of `store_daily_locations`.
+        """
+        daily_locs = self.daily_locations
+        unstored = [
+            (date, dl) for date, dl in zip(self.dates, daily_locs) if not dl.is_stored
+        ]
+        if len(unstored) == 0:
+            return daily_locs
+        logger.debug(
+            f"Storing {len(unstored)} daily locations from '{self.query_id}'.",
+            query_ids=[dl.query_id for _, dl in unstored],
+        )
+        if self.is_stored:
+            write_derived_queries_to_cache(
+                self,
+                [
+                    (
+                        dl,
+                        f"SELECT * FROM {self.fully_qualified_table_name} WHERE date = '{date}'::date",
+                    )
+                    for date, dl in unstored
+                ],
+            )
+            return daily_locs
+        # The per-day tables hold the whole result, so storing this query as well
+        # would duplicate it. Instead it is written to a table outside the cache
+        # metadata, which is dropped once the per-day tables have been made.
+        scratch_table = f"cache.per_day_locations_{uuid.uuid4().hex}"
+        store_subset_tables(self)
+        try:
+            with self.connection.engine.begin():
+                compute_time = write_query(
+                    [
+                        f"""EXPLAIN (ANALYZE TRUE, TIMING FALSE, FORMAT JSON) CREATE UNLOGGED TABLE {scratch_table} AS
+                        (SELECT {self.column_names_as_string_list} FROM ({self.get_query()}) _)""",
+                        f"CREATE INDEX ON {scratch_table} (date)",
+                        f"ANALYZE {scratch_table}",
+                    ],
+                    self.connection.engine,
+                )
+            write_derived_queries_to_cache(
+                self,
+                [
+                    (dl, f"SELECT * FROM {scratch_table} WHERE date = '{date}'::date",)
+                    for date, dl in unstored
+                ],
+                compute_time=compute_time / 1000,
+            )
+        finally:
+            self.connection.engine.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+        return daily_locs
@@ -15,7 +15,7 @@ from typing import List, Optional
 from ...core import location_joined_query, make_spatial_unit
 from ...core.spatial_unit import AnySpatialUnit
 from ..utilities import EventsTablesUnion
-from .metaclasses import SubscriberFeature
+from .metaclasses import FusableAggregate, SubscriberFeature
 
 valid_stats = {"count", "sum", "avg", "max", "min", "median", "stddev", "variance"}
 
@@ -115,6 +115,17 @@ class SubscriberCallDurations(SubscriberFeature):
         GROUP BY subscriber
         """
 
+    @property
+    def _fusable_aggregate(self) -> FusableAggregate:
+        where = None
+        if self.direction != "both":
+            where = "{}outgoing".format("" if self.direction == "out" else "NOT ")
+        return FusableAggregate(
+            events=self.unioned_query,
+            value=f"{self.statistic}(duration){{filter}}",
+            where=where,
+        )
+
 
 class PerLocationSubscriberCallDurations(SubscriberFeature):
     """
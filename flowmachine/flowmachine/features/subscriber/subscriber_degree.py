@@ -11,7 +11,7 @@ have done over a certain time period.
 """
 from typing import List
 
-from .metaclasses import SubscriberFeature
+from .metaclasses import FusableAggregate, SubscriberFeature
 from ..utilities import EventsTablesUnion
 
 
@@ -127,3 +127,25 @@ class SubscriberDegree(SubscriberFeature):
         """
 
         return sql
+
+    @property
+    def _fusable_aggregate(self) -> FusableAggregate:
+        filters = []
+        if self.direction != "both":
+            filters.append(
+                f"outgoing = {'TRUE' if self.direction == 'out' else 'FALSE'}"
+            )
+        if self.exclude_self_calls:
+            filters.append("subscriber != msisdn_counterpart")
+            value = "COUNT(DISTINCT msisdn_counterpart){filter}"
+        else:
+            # SELECT DISTINCT counts a null counterpart, but COUNT(DISTINCT ...) doesn't
+            value = """
+            COUNT(DISTINCT msisdn_counterpart){filter}
+              + coalesce((bool_or(msisdn_counterpart IS NULL){filter})::int, 0)
+            """
+        return FusableAggregate(
+            events=self.unioned_query,
+            value=value,
+            where=" AND ".join(filters) if len(filters) > 0 else None,
+        )
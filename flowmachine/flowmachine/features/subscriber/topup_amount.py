@@ -10,7 +10,7 @@ Class for calculating top-up recharge amount statistics.
 import warnings
 
 from ..utilities.sets import EventsTablesUnion
-from .metaclasses import SubscriberFeature
+from .metaclasses import FusableAggregate, SubscriberFeature
 
 valid_stats = {"count", "sum", "avg", "max", "min", "median", "stddev", "variance"}
 
@@ -99,3 +99,10 @@ class TopUpAmount(SubscriberFeature):
         FROM ({self.unioned_query.get_query()}) U
         GROUP BY subscriber
         """
+
+    @property
+    def _fusable_aggregate(self) -> FusableAggregate:
+        return FusableAggregate(
+            events=self.unioned_query,
+            value=f"{self.statistic}(recharge_amount){{filter}}",
+        )
@@ -7,7 +7,11 @@ Utilities for working with features.
 """
 from .group_values import GroupValues
 from .subscriber_locations import SubscriberLocations
-from .feature_collection import feature_collection
+from .feature_collection import (
+    feature_collection,
+    FusedFeatureCollection,
+    FusedSubscriberFeatures,
+)
 
 
 from .sets import UniqueSubscribers, SubscriberLocationSubset
@@ -6,13 +6,13 @@
 import datetime
 import pandas as pd
 import warnings
-from sqlalchemy import select
-from typing import List
+from sqlalchemy import MetaData, select, union_all
+from sqlalchemy import Table as SqlalchemyTable
+from typing import List, Optional
 
 from ...core import Query, Table
 from ...core.errors import MissingDateError
 from ...core.sqlalchemy_utils import (
-    get_sqlalchemy_table_definition,
     make_sqlalchemy_column_from_flowmachine_column_description,
     get_sql_string,
 )
@@ -61,6 +61,10 @@ class EventTableSubset(Query):
 
     * Use 24 hr format!
 
+    * Where every ingested date in the range has its own child table of the events
+      table (as created by FlowETL), the query selects from those child tables directly
+      instead of from the parent table.
+
     Examples
     --------
     >>> sd = EventTableSubset(start='2016-01-01 13:30:30', stop='2016-01-02 16:25:00')
@@ -145,8 +149,8 @@ class EventTableSubset(Query):
                 )
         self.columns = sorted(self.columns)
 
-        self.sqlalchemy_table = get_sqlalchemy_table_definition(
-            self.table_ORIG.fully_qualified_table_name, engine=Query.connection.engine
+        self.sqlalchemy_table = Query.connection.get_sqlalchemy_table(
+            self.table_ORIG.fully_qualified_table_name
         )
 
         if self.start == self.stop:
@@ -162,12 +166,15 @@ class EventTableSubset(Query):
     def column_names(self) -> List[str]:
         return [c.split(" AS ")[-1] for c in self.columns]
 
-    def _check_dates(self):
+    def _get_dates_in_range(self) -> List[str]:
+        """
+        Get the calendar dates this subset covers.
 
-        # Handle the logic for dealing with missing dates.
-        # If there are no dates present, then we raise an error
-        # if some are present, but some are missing we raise a
-        # warning.
+        Returns
+        -------
+        list of str
+            ISO format dates
+        """
         # If the subscriber does not pass a start or stop date, then we take
         # the min/max date in the events.calls table
         if self.start is None:
@@ -193,6 +200,15 @@ class EventTableSubset(Query):
             len(self.stop) == 10 or self.stop.endswith("00:00:00")
         ):
             all_dates.pop(-1)
+        return all_dates
+
+    def _check_dates(self):
+
+        # Handle the logic for dealing with missing dates.
+        # If there are no dates present, then we raise an error
+        # if some are present, but some are missing we raise a
+        # warning.
+        all_dates = self._get_dates_in_range()
         # This will be a true false list for whether each of the dates
         # is present in the database
         try:
@@ -217,10 +233,49 @@ class EventTableSubset(Query):
                 stacklevel=2,
             )
 
-    def _make_query_with_sqlalchemy(self):
+    def _get_partition_tables(self) -> Optional[List[SqlalchemyTable]]:
+        """
+        Get the child tables of the events table which hold the dates this subset covers.
+
+        Returns
+        -------
+        list of sqlalchemy.Table or None
+            One table per date in the range, or None if any date in the range
+            has not been ingested or has no child table, in which case the parent
+            table should be used so that no rows held only by the parent are missed.
+        """
+        if self.table_ORIG.schema != "events":
+            return None
+        ingested_dates = {
+            d.strftime("%Y-%m-%d")
+            for d in self.connection.available_dates.get(self.table_ORIG.name, [])
+        }
+        dates = self._get_dates_in_range()
+        if len(dates) == 0 or not ingested_dates.issuperset(dates):
+            return None
+        partition_names = [
+            f"{self.table_ORIG.name}_{d.replace('-', '')}" for d in dates
+        ]
+        if not all(
+            self.connection.has_table(name, schema="events") for name in partition_names
+        ):
+            return None
+        # Child tables inherit all the parent's columns, so don't need reflecting
+        metadata = MetaData()
+        return [
+            SqlalchemyTable(
+                name,
+                metadata,
+                *[col.copy() for col in self.sqlalchemy_table.columns],
+                schema="events",
+            )
+            for name in partition_names
+        ]
+
+    def _make_select_from_table(self, sqlalchemy_table: SqlalchemyTable):
         sqlalchemy_columns = [
             make_sqlalchemy_column_from_flowmachine_column_description(
-                self.sqlalchemy_table, column_str
+                sqlalchemy_table, column_str
             )
             for column_str in self.columns
         ]
@@ -228,21 +283,30 @@ class EventTableSubset(Query):
 
         if self.start is not None:
             ts_start = pd.Timestamp(self.start).strftime("%Y-%m-%d %H:%M:%S")
-            select_stmt = select_stmt.where(
-                self.sqlalchemy_table.c.datetime >= ts_start
-            )
+            select_stmt = select_stmt.where(sqlalchemy_table.c.datetime >= ts_start)
         if self.stop is not None:
             ts_stop = pd.Timestamp(self.stop).strftime("%Y-%m-%d %H:%M:%S")
-            select_stmt = select_stmt.where(self.sqlalchemy_table.c.datetime < ts_stop)
+            select_stmt = select_stmt.where(sqlalchemy_table.c.datetime < ts_stop)
 
         select_stmt = select_stmt.where(
-            self.hour_slices.get_subsetting_condition(self.sqlalchemy_table.c.datetime)
+            self.hour_slices.get_subsetting_condition(sqlalchemy_table.c.datetime)
         )
-        select_stmt = self.subscriber_subsetter.apply_subset_if_needed(
+        return self.subscriber_subsetter.apply_subset_if_needed(
             select_stmt, subscriber_identifier=self.subscriber_identifier
         )
 
-        return get_sql_string(select_stmt)
+    def _make_query_with_sqlalchemy(self):
+        partition_tables = self._get_partition_tables()
+        if partition_tables is None:
+            return get_sql_string(self._make_select_from_table(self.sqlalchemy_table))
+        logger.debug(
+            f"Selecting from {len(partition_tables)} child tables of {self.table_ORIG.fully_qualified_table_name}."
+        )
+        return get_sql_string(
+            union_all(
+                *[self._make_select_from_table(table) for table in partition_tables]
+            )
+        )
 
     _make_query = _make_query_with_sqlalchemy
 
@@ -6,10 +6,20 @@
 Class definition for feature_collection, this is a group of
 joined features.
 """
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import List, Tuple, Union
+
+import structlog
+
 from flowmachine.core.join import Join
+from flowmachine.core.query import Query, write_derived_queries_to_cache
+from .events_tables_union import EventsTablesUnion
 
+logger = structlog.get_logger("flowmachine.debug", submodule=__name__)
 
-def feature_collection(metrics, dropna=True) -> Join:
+
+def feature_collection(metrics, dropna=True, fused=False) -> Union[Join, Query]:
     """
     Joined set of features. Takes a set of features and creates
     one wide dataset about these features. Most often used to gather
@@ -24,6 +34,10 @@ def feature_collection(metrics, dropna=True) -> Join:
     dropna : bool
         Keeps rows in which a subscriber has some but not 
         all of the features. 
+    fused : bool, default False
+        If True, subscriber features which aggregate the same events are
+        calculated together, in a single pass over the events. The result
+        is the same, but is a FusedFeatureCollection rather than a Join.
 
     Examples
     --------
@@ -75,8 +89,8 @@ def feature_collection(metrics, dropna=True) -> Join:
 
     Returns
     -------
-    Join
-        A Join object combining all the features
+    Join or FusedFeatureCollection
+        A query combining all the features
 
     Notes
     -----
@@ -86,13 +100,14 @@ def feature_collection(metrics, dropna=True) -> Join:
     multiple times but with different parameters.
 
     """
-
+    if fused:
+        return FusedFeatureCollection(metrics, dropna=dropna)
     return _join_queries(metrics, dropna)
 
 
 def feature_collection_from_list_of_classes(
-    classes, *args, dropna=False, **kwargs
-) -> Join:
+    classes, *args, dropna=False, fused=False, **kwargs
+) -> Union[Join, Query]:
     """
     Create a feature collection from uninstantiated classes with common arguments.
 
@@ -102,12 +117,12 @@ def feature_collection_from_list_of_classes(
 
     Returns
     -------
-    Join
-        A Join object combining all the features
+    Join or FusedFeatureCollection
+        A query combining all the features
     """
 
     metrics = [c(*args, **kwargs) for c in classes]
-    return feature_collection(metrics, dropna=dropna)
+    return feature_collection(metrics, dropna=dropna, fused=fused)
 
 
 # Private function that joins multiple queries together
@@ -139,3 +154,272 @@ def _join_queries(queries, dropna):
         _ = running_join.column_names
 
     return running_join
+
+
+def _events_key(events: EventsTablesUnion) -> Tuple:
+    """
+    Identify the events in an EventsTablesUnion, ignoring which columns of
+    them are selected.
+    """
+    subset = events.date_subsets[0]
+    return (
+        str(events.start),
+        str(events.stop),
+        tuple(events.tables),
+        str(subset.hours),
+        subset.subscriber_subsetter.query_id,
+        subset.subscriber_identifier,
+    )
+
+
+class FusedSubscriberFeatures(Query):
+    """
+    Several subscriber features which aggregate the same events, calculated
+    together in a single `GROUP BY subscriber` pass over the events.
+
+    Parameters
+    ----------
+    features : list of SubscriberFeature
+        Features to calculate. These must all have a `_fusable_aggregate`,
+        over the same dates, hours, tables and subscriber subset.
+
+    Notes
+    -----
+    For the i-th feature, the result has a column `value_<i>` with the value of
+    the feature, and a boolean column `present_<i>` which is true for the
+    subscribers who have a value for the feature.
+
+    Each of the features can be stored as its own cache table, from the stored
+    result of this query, using `store_features`.
+    """
+
+    def __init__(self, features):
+        self.features = list(features)
+        aggregates = [feature._fusable_aggregate for feature in self.features]
+        if any(aggregate is None for aggregate in aggregates):
+            raise ValueError("All features must have a fusable aggregate.")
+        if len({_events_key(aggregate.events) for aggregate in aggregates}) > 1:
+            raise ValueError("All features must aggregate the same events.")
+        events = aggregates[0].events
+        subset = events.date_subsets[0]
+        self.unioned_query = EventsTablesUnion(
+            events.start,
+            events.stop,
+            tables=events.tables,
+            columns=sorted(
+                {
+                    column
+                    for aggregate in aggregates
+                    for column in aggregate.events.columns
+                }
+            ),
+            hours=subset.hours,
+            subscriber_identifier=subset.subscriber_identifier,
+            subscriber_subset=subset.subscriber_subsetter,
+        )
+        super().__init__()
+
+    @property
+    def column_names(self) -> List[str]:
+        return ["subscriber"] + [
+            column
+            for i in range(len(self.features))
+            for column in (f"value_{i}", f"present_{i}")
+        ]
+
+    def _make_query(self):
+        aggregates = []
+        for i, feature in enumerate(self.features):
+            aggregate = feature._fusable_aggregate
+            if aggregate.where is None:
+                aggregates += [
+                    f"{aggregate.value.format(filter='')} AS value_{i}",
+                    f"TRUE AS present_{i}",
+                ]
+            else:
+                aggregate_filter = f" FILTER (WHERE {aggregate.where})"
+                present = f"COUNT(*){aggregate_filter} > 0"
+                aggregates += [
+                    f"CASE WHEN {present} THEN {aggregate.value.format(filter=aggregate_filter)} END AS value_{i}",
+                    f"{present} AS present_{i}",
+                ]
+
+        sql = f"""
+        SELECT
+            subscriber,
+            {", ".join(aggregates)}
+        FROM ({self.unioned_query.get_query()}) U
+        GROUP BY subscriber
+        """
+
+        return sql
+
+    def store_features(self) -> Future:
+        """
+        Store this query, and then store each of the features which isn't
+        already cached as its own cache table, using a background thread.
+
+        Returns
+        -------
+        Future
+            Future object which resolves to the list of features once they
+            are all stored.
+        """
+        return self.thread_pool_executor.submit(self._store_features)
+
+    def _store_features(self) -> List[Query]:
+        """
+        Blocking implementation of `store_features`.
+        """
+        unstored = [
+            (i, feature)
+            for i, feature in enumerate(self.features)
+            if not feature.is_stored
+        ]
+        if len(unstored) == 0:
+            return self.features
+        logger.debug(
+            f"Storing {len(unstored)} features from '{self.query_id}'.",
+            query_ids=[feature.query_id for _, feature in unstored],
+        )
+        self.store().result()
+        write_derived_queries_to_cache(
+            self,
+            [
+                (
+                    feature,
+                    f"SELECT subscriber, value_{i} AS {feature.column_names[1]} FROM {self.fully_qualified_table_name} WHERE present_{i}",
+                )
+                for i, feature in unstored
+            ],
+        )
+        return self.features
+
+
+class FusedFeatureCollection(Query):
+    """
+    Joined set of features, with the same result as `feature_collection`,
+    where unstored subscriber features which aggregate the same events are
+    calculated together in a single pass over the events.
+
+    Parameters
+    ----------
+    metrics : list of Query type objects
+        A list (or other iterable) of objects which derive
+        from the flowmachine.Query base class.
+    dropna : bool
+        Keeps rows in which a subscriber has some but not
+        all of the features.
+
+    See Also
+    --------
+    feature_collection, FusedSubscriberFeatures
+    """
+
+    def __init__(self, metrics, dropna=True):
+        self.metrics = list(metrics)
+        self.dropna = dropna
+        super().__init__()
+
+    @property
+    def column_names(self) -> List[str]:
+        return [self.metrics[0].column_names[0]] + [
+            f"{column}_{metric.__class__.__name__.lower()}_{i}"
+            for i, metric in enumerate(self.metrics)
+            for column in metric.column_names[1:]
+        ]
+
+    @property
+    def fused_features(self) -> List[FusedSubscriberFeatures]:
+        """
+        Returns
+        -------
+        list of FusedSubscriberFeatures
+            The groups of unstored features in this collection which
+            aggregate the same events.
+        """
+        groups = defaultdict(dict)
+        for metric in self.metrics:
+            aggregate = getattr(metric, "_fusable_aggregate", None)
+            if aggregate is not None and not metric.is_stored:
+                groups[_events_key(aggregate.events)][metric.query_id] = metric
+        return [
+            FusedSubscriberFeatures(group.values())
+            for group in groups.values()
+            if len(group) > 1
+        ]
+
+    def _make_query(self):
+        parts = []
+        fused_columns = {}
+        for fused in self.fused_features:
+            table = f"t{len(parts)}"
+            presence = [f"present_{i}" for i in range(len(fused.features))]
+            parts.append(
+                (
+                    f"""
+                    SELECT * FROM ({fused.get_query()}) AS fused
+                    WHERE {(" AND " if self.dropna else " OR ").join(presence)}
+                    """,
+                    f"{table}.subscriber",
+                )
+            )
+            for i, feature in enumerate(fused.features):
+                fused_columns[feature.query_id] = (table, i)
+
+        select_targets = []
+        for i, metric in enumerate(self.metrics):
+            append = f"_{metric.__class__.__name__.lower()}_{i}"
+            if metric.query_id in fused_columns:
+                table, j = fused_columns[metric.query_id]
+                select_targets.append(
+                    f"CASE WHEN {table}.present_{j} THEN {table}.value_{j} END AS {metric.column_names[1]}{append}"
+                )
+            else:
+                table = f"t{len(parts)}"
+                parts.append((metric.get_query(), f"{table}.{metric.column_names[0]}"))
+                select_targets += [
+                    f"{table}.{column} AS {column}{append}"
+                    for column in metric.column_names[1:]
+                ]
+
+        join_kind = "INNER" if self.dropna else "FULL OUTER"
+        join_columns = [join_column for _, join_column in parts]
+        from_clause = f"({parts[0][0]}) AS t0"
+        for i, (part, join_column) in enumerate(parts[1:], start=1):
+            if self.dropna:
+                on = join_columns[0]
+            else:
+                on = f"coalesce({', '.join(join_columns[:i])})"
+            from_clause += f"""
+            {join_kind} JOIN ({part}) AS t{i}
+            ON {join_column} = {on}
+            """
+        if self.dropna:
+            focal = join_columns[0]
+        else:
+            focal = f"coalesce({', '.join(join_columns)})"
+
+        sql = f"""
+        SELECT
+            {focal} AS {self.column_names[0]},
+            {", ".join(select_targets)}
+        FROM {from_clause}
+        """
+
+        return sql
+
+    def _precompute_dependencies(self) -> bool:
+        """
+        Store each group of unstored subscriber features which aggregate the
+        same events, calculating each group in a single pass over the events.
+
+        Returns
+        -------
+        bool
+            True if any features were stored.
+        """
+        fused_features = self.fused_features
+        for fused in fused_features:
+            fused._store_features()
+        return len(fused_features) > 0
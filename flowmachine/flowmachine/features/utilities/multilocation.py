@@ -11,10 +11,14 @@ dailylocations objects, although they can be.
 
 """
 
+import datetime
+from functools import reduce
+from typing import List, Optional
 
 from flowmachine.utils import parse_datestring
 
-from ...core import CustomQuery
+from ...core import CustomQuery, Query
+from ...core.errors import MissingDateError
 
 import structlog
 
@@ -81,3 +85,99 @@ class MultiLocation:
         date_string = f"to_date('{dl.start}','YYYY-MM-DD') AS date"
         sql = f"SELECT *, {date_string} FROM ({dl.get_query()}) AS dl"
         return CustomQuery(sql, self.spatial_unit.location_id_columns + ["date"])
+
+    def _get_per_day_locations(self, dls: List[Query]) -> Optional[Query]:
+        """
+        Returns a PerDayLocations query which computes the given daily
+        locations in a single pass over the events of their days, or None if the
+        daily locations can't be computed that way (e.g. because they don't all
+        use the same method).
+
+        Parameters
+        ----------
+        dls : list of Query
+            Daily locations from this query to compute together
+
+        Returns
+        -------
+        PerDayLocations or None
+        """
+        from ..subscriber.last_location import LastLocation
+        from ..subscriber.most_frequent_location import MostFrequentLocation
+        from ..subscriber.per_day_locations import PerDayLocations
+
+        if all(isinstance(dl, LastLocation) for dl in dls):
+            method = "last"
+        elif all(isinstance(dl, MostFrequentLocation) for dl in dls):
+            method = "most-common"
+        else:
+            return None
+        first_dl = dls[0]
+        dates = sorted(parse_datestring(dl.start).date() for dl in dls)
+        try:
+            per_day_locations = PerDayLocations(
+                start=str(dates[0]),
+                stop=str(dates[-1] + datetime.timedelta(days=1)),
+                spatial_unit=self.spatial_unit,
+                hours=first_dl.hours,
+                method=method,
+                table=first_dl.table,
+                subscriber_identifier=self.subscriber_identifier,
+                ignore_nulls=first_dl.subscriber_locs.ignore_nulls,
+                subscriber_subset=first_dl.subscriber_locs.subscriber_subsetter,
+                dates=[str(date) for date in dates],
+            )
+            per_day_query_ids = {
+                dl.query_id for dl in per_day_locations.daily_locations
+            }
+        except MissingDateError:
+            return None
+        # Only usable if every one of the daily locations is one of its days
+        if all(dl.query_id in per_day_query_ids for dl in dls):
+            return per_day_locations
+        else:
+            return None
+
+    def _get_all_locs(self) -> Query:
+        """
+        Returns a query representing the concatenated dated locations of
+        the subscribers from all of the daily locations.
+
+        If more than one of the daily locations is not stored, the unstored ones
+        are computed together in a single pass over the events where possible,
+        rather than with a separate query for each day.
+
+        Returns
+        -------
+        Query
+        """
+        unstored_dls = [dl for dl in self._all_dls if not dl.is_stored]
+        per_day_locations = (
+            self._get_per_day_locations(unstored_dls) if len(unstored_dls) > 1 else None
+        )
+        if per_day_locations is None:
+            dated_locs = [self._append_date(dl) for dl in self._all_dls]
+        else:
+            dated_locs = [
+                self._append_date(dl) for dl in self._all_dls if dl.is_stored
+            ] + [per_day_locations]
+        return reduce(lambda x, y: x.union(y), dated_locs)
+
+    def _precompute_dependencies(self) -> bool:
+        """
+        Store all of the unstored daily locations together, in a single pass
+        over the events, if more than one of them is unstored.
+
+        Returns
+        -------
+        bool
+            True if any daily locations were stored.
+        """
+        unstored_dls = [dl for dl in self._all_dls if not dl.is_stored]
+        if len(unstored_dls) < 2:
+            return False
+        per_day_locations = self._get_per_day_locations(unstored_dls)
+        if per_day_locations is None:
+            return False
+        per_day_locations._store_daily_locations()
+        return True
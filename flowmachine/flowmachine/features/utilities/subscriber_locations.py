@@ -123,8 +123,35 @@ class SubscriberLocations(Query):
     def column_names(self) -> List[str]:
         return ["subscriber", "time"] + self.spatial_unit.location_id_columns
 
+    @property
+    def subscriber_subsetter(self):
+        """
+        Returns
+        -------
+        SubscriberSubsetterBase
+            The subscriber subsetter applied to the events.
+        """
+        return self.unioned.date_subsets[0].subscriber_subsetter
+
     def _make_query(self):
 
+        return self._make_query_from(self.unioned.get_query())
+
+    def _make_query_from(self, located_events_sql: str) -> str:
+        """
+        Make the SQL for this query, taking the events joined to locations
+        from the given SQL query instead of from `self.unioned`.
+
+        Parameters
+        ----------
+        located_events_sql : str
+            SQL query with the same result as `self.unioned`
+
+        Returns
+        -------
+        str
+        """
+
         if self.ignore_nulls:
             where_clause = "WHERE location_id IS NOT NULL AND location_id !=''"
         else:
@@ -136,7 +163,7 @@ class SubscriberLocations(Query):
                 SELECT
                     subscriber, datetime as time, {location_cols}
                 FROM
-                    ({self.unioned.get_query()}) AS foo
+                    ({located_events_sql}) AS foo
                 {where_clause}
                 """
         return sql
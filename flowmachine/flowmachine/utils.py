@@ -15,7 +15,7 @@ from pathlib import Path
 from pglast import prettify
 from psycopg2._psycopg import adapt
 from time import sleep
-from typing import Union, Tuple
+from typing import Union, Tuple, Optional, Sequence
 
 
 def parse_datestring(
@@ -211,6 +211,129 @@ def pretty_sql(
     )
 
 
+# SQL comparison operator for each filter operator accepted by get_page_sql
+PAGE_FILTER_OPERATORS = {
+    "eq": "=",
+    "ne": "<>",
+    "lt": "<",
+    "le": "<=",
+    "gt": ">",
+    "ge": ">=",
+}
+
+
+def get_page_sql(
+    source: str,
+    *,
+    column_names: Sequence[str],
+    index_columns: Sequence[str] = (),
+    unique_column: Optional[str] = None,
+    columns: Optional[Sequence[str]] = None,
+    filters: Optional[Sequence[Tuple[str, str, str]]] = None,
+    order_by: Optional[Sequence[str]] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> str:
+    """
+    Get SQL which returns a page of the rows of a table or subquery, optionally
+    restricted to some of its columns and to rows matching some filters.
+
+    Rows are only ordered if `order_by`, `limit` or `offset` is given. They are
+    then ordered by the `order_by` columns, followed by the columns of an index and
+    a unique column, so that the order is the same every time and can be read
+    from the index.
+
+    Parameters
+    ----------
+    source : str
+        Fully qualified name of a table, or a subquery in parentheses
+    column_names : list of str
+        Names of the columns of `source`
+    index_columns : list of str, optional
+        Columns of one index on `source`, in index order
+    unique_column : str, optional
+        Column (or system column, such as ctid) which is unique for each row of
+        `source`. If not given, the remaining columns of `source` are used to
+        break ties instead.
+    columns : list of str, optional
+        Columns to return. Defaults to all columns.
+    filters : list of (str, str, str), optional
+        Filters to apply, each a (column, operator, value) triple, where the
+        operator is one of 'eq', 'ne', 'lt', 'le', 'gt' and 'ge'. Values are
+        compared as literals of the column's type.
+    order_by : list of str, optional
+        Columns to order rows by. Prefix a column with '-' to sort it in
+        descending order.
+    limit : int, optional
+        Maximum number of rows to return. Defaults to all rows.
+    offset : int, default 0
+        Number of rows to skip before the start of the page.
+
+    Returns
+    -------
+    str
+        SQL string
+
+    Raises
+    ------
+    ValueError
+        If any of the columns or operators are not valid, or if the limit or
+        offset is negative.
+    """
+
+    def check_column(column):
+        if column not in column_names:
+            raise ValueError(
+                f"'{column}' is not a column of this query. Must be one of {list(column_names)}."
+            )
+        return f'"{column}"'
+
+    if columns is None:
+        columns = column_names
+    if len(columns) == 0:
+        raise ValueError("At least one column must be returned.")
+    selected = ", ".join(check_column(column) for column in columns)
+
+    conditions = []
+    for column, operator, value in filters or []:
+        try:
+            comparison = PAGE_FILTER_OPERATORS[operator]
+        except KeyError:
+            raise ValueError(
+                f"'{operator}' is not a filter operator. Must be one of {list(PAGE_FILTER_OPERATORS)}."
+            )
+        if "\x00" in str(value):
+            raise ValueError("Filter values must not contain null characters.")
+        # Escape string syntax, so backslashes are escapes whatever the server's settings
+        literal = str(value).replace("\\", "\\\\").replace("'", "\\'")
+        conditions.append(f"{check_column(column)} {comparison} E'{literal}'")
+    where = f" WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
+
+    if limit is not None and limit < 0:
+        raise ValueError("Limit must not be negative.")
+    if offset < 0:
+        raise ValueError("Offset must not be negative.")
+
+    ordering = []
+    for column in order_by or []:
+        descending = column.startswith("-")
+        column = check_column(column[1:] if descending else column)
+        ordering.append(f"{column} DESC" if descending else column)
+    if len(ordering) > 0 or limit is not None or offset > 0:
+        ordered = {ordering_term.split(" ")[0] for ordering_term in ordering}
+        tiebreakers = [unique_column] if unique_column is not None else column_names
+        for column in list(index_columns) + list(tiebreakers):
+            quoted = column if column == unique_column else check_column(column)
+            if quoted not in ordered:
+                ordered.add(quoted)
+                ordering.append(quoted)
+    order = f" ORDER BY {', '.join(ordering)}" if len(ordering) > 0 else ""
+    page = f" LIMIT {int(limit)}" if limit is not None else ""
+    page += f" OFFSET {int(offset)}" if offset > 0 else ""
+
+    return f"SELECT {selected} FROM {source} _{where}{order}{page}"
+
+
 def _makesafe(x):
     """
     Function that converts input into a PostgreSQL readable.
@@ -82,7 +82,6 @@ setup(
         "pytz",
         "python-louvain",
         "psycopg2-binary",
-        "finist",
         "redis",
         "pyzmq",
         "structlog",
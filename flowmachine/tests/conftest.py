@@ -216,23 +216,23 @@ class DummyRedis:
         self._store = {}
         self.allow_flush = True
 
-    def setnx(self, name, val):
-        if name not in self._store:
-            self._store[name] = val.encode()
-
-    def eval(self, script, numkeys, name, event):
-        current_value = self._store[name]
-        try:
-            self._store[name] = self._store[event][current_value]
-            return self._store[name], current_value
-        except KeyError:
-            return current_value, None
-
-    def hset(self, key, current, next):
-        try:
-            self._store[key][current.encode()] = next.encode()
-        except KeyError:
-            self._store[key] = {current.encode(): next.encode()}
+    def register_script(self, script):
+        """
+        Stand-in for the query state machine's transition script.
+        """
+
+        def transition(keys, args):
+            (name,) = keys
+            initial_state, channel, *transitions = args
+            current_value = self._store.get(name, initial_state.encode())
+            next_states = dict(zip(transitions[::2], transitions[1::2]))
+            try:
+                self._store[name] = next_states[current_value.decode()].encode()
+                return self._store[name], 1
+            except KeyError:
+                return current_value, 0
+
+        return transition
 
     def set(self, key, value):
         self._store[key] = value.encode()
@@ -61,7 +61,9 @@ def server_config():
         port=5555,
         debug_mode=False,
         store_dependencies=True,
+        store_all_dependencies=False,
         cache_pruning_frequency=86400,
         cache_pruning_timeout=600,
         server_thread_pool=ThreadPoolExecutor(),
+        result_sql_cache_size=1024,
     )
@@ -1,6 +1,9 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import datetime
+from unittest.mock import Mock
+
 import pytest
 from marshmallow import Schema, fields
 
@@ -100,7 +103,48 @@ async def test_get_sql_error_states(query_state, dummy_redis, server_config):
     """
     dummy_redis.set("DUMMY_QUERY_ID", "KNOWN")
     state_machine = QueryStateMachine(dummy_redis, "DUMMY_QUERY_ID")
-    dummy_redis.set(state_machine.state_machine._name, query_state)
+    dummy_redis.set(state_machine.state_key, query_state)
     msg = await action_handler__get_sql(config=server_config, query_id="DUMMY_QUERY_ID")
     assert msg.status == ZMQReplyStatus.ERROR
     assert msg.payload["query_state"] == query_state
+
+
+@pytest.mark.asyncio
+async def test_get_sql_page(monkeypatch, dummy_redis, server_config):
+    """
+    Test that get_sql handler replies with sql for a page of the result if page parameters are given.
+    """
+    dummy_redis.set("DUMMY_QUERY_ID", "KNOWN")
+    state_machine = QueryStateMachine(dummy_redis, "DUMMY_QUERY_ID")
+    dummy_redis.set(state_machine.state_key, QueryState.COMPLETED)
+    get_result_page_sql = Mock(
+        return_value=("DUMMY_PAGE_SQL", datetime.datetime(2016, 1, 1))
+    )
+    monkeypatch.setattr(
+        flowmachine.core.server.action_handlers,
+        "get_result_page_sql",
+        get_result_page_sql,
+    )
+    msg = await action_handler__get_sql(
+        config=server_config, query_id="DUMMY_QUERY_ID", columns=["pcod"], limit=10
+    )
+    assert msg.status == ZMQReplyStatus.SUCCESS
+    assert msg.payload["sql"] == "DUMMY_PAGE_SQL"
+    assert msg.payload["created"] == "2016-01-01T00:00:00"
+    get_result_page_sql.assert_called_once_with(
+        Query.connection,
+        "DUMMY_QUERY_ID",
+        columns=["pcod"],
+        filters=None,
+        order_by=None,
+        limit=10,
+        offset=0,
+    )
+
+    get_result_page_sql.side_effect = ValueError("DUMMY_ERROR")
+    msg = await action_handler__get_sql(
+        config=server_config, query_id="DUMMY_QUERY_ID", columns=["NOT_A_COLUMN"]
+    )
+    assert msg.status == ZMQReplyStatus.ERROR
+    assert msg.msg == "DUMMY_ERROR"
+    assert msg.payload["query_state"] == QueryState.COMPLETED
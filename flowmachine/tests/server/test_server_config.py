@@ -39,11 +39,15 @@ def test_get_server_config(monkeypatch):
     monkeypatch.setenv("FLOWMACHINE_CACHE_PRUNING_FREQUENCY", 1)
     monkeypatch.setenv("FLOWMACHINE_CACHE_PRUNING_TIMEOUT", 2)
     monkeypatch.setenv("FLOWMACHINE_SERVER_THREADPOOL_SIZE", 1)
+    monkeypatch.setenv("FLOWMACHINE_SERVER_RESULT_SQL_CACHE_SIZE", 3)
+    monkeypatch.setenv("FLOWMACHINE_SERVER_STORE_ALL_DEPENDENCIES", "true")
     config = get_server_config()
-    assert len(config) == 6
+    assert len(config) == 8
     assert config.port == 5678
     assert config.debug_mode
     assert not config.store_dependencies
+    assert config.store_all_dependencies
+    assert config.result_sql_cache_size == 3
     assert config.cache_pruning_timeout == 2
     assert config.cache_pruning_frequency == 1
     assert config.server_thread_pool._max_workers == 1
@@ -59,11 +63,15 @@ def test_get_server_config_defaults(monkeypatch):
     monkeypatch.delenv("FLOWMACHINE_CACHE_PRUNING_FREQUENCY", raising=False)
     monkeypatch.delenv("FLOWMACHINE_CACHE_PRUNING_TIMEOUT", raising=False)
     monkeypatch.delenv("FLOWMACHINE_SERVER_THREADPOOL_SIZE", raising=False)
+    monkeypatch.delenv("FLOWMACHINE_SERVER_RESULT_SQL_CACHE_SIZE", raising=False)
+    monkeypatch.delenv("FLOWMACHINE_SERVER_STORE_ALL_DEPENDENCIES", raising=False)
     config = get_server_config()
-    assert len(config) == 6
+    assert len(config) == 8
     assert config.port == 5555
     assert not config.debug_mode
     assert config.store_dependencies
+    assert not config.store_all_dependencies
+    assert config.result_sql_cache_size == 1024
     assert config.cache_pruning_timeout == 600
     assert config.cache_pruning_frequency == 86400
     assert config.server_thread_pool._max_workers == (os.cpu_count() or 1) * 5
@@ -142,3 +142,31 @@ async def test_generic_error_catch(server_config):
         )
         mock_get_reply.assert_called_once()
         mock_socket.send_multipart.assert_called_once_with(expected_response)
+
+
+@pytest.mark.asyncio
+async def test_request_frames_returned_with_reply(server_config):
+    """
+    Test that calculate_and_send_reply_for_message sends any request frames in the envelope back with the reply
+    """
+    mock_socket = Mock()
+    mock_socket.send_multipart = CoroutineMock()
+    with patch(
+        "flowmachine.core.server.server.get_reply_for_message",
+        CoroutineMock(return_value=ZMQReply(status="success", msg="DUMMY_REPLY")),
+    ):
+        await calculate_and_send_reply_for_message(
+            socket=mock_socket,
+            return_address=b"DUMMY_RETURN_ADDRESS",
+            msg_contents="DUMMY_MESSAGE",
+            config=server_config,
+            request_frames=[b"DUMMY_REQUEST_ID"],
+        )
+        mock_socket.send_multipart.assert_called_once_with(
+            [
+                b"DUMMY_RETURN_ADDRESS",
+                b"DUMMY_REQUEST_ID",
+                b"",
+                rapidjson.dumps(ZMQReply(status="success", msg="DUMMY_REPLY")).encode(),
+            ]
+        )
@@ -5,10 +5,15 @@
 """
 Tests for cache management utilities.
 """
+import datetime
+import gc
+import weakref
+
 from cachey import Scorer
 from unittest.mock import Mock
 
 import pytest
+import sqlalchemy
 
 from flowmachine.core import Table, Query
 from flowmachine.core.cache import (
@@ -34,6 +39,24 @@ from flowmachine.core.cache import (
     get_cache_protected_period,
     set_cache_protected_period,
     watch_and_shrink_cache,
+    get_cache_records_ordered_by_score,
+    plan_cache_eviction,
+    evict_cache_records,
+    get_result_sql,
+    get_result_sql_and_created,
+    get_result_page_sql,
+    forget_result_sql,
+    queue_cache_touch,
+    flush_cache_touches,
+    _cache_touch_buffers,
+    CacheAccess,
+    read_cache_access_trace,
+    simulate_cache_policy,
+    compare_cache_policies,
+    LRUPolicy,
+    LFUPolicy,
+    GreedyDualSizeFrequencyPolicy,
+    CacheScorePolicy,
 )
 from flowmachine.core.query_state import QueryState, QueryStateMachine
 from flowmachine.features import daily_location
@@ -210,6 +233,98 @@ def test_shrink_one(flowmachine_connect):
     assert dl_aggregate.is_stored
 
 
+def test_get_cache_records_ordered_by_score(flowmachine_connect, monkeypatch):
+    """
+    Test that cache records are returned in score order without unpickling any query objects.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    dl_agg = dl.aggregate().store().result()
+    monkeypatch.setattr(
+        "flowmachine.core.cache.pickle.loads", Mock(side_effect=AssertionError)
+    )
+
+    cached_records = get_cache_records_ordered_by_score(
+        flowmachine_connect, protected_period=-1
+    )
+    assert [dl_agg.query_id, dl.query_id] == [
+        record.query_id for record in cached_records
+    ]
+    assert dl.fully_qualified_table_name == cached_records[1].fully_qualified_table_name
+    assert (
+        get_size_of_table(flowmachine_connect, dl.table_name, "cache")
+        == cached_records[1].table_size
+    )
+
+
+def test_plan_cache_eviction(flowmachine_connect):
+    """
+    Test that the eviction plan only includes enough records to get below the threshold.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    dl_aggregate = dl.aggregate().store().result()
+    flowmachine_connect.engine.execute(
+        f"UPDATE cache.cached SET cache_score_multiplier = 100 WHERE query_id='{dl_aggregate.query_id}'"
+    )
+    flowmachine_connect.engine.execute(
+        f"UPDATE cache.cached SET cache_score_multiplier = 0.5 WHERE query_id='{dl.query_id}'"
+    )
+    table_size = get_size_of_table(flowmachine_connect, dl.table_name, "cache")
+    victims = plan_cache_eviction(
+        flowmachine_connect, size_threshold=table_size, protected_period=-1
+    )
+    assert [dl.query_id] == [record.query_id for record in victims]
+    assert dl.is_stored
+
+
+def test_evict_cache_records_removes_tables_and_resets_state(flowmachine_connect):
+    """
+    Test that evicting a cache record drops the table, removes Table records pointing
+    at it, and returns the query to the known state.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    table = dl.get_table()
+    (record,) = [
+        record
+        for record in get_cache_records_ordered_by_score(
+            flowmachine_connect, protected_period=-1
+        )
+        if record.query_id == dl.query_id
+    ]
+    evicted = evict_cache_records(flowmachine_connect, dl.redis, [record])
+    assert [record] == evicted
+    assert not dl.is_stored
+    assert dl.query_state == QueryState.KNOWN
+    assert table.query_state == QueryState.KNOWN
+    assert not cache_table_exists(flowmachine_connect, table.query_id)
+
+
+def test_evict_cache_records_restores_state_on_failure(
+    flowmachine_connect, monkeypatch
+):
+    """
+    Test that a failed eviction leaves the records in place and returns the queries
+    to their previous state.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    (record,) = [
+        record
+        for record in get_cache_records_ordered_by_score(
+            flowmachine_connect, protected_period=-1
+        )
+        if record.query_id == dl.query_id
+    ]
+    monkeypatch.setattr(
+        flowmachine_connect.engine,
+        "begin",
+        Mock(side_effect=RuntimeError("Database went away")),
+    )
+    with pytest.raises(RuntimeError):
+        evict_cache_records(flowmachine_connect, dl.redis, [record])
+    monkeypatch.undo()
+    assert dl.query_state == QueryState.COMPLETED
+    assert dl.is_stored
+
+
 def test_shrink_to_size_does_nothing_when_cache_ok(flowmachine_connect):
     """
     Test that shrink_below_size doesn't remove anything if cache size is within limit.
@@ -613,3 +728,233 @@ async def test_cache_watch_does_timeout(flowmachine_connect, json_log):
         log_lines[0]["event"]
         == "Failed to complete cache shrink within 0s. Trying again in 0s."
     )
+
+
+def test_queued_cache_touches(flowmachine_connect):
+    """
+    Test that queued cache touches are written in order when flushed, matching touching directly.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    dl_2 = daily_location("2016-01-02").store().result()
+    cachey_scorer = Scorer(halflife=1000.0)
+    for query in (dl, dl_2):
+        cachey_scorer.touch(
+            query.query_id,
+            get_compute_time(flowmachine_connect, query.query_id)
+            / get_size_of_table(flowmachine_connect, query.table_name, "cache"),
+        )
+    expected_scores = {}
+    for query_id in (dl.query_id, dl_2.query_id, dl.query_id):
+        queue_cache_touch(flowmachine_connect, query_id)
+        expected_scores[query_id] = cachey_scorer.touch(query_id)
+    queue_cache_touch(flowmachine_connect, "NOT_IN_CACHE")  # Should be skipped
+    flush_cache_touches(flowmachine_connect)
+    for query_id, expected_score in expected_scores.items():
+        assert expected_score == pytest.approx(get_score(flowmachine_connect, query_id))
+
+
+def test_queued_cache_touches_are_committed(flowmachine_connect):
+    """
+    Test that flushed cache touches are visible from another connection.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    access_count_sql = (
+        f"SELECT access_count FROM cache.cached WHERE query_id='{dl.query_id}'"
+    )
+    access_count = flowmachine_connect.fetch(access_count_sql)[0][0]
+    queue_cache_touch(flowmachine_connect, dl.query_id)
+    queue_cache_touch(flowmachine_connect, dl.query_id)
+    flush_cache_touches(flowmachine_connect)
+    engine = sqlalchemy.create_engine(
+        flowmachine_connect.engine.url, poolclass=sqlalchemy.pool.NullPool
+    )
+    assert access_count + 2 == engine.execute(access_count_sql).fetchall()[0][0]
+
+
+def test_get_result_sql_is_remembered(flowmachine_connect, monkeypatch):
+    """
+    Test that result sql is remembered, so the query object is only unpickled once.
+    """
+    forget_result_sql()
+    dl = daily_location("2016-01-01").store().result()
+    expected_sql = f"SELECT * FROM {dl.fully_qualified_table_name}"
+    assert get_result_sql(flowmachine_connect, dl.query_id) == expected_sql
+    monkeypatch.setattr(
+        "flowmachine.core.cache.pickle.loads", Mock(side_effect=AssertionError)
+    )
+    assert get_result_sql(flowmachine_connect, dl.query_id) == expected_sql
+    flush_cache_touches(flowmachine_connect)
+    assert (
+        3
+        == flowmachine_connect.fetch(
+            f"SELECT access_count FROM cache.cached WHERE query_id='{dl.query_id}'"
+        )[0][0]
+    )
+
+
+def test_get_result_sql_forgotten_on_invalidate(flowmachine_connect):
+    """
+    Test that result sql is no longer used after a query is removed from cache.
+    """
+    forget_result_sql()
+    dl = daily_location("2016-01-01").store().result()
+    get_result_sql(flowmachine_connect, dl.query_id)
+    dl.invalidate_db_cache()
+    with pytest.raises(ValueError):
+        get_result_sql(flowmachine_connect, dl.query_id)
+
+
+def test_get_result_sql_checks_query_is_still_cached(flowmachine_connect):
+    """
+    Test that remembered result sql isn't used after another process removes the query from cache.
+    """
+    forget_result_sql()
+    dl = daily_location("2016-01-01").store().result()
+    get_result_sql(flowmachine_connect, dl.query_id)
+    flowmachine_connect.engine.execute(
+        f"DELETE FROM cache.cached WHERE query_id='{dl.query_id}'"
+    )
+    with pytest.raises(ValueError):
+        get_result_sql(flowmachine_connect, dl.query_id)
+
+
+def test_cache_touch_buffer_does_not_keep_connection_alive():
+    """
+    Test that queued cache touches don't keep a connection alive, and the thread writing them stops once it is gone.
+    """
+    connection = Mock()
+    queue_cache_touch(connection, "DUMMY_QUERY_ID", flush_interval=60)
+    buffer = _cache_touch_buffers[connection]
+    connection_ref = weakref.ref(connection)
+    del connection
+    gc.collect()
+    assert connection_ref() is None
+    assert buffer not in list(_cache_touch_buffers.values())
+    buffer._flush_requested.set()
+    buffer._thread.join(timeout=5)
+    assert not buffer._thread.is_alive()
+
+
+def test_get_result_sql_and_created(flowmachine_connect):
+    """
+    Test that the time a result was cached is returned with its sql, and remembered.
+    """
+    forget_result_sql()
+    dl = daily_location("2016-01-01").store().result()
+    created = flowmachine_connect.fetch(
+        f"SELECT created FROM cache.cached WHERE query_id='{dl.query_id}'"
+    )[0][0]
+    expected = (f"SELECT * FROM {dl.fully_qualified_table_name}", created)
+    assert get_result_sql_and_created(flowmachine_connect, dl.query_id) == expected
+    assert get_result_sql_and_created(flowmachine_connect, dl.query_id) == expected
+
+
+def test_get_result_page_sql_is_remembered(flowmachine_connect, monkeypatch):
+    """
+    Test that page sql for a result is built from remembered metadata, so the query object is only unpickled once.
+    """
+    forget_result_sql()
+    dl = daily_location("2016-01-01").store().result()
+    sql, created = get_result_page_sql(
+        flowmachine_connect, dl.query_id, columns=["subscriber"], limit=10
+    )
+    assert created == get_result_sql_and_created(flowmachine_connect, dl.query_id)[1]
+    monkeypatch.setattr(
+        "flowmachine.core.cache.pickle.loads", Mock(side_effect=AssertionError)
+    )
+    assert (sql, created) == get_result_page_sql(
+        flowmachine_connect, dl.query_id, columns=["subscriber"], limit=10
+    )
+    assert sql == dl.get_page_query(columns=["subscriber"], limit=10)
+    assert len(flowmachine_connect.fetch(sql)) == 10
+
+
+def test_get_result_sql_and_created_rereads_created(flowmachine_connect):
+    """
+    Test that the time a result was cached is up to date when the query has been cached again by another process.
+    """
+    forget_result_sql()
+    dl = daily_location("2016-01-01").store().result()
+    _, created = get_result_sql_and_created(flowmachine_connect, dl.query_id)
+    flowmachine_connect.engine.execute(
+        f"UPDATE cache.cached SET created = created + interval '1 hour' WHERE query_id='{dl.query_id}'"
+    )
+    assert get_result_sql_and_created(flowmachine_connect, dl.query_id) == (
+        f"SELECT * FROM {dl.fully_qualified_table_name}",
+        created + datetime.timedelta(hours=1),
+    )
+
+
+def _make_trace(*accesses):
+    now = datetime.datetime.now()
+    return [
+        CacheAccess(
+            query_id=query_id, timestamp=now, table_size=size, compute_time=time
+        )
+        for query_id, size, time in accesses
+    ]
+
+
+def test_read_cache_access_trace():
+    """
+    Test that cache accesses are read from log lines, and other lines are ignored.
+    """
+    log_lines = [
+        '{"event": "Touched cache", "logger": "flowmachine.debug"}',
+        "Not JSON",
+        '{"query_id": "a", "table_size": 10, "compute_time": 1.5, "event": "cache_access", '
+        '"logger": "flowmachine.cache_trace", "level": "info", "timestamp": "2020-01-01T00:00:00.000000Z"}',
+    ]
+    assert read_cache_access_trace(log_lines) == [
+        CacheAccess(
+            query_id="a",
+            timestamp=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+            table_size=10,
+            compute_time=1.5,
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "policy, expected_hits",
+    [
+        (LRUPolicy(), 1),  # 'a' evicted by 'c', 'b' evicted by 'a'
+        (LFUPolicy(), 2),  # 'b' evicted by 'c' and 'c' by 'b' as 'a' is used most
+        (GreedyDualSizeFrequencyPolicy(), 2),
+        (CacheScorePolicy(), 2),
+    ],
+)
+def test_simulate_cache_policy(policy, expected_hits):
+    """
+    Test that replaying a trace counts hits according to the policy's evictions.
+    """
+    trace = _make_trace(
+        ("a", 1, 10), ("a", 1, 10), ("b", 1, 1), ("c", 1, 1), ("a", 1, 10), ("b", 1, 1),
+    )
+    result = simulate_cache_policy(policy, trace, cache_size=2)
+    assert result.hits == expected_hits
+    assert result.misses == len(trace) - expected_hits
+    assert result.hit_rate == expected_hits / len(trace)
+
+
+def test_simulate_cache_policy_skips_oversized():
+    """
+    Test that queries bigger than the cache are never cached.
+    """
+    trace = _make_trace(("a", 1, 1), ("big", 10, 100), ("big", 10, 100), ("a", 1, 1))
+    result = simulate_cache_policy(LRUPolicy(), trace, cache_size=2)
+    assert result.hits == 1
+    assert result.evictions == 0
+    assert result.compute_time_saved == 1
+
+
+def test_compare_cache_policies():
+    """
+    Test that comparing policies gives one row per policy, best first.
+    """
+    trace = _make_trace(
+        ("a", 1, 10), ("a", 1, 10), ("b", 1, 1), ("c", 1, 1), ("a", 1, 10)
+    )
+    comparison = compare_cache_policies(trace, cache_size=2)
+    assert set(comparison.policy) == {"lru", "lfu", "gdsf", "cache_score"}
+    assert comparison.hit_rate.is_monotonic_decreasing
@@ -6,6 +6,7 @@
 Unit tests for the Connection() class. 
 """
 import datetime
+import time
 from unittest.mock import Mock
 import pytest
 
@@ -87,6 +88,33 @@ def test_available_dates(flowmachine_connect):
     assert datetime.date(2016, 9, 9) not in flowmachine_connect.available_dates["calls"]
 
 
+def test_available_dates_updated_on_etl_notification(flowmachine_connect):
+    """Test that available dates are updated when FlowETL notifies of ingestion."""
+    assert datetime.date(2016, 9, 9) not in flowmachine_connect.available_dates["calls"]
+    try:
+        flowmachine_connect.engine.execute(
+            """
+            INSERT INTO etl.etl_records (cdr_type, cdr_date, state, timestamp) VALUES ('calls', '2016-09-09'::DATE, 'ingested', NOW());
+            SELECT pg_notify('etl_records_updated', 'calls');
+            """
+        )
+        for _ in range(50):
+            if (
+                datetime.date(2016, 9, 9)
+                in flowmachine_connect.available_dates["calls"]
+            ):
+                break
+            time.sleep(0.1)
+        assert datetime.date(2016, 9, 9) in flowmachine_connect.available_dates["calls"]
+    finally:
+        flowmachine_connect.engine.execute(
+            """
+            DELETE FROM etl.etl_records WHERE cdr_type='calls' AND cdr_date='2016-09-09'::DATE;
+            SELECT pg_notify('etl_records_updated', 'calls');
+            """
+        )
+
+
 def test_location_id(flowmachine_connect):
     """Test that we can get the location_id lookup table from the db."""
     assert "infrastructure.cells" == flowmachine_connect.location_table
@@ -97,3 +125,83 @@ def test_location_tables(flowmachine_connect):
     assert sorted(["calls", "mds", "sms", "topups"]) == sorted(
         flowmachine_connect.location_tables
     )
+
+
+def test_table_metadata_is_cached(test_tables, monkeypatch):
+    """
+    Test that table existence and columns are only looked up from the database once.
+    """
+    assert test_tables.has_table("test_table_b", schema="public")
+    assert ["id", "field", "numeric_field"] == test_tables.get_columns(
+        "test_table_b", "public"
+    )
+    sqlalchemy_table = test_tables.get_sqlalchemy_table("public.test_table_b")
+    monkeypatch.setattr(test_tables, "fetch", Mock(side_effect=AssertionError))
+    monkeypatch.setattr(
+        test_tables,
+        "engine",
+        Mock(
+            side_effect=AssertionError,
+            **{
+                f"{method}.side_effect": AssertionError
+                for method in ("begin", "connect", "execute", "raw_connection")
+            },
+        ),
+    )
+    assert test_tables.has_table("test_table_b", schema="public")
+    assert ["id", "field", "numeric_field"] == test_tables.get_columns(
+        "test_table_b", "public"
+    )
+    assert sqlalchemy_table is test_tables.get_sqlalchemy_table("public.test_table_b")
+
+
+def test_invalidate_table_metadata(test_tables):
+    """
+    Test that invalidating table metadata means changes are seen.
+    """
+    assert test_tables.has_table("test_table_b", schema="public")
+    test_tables.engine.execute("DROP TABLE test_table_b")
+    assert test_tables.has_table("test_table_b", schema="public")
+    test_tables.invalidate_table_metadata(name="test_table_b", schema="public")
+    assert not test_tables.has_table("test_table_b", schema="public")
+
+
+def test_missing_cache_tables_are_not_remembered(flowmachine_connect):
+    """
+    Test that the absence of tables in the cache schema is not cached.
+    """
+    assert not flowmachine_connect.has_table("x_not_there", schema="cache")
+    assert ("has_table", "cache", "x_not_there") not in (
+        flowmachine_connect._metadata_cache
+    )
+
+
+def test_dropped_cache_tables_are_not_remembered(flowmachine_connect):
+    """
+    Test that a cache table dropped by another process is not reported as existing.
+    """
+    flowmachine_connect.engine.execute("CREATE TABLE cache.x_dropped (id int)")
+    assert flowmachine_connect.has_table("x_dropped", schema="cache")
+    flowmachine_connect.engine.execute("DROP TABLE cache.x_dropped")
+    assert not flowmachine_connect.has_table("x_dropped", schema="cache")
+
+
+def test_table_checksum(test_tables):
+    """
+    Test that a table's checksum changes when its contents change.
+    """
+    checksum = test_tables.get_table_checksum("test_table_b", "public")
+    assert checksum == test_tables.get_table_checksum("test_table_b", "public")
+    test_tables.engine.execute("DELETE FROM test_table_b WHERE id = 1")
+    test_tables.invalidate_table_metadata(name="test_table_b", schema="public")
+    assert checksum != test_tables.get_table_checksum("test_table_b", "public")
+
+
+def test_table_comment(test_tables):
+    """
+    Test that table comments can be retrieved.
+    """
+    assert test_tables.get_table_comment("test_table_b", "public") is None
+    test_tables.engine.execute("COMMENT ON TABLE test_table_b IS 'A comment'")
+    assert test_tables.get_table_comment("test_table_b", "public") == "A comment"
+    assert test_tables.get_table_comment("not_a_table", "public") is None
@@ -0,0 +1,100 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Tests for reading query results using COPY.
+"""
+import datetime
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+from flowmachine.core.copy_utils import read_sql_via_copy
+from flowmachine.features import EventTableSubset
+
+
+def test_read_sql_via_copy_types(flowmachine_connect):
+    """
+    Test that text, numeric, boolean, date, timestamp and geometry columns are read correctly,
+    including nulls and empty strings.
+    """
+    sql = """
+    SELECT * FROM (VALUES
+        ('a,"b"', 1, 1.5::numeric, TRUE, '2016-01-01'::date, '2016-01-01 10:00:00+00'::timestamptz, ST_SetSRID(ST_Point(1, 2), 4326)),
+        ('', 2, 2.5::numeric, FALSE, '2016-01-02'::date, '2016-01-02 10:00:00+00'::timestamptz, NULL),
+        (NULL, 3, NULL, NULL, NULL, NULL, ST_SetSRID(ST_Point(3, 4), 4326)),
+        ('\\N', 4, 4.5::numeric, TRUE, '2016-01-04'::date, '2016-01-04 10:00:00+00'::timestamptz, NULL)
+    ) AS t(text_col, int_col, numeric_col, bool_col, date_col, timestamptz_col, geom_col)
+    """
+    df = read_sql_via_copy(sql, flowmachine_connect.engine)
+    expected = pd.read_sql_query(sql, con=flowmachine_connect.engine)
+    assert df.text_col.tolist() == ['a,"b"', "", None, "\\N"]
+    assert df.int_col.tolist() == [1, 2, 3, 4]
+    assert df.numeric_col.tolist()[:2] == [1.5, 2.5]
+    assert pd.isna(df.numeric_col[2])
+    assert df.bool_col.tolist() == [True, False, None, True]
+    assert df.date_col.tolist()[:3] == [
+        datetime.date(2016, 1, 1),
+        datetime.date(2016, 1, 2),
+        None,
+    ]
+    assert df.timestamptz_col.dtype == expected.timestamptz_col.dtype
+    assert df.timestamptz_col[:2].tolist() == expected.timestamptz_col[:2].tolist()
+    assert df.geom_col.tolist() == expected.geom_col.tolist()
+
+
+@pytest.mark.parametrize(
+    "timestamps",
+    [
+        ["2016-01-01 10:00:00+00", "2016-01-02 10:00:00+00"],
+        ["2016-01-01 10:00:00+00", "2016-07-01 10:00:00+00"],
+    ],
+)
+def test_read_sql_via_copy_timestamptz_matches_read_sql_query(
+    flowmachine_connect, timestamps
+):
+    """
+    Test that timestamp with time zone columns have the same dtype and values as
+    with read_sql_query, when the connection's time zone isn't UTC.
+    """
+    engine = sqlalchemy.create_engine(
+        flowmachine_connect.engine.url,
+        connect_args={"options": "-c timezone=Europe/London"},
+    )
+    values = ", ".join(f"('{timestamp}'::timestamptz)" for timestamp in timestamps)
+    sql = f"SELECT * FROM (VALUES {values}, (NULL)) AS t(timestamptz_col)"
+    df = read_sql_via_copy(sql, engine)
+    expected = pd.read_sql_query(sql, con=engine)
+    assert df.timestamptz_col.dtype == expected.timestamptz_col.dtype
+    assert df.timestamptz_col.tolist()[:2] == expected.timestamptz_col.tolist()[:2]
+    assert pd.isna(df.timestamptz_col[2])
+
+
+def test_read_sql_via_copy_unsupported_types(flowmachine_connect):
+    """
+    Test that None is returned for queries with column types which can't be read using COPY.
+    """
+    assert (
+        read_sql_via_copy("SELECT ARRAY[1, 2] AS array_col", flowmachine_connect.engine)
+        is None
+    )
+
+
+def test_get_dataframe_matches_read_sql_query(flowmachine_connect):
+    """
+    Test that get_dataframe gives the same result as reading with pandas.
+    """
+    sd = EventTableSubset(
+        start="2016-01-01", stop="2016-01-02", columns=["msisdn", "datetime", "id"]
+    )
+    expected = pd.read_sql_query(
+        f"SELECT {sd.column_names_as_string_list} FROM ({sd.get_query()}) _",
+        con=flowmachine_connect.engine,
+    )
+    df = sd.get_dataframe()
+    assert expected.msisdn.tolist() == df.msisdn.tolist()
+    assert expected.id.tolist() == df.id.tolist()
+    assert expected.datetime.dtype == df.datetime.dtype
+    assert expected.datetime.tolist() == df.datetime.tolist()
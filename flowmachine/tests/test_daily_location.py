@@ -6,7 +6,18 @@ import pytest
 
 from flowmachine.core.errors import MissingDateError
 from flowmachine.core import make_spatial_unit
-from flowmachine.features import daily_location, MostFrequentLocation
+from flowmachine.core.cache import write_cache_metadata
+from flowmachine.core.errors.flowmachine_errors import (
+    QueryCancelledException,
+    QueryErroredException,
+)
+from flowmachine.core.query_state import QueryEvent, QueryStateMachine
+from flowmachine.features import (
+    daily_location,
+    MostFrequentLocation,
+    precompute_daily_locations,
+    store_daily_locations_batch,
+)
 
 
 def test_equivalent_to_locate_subscribers(get_dataframe):
@@ -79,3 +90,104 @@ def test_daily_locs_errors():
 
     with pytest.raises(MissingDateError):
         daily_location("2016-01-31")
+
+
+def test_precompute_daily_locations(get_dataframe):
+    """
+    precompute_daily_locations stores daily locations for each date, spatial unit and method, with the same results as daily_location.
+    """
+    dates = ["2016-01-01", "2016-01-02"]
+    spatial_units = [
+        make_spatial_unit("admin", level=2),
+        make_spatial_unit("admin", level=3),
+    ]
+    dls = [
+        daily_location(date, spatial_unit=spatial_unit, method="last")
+        for date in dates
+        for spatial_unit in spatial_units
+    ]
+    expected = [get_dataframe(dl) for dl in dls]
+    stored = precompute_daily_locations(
+        dates, spatial_units, methods=["last", "most-common"]
+    ).result()
+    assert len(stored) == 8
+    assert all(dl.is_stored for dl in stored)
+    for dl, expected_df in zip(dls, expected):
+        assert dl.is_stored
+        df = get_dataframe(dl)
+        assert sorted(map(tuple, df.values.tolist())) == sorted(
+            map(tuple, expected_df.values.tolist())
+        )
+
+
+def test_store_daily_locations_batch_skips_stored():
+    """
+    store_daily_locations_batch leaves already stored daily locations alone.
+    """
+    stored_dl = daily_location("2016-01-01")
+    stored_dl.store().result()
+    created = stored_dl.connection.fetch(
+        f"SELECT created FROM cache.cached WHERE query_id='{stored_dl.query_id}'"
+    )[0][0]
+    unstored_dl = daily_location("2016-01-01", method="most-common")
+    store_daily_locations_batch([stored_dl, unstored_dl]).result()
+    assert unstored_dl.is_stored
+    assert (
+        stored_dl.connection.fetch(
+            f"SELECT created FROM cache.cached WHERE query_id='{stored_dl.query_id}'"
+        )[0][0]
+        == created
+    )
+
+
+def test_store_daily_locations_batch_metadata_error(monkeypatch):
+    """
+    If writing the cache metadata for one daily location fails, the others sharing its
+    events are marked as errored rather than left executing.
+    """
+    dls = [
+        daily_location("2016-01-01", method="last"),
+        daily_location("2016-01-01", method="most-common"),
+    ]
+
+    def fail_first(connection, query, compute_time=None):
+        if query.query_id == dls[0].query_id:
+            raise RuntimeError("DUMMY_ERROR")
+        return write_cache_metadata(connection, query, compute_time=compute_time)
+
+    monkeypatch.setattr(
+        "flowmachine.features.subscriber.daily_location_batch.write_cache_metadata",
+        fail_first,
+    )
+    with pytest.raises(RuntimeError, match="DUMMY_ERROR"):
+        store_daily_locations_batch(dls).result()
+    assert QueryStateMachine(dls[0].redis, dls[0].query_id).is_errored
+    assert QueryStateMachine(dls[1].redis, dls[1].query_id).is_completed
+
+
+@pytest.mark.parametrize(
+    "fail_event, expected_exception",
+    [
+        (QueryEvent.CANCEL, QueryCancelledException),
+        (QueryEvent.ERROR, QueryErroredException),
+    ],
+)
+def test_store_daily_locations_batch_raises_for_failed_elsewhere(
+    fail_event, expected_exception
+):
+    """
+    store_daily_locations_batch raises an error if a daily location it waited for
+    failed to be stored elsewhere, rather than reporting that it is stored.
+    """
+    dls = [
+        daily_location("2016-01-01", method="last"),
+        daily_location("2016-01-01", method="most-common"),
+    ]
+    qsm = QueryStateMachine(dls[0].redis, dls[0].query_id)
+    qsm.enqueue()
+    qsm.execute()
+    qsm.trigger_event(fail_event)
+    with pytest.raises(expected_exception):
+        store_daily_locations_batch(dls).result()
+    assert not dls[0].is_stored
+    assert dls[1].is_stored
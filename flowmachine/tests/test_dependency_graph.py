@@ -5,6 +5,12 @@
 """
 Tests for flowmachine dependency graph functions
 """
+import threading
+from functools import partial
+import time
+from concurrent.futures import wait
+
+import networkx as nx
 import pytest
 import re
 import textwrap
@@ -14,7 +20,7 @@ from io import StringIO
 from flowmachine.core import CustomQuery
 from flowmachine.core.dummy_query import DummyQuery
 from flowmachine.core.subscriber_subsetter import make_subscriber_subsetter
-from flowmachine.features import daily_location, EventTableSubset
+from flowmachine.features import daily_location, EventTableSubset, ContactReciprocal
 
 from flowmachine.core.dependency_graph import (
     print_dependency_tree,
@@ -22,6 +28,9 @@ from flowmachine.core.dependency_graph import (
     unstored_dependencies_graph,
     plot_dependency_graph,
     store_queries_in_order,
+    _critical_path_lengths,
+    common_subexpressions,
+    store_common_subexpressions,
 )
 
 
@@ -83,6 +92,21 @@ def test_calculate_dependency_graph():
     )
     assert f"x{sd.query_id}" in G.nodes()
     assert G.nodes[f"x{sd.query_id}"]["query_object"].query_id == sd.query_id
+    assert G.nodes[f"x{query.query_id}"]["references"] == 1
+
+
+def test_calculate_dependency_graph_counts_references():
+    """
+    Test that calculate_dependency_graph() counts each time a shared query is evaluated.
+    """
+    query = ContactReciprocal("2016-01-01", "2016-01-02")
+    unioned = query.contact_in_query.unioned_query
+    assert unioned.query_id == query.contact_out_query.unioned_query.query_id
+    G = calculate_dependency_graph(query)
+    assert G.nodes[f"x{unioned.query_id}"]["references"] == 2
+    query.contact_in_query.store().result()
+    G = calculate_dependency_graph(query)
+    assert G.nodes[f"x{unioned.query_id}"]["references"] == 1
 
 
 def test_unstored_dependencies_graph():
@@ -155,7 +179,7 @@ def test_store_queries_in_order():
         def store(self):
             for query in self.dependencies:
                 assert query.is_stored
-            super().store()
+            return super().store()
 
     dummy1 = QueryWithStoreAssertions(dummy_param=["dummy1"])
     dummy2 = QueryWithStoreAssertions(dummy_param=["dummy2"])
@@ -164,3 +188,111 @@ def test_store_queries_in_order():
     dummy5 = QueryWithStoreAssertions(dummy_param=["dummy5", dummy3, dummy4])
     graph = calculate_dependency_graph(dummy5)
     store_queries_in_order(graph)
+
+
+def test_store_queries_in_order_limits_concurrency():
+    """
+    Test that store_queries_in_order() never runs more than max_concurrent_stores stores at once.
+    """
+    lock = threading.Lock()
+    counts = dict(running=0, max_running=0)
+
+    class SlowDummyQuery(DummyQuery):
+        def store(self):
+            def slow_store():
+                with lock:
+                    counts["running"] += 1
+                    counts["max_running"] = max(
+                        counts["max_running"], counts["running"]
+                    )
+                time.sleep(0.1)
+                with lock:
+                    counts["running"] -= 1
+                return DummyQuery.store(self).result()
+
+            return self.thread_pool_executor.submit(slow_store)
+
+    leaves = [SlowDummyQuery(dummy_param=[f"leaf{i}"]) for i in range(6)]
+    root = SlowDummyQuery(dummy_param=["root", *leaves])
+    graph = calculate_dependency_graph(root)
+    futures = store_queries_in_order(graph, max_concurrent_stores=2)
+    wait(list(futures.values()))
+    assert counts["max_running"] <= 2
+    assert all(query.is_stored for query in [root, *leaves])
+
+
+def test_store_queries_in_order_does_not_store_dependents_of_failed_query():
+    """
+    Test that store_queries_in_order() doesn't store queries whose dependencies failed to store, and fails them with the same error.
+    """
+    error = ValueError("DUMMY_ERROR")
+
+    class FailingDummyQuery(DummyQuery):
+        def store(self):
+            def fail():
+                raise error
+
+            return self.thread_pool_executor.submit(fail)
+
+    failing = FailingDummyQuery(dummy_param=["failing"])
+    other = DummyQuery(dummy_param=["other"])
+    dependent = DummyQuery(dummy_param=["dependent", failing, other])
+    root = DummyQuery(dummy_param=["root", dependent])
+    graph = calculate_dependency_graph(root)
+    futures = store_queries_in_order(graph, max_concurrent_stores=1)
+    wait(list(futures.values()))
+    assert futures[f"x{other.query_id}"].exception() is None
+    for query in (failing, dependent, root):
+        assert futures[f"x{query.query_id}"].exception() is error
+    assert other.is_stored
+    assert not dependent.is_stored
+    assert not root.is_stored
+
+
+def test_critical_path_lengths():
+    """
+    Test that critical path lengths sum costs along the most expensive chain of dependents.
+    """
+    graph = nx.DiGraph([("root", "a"), ("root", "b"), ("a", "c"), ("b", "c")])
+    costs = dict(root=1, a=5, b=2, c=1)
+    assert _critical_path_lengths(graph, costs) == dict(root=1, a=6, b=3, c=7)
+
+
+def test_common_subexpressions():
+    """
+    Test that common_subexpressions() returns shared queries, only if they are costly enough.
+    """
+    query = ContactReciprocal("2016-01-01", "2016-01-02")
+    unioned = query.contact_in_query.unioned_query
+    assert [q.query_id for q in common_subexpressions(query, min_cost=0)] == [
+        unioned.query_id
+    ]
+    assert common_subexpressions(query, min_cost=float("inf")) == []
+
+
+def test_store_common_subexpressions():
+    """
+    Test that store_common_subexpressions() stores shared queries, and nothing else.
+    """
+    query = ContactReciprocal("2016-01-01", "2016-01-02")
+    store_common_subexpressions(query, min_cost=0)
+    assert query.contact_in_query.unioned_query.is_stored
+    assert not query.contact_in_query.is_stored
+    assert not query.contact_out_query.is_stored
+    assert common_subexpressions(query, min_cost=0) == []
+
+
+def test_store_shared_dependencies_is_opt_in(monkeypatch):
+    """
+    Test that shared dependencies are only stored first if asked for.
+    """
+    monkeypatch.setattr(
+        "flowmachine.core.query.store_common_subexpressions",
+        partial(store_common_subexpressions, min_cost=0),
+    )
+    query = ContactReciprocal("2016-01-01", "2016-01-02")
+    query.store().result()
+    assert not query.contact_in_query.unioned_query.is_stored
+    query.invalidate_db_cache()
+    query.store(store_shared_dependencies=True).result()
+    assert query.contact_in_query.unioned_query.is_stored
@@ -11,6 +11,7 @@ import pytz
 from datetime import datetime
 
 from flowmachine.core.errors import MissingDateError
+from flowmachine.core.sqlalchemy_utils import get_sql_string
 from flowmachine.features.utilities.event_table_subset import EventTableSubset
 
 
@@ -170,3 +171,61 @@ def test_avoids_searching_extra_tables(get_dataframe):
     sd = EventTableSubset(start="2016-01-01", stop="2016-01-02")
     explain_string = sd.explain()
     assert "calls_20160103" not in explain_string
+
+
+@pytest.mark.parametrize(
+    "subscriber_subset", [None, ["038OVABN11Ak4W5P", "09NrjaNNvDanD8pk"]]
+)
+def test_selects_from_child_tables(subscriber_subset, flowmachine_connect):
+    """
+    Test that the subset selects from the child table for each ingested date,
+    and gets the same rows as selecting from the parent table.
+    """
+    sd = EventTableSubset(
+        start="2016-01-01 12:00:00",
+        stop="2016-01-03",
+        hours=(10, 20),
+        subscriber_subset=subscriber_subset,
+    )
+    sql = sd.get_query()
+    assert "events.calls_20160101" in sql
+    assert "events.calls_20160102" in sql
+    assert "events.calls_20160103" not in sql
+    assert "events.calls." not in sql
+    parent_sql = get_sql_string(sd._make_select_from_table(sd.sqlalchemy_table))
+    assert sorted(flowmachine_connect.fetch(sql)) == sorted(
+        flowmachine_connect.fetch(parent_sql)
+    )
+
+
+def test_selects_from_parent_table_if_child_missing(flowmachine_connect, monkeypatch):
+    """
+    Test that the parent table is used if any ingested date doesn't have a child table.
+    """
+    sd = EventTableSubset(start="2016-01-01", stop="2016-01-03")
+    monkeypatch.setattr(
+        flowmachine_connect,
+        "has_table",
+        lambda name, schema=None: name != "calls_20160102",
+    )
+    assert "calls_2016" not in sd.get_query()
+
+
+def test_selects_from_parent_table_if_date_not_ingested(
+    flowmachine_connect, monkeypatch
+):
+    """
+    Test that the parent table is used if any date in the range isn't recorded as ingested,
+    because its rows may only be in the parent table.
+    """
+    available_dates = dict(flowmachine_connect.available_dates)
+    available_dates["calls"] = [
+        d for d in available_dates["calls"] if d.strftime("%Y-%m-%d") != "2016-01-02"
+    ]
+    monkeypatch.setattr(
+        type(flowmachine_connect),
+        "available_dates",
+        property(lambda self: available_dates),
+    )
+    sd = EventTableSubset(start="2016-01-01", stop="2016-01-04")
+    assert "calls_2016" not in sd.get_query()
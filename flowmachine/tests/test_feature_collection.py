@@ -6,9 +6,21 @@
 Tests for flowmachine.feature_collection
 """
 
+import pytest
+from pandas.testing import assert_frame_equal
+
 from flowmachine import feature_collection
 from flowmachine.core import CustomQuery
-from flowmachine.features import RadiusOfGyration, NocturnalEvents, SubscriberDegree
+from flowmachine.core.dependency_graph import store_all_unstored_dependencies
+from flowmachine.features import (
+    EventCount,
+    FusedFeatureCollection,
+    FusedSubscriberFeatures,
+    RadiusOfGyration,
+    NocturnalEvents,
+    SubscriberCallDurations,
+    SubscriberDegree,
+)
 from flowmachine.features.utilities.feature_collection import (
     feature_collection_from_list_of_classes,
 )
@@ -82,3 +94,63 @@ def test_dropna(get_length):
     # usully without dropna=False this query would only return
     # a single row. We check that this is not the case.
     assert get_length(fc) > 1
+
+
+@pytest.mark.parametrize("dropna", [True, False])
+def test_fused_feature_collection_matches_joined(get_dataframe, dropna):
+    """
+    Test that a fused feature collection gives the same result as the joined features.
+    """
+    start, stop = "2016-01-01", "2016-01-03"
+    metrics = [
+        EventCount(start, stop, direction="out"),
+        RadiusOfGyration(start, stop),
+        NocturnalEvents(start, stop),
+        SubscriberDegree(start, stop, direction="in"),
+        SubscriberCallDurations(start, stop),
+    ]
+    fc = feature_collection(metrics, dropna=dropna, fused=True)
+    assert isinstance(fc, FusedFeatureCollection)
+    assert len(fc.fused_features) == 1
+    expected = get_dataframe(feature_collection(metrics, dropna=dropna))
+    df = get_dataframe(fc)
+    assert fc.column_names == expected.columns.tolist()
+    assert_frame_equal(
+        df.sort_values("subscriber").reset_index(drop=True),
+        expected.sort_values("subscriber").reset_index(drop=True),
+    )
+
+
+def test_fused_feature_collection_stores_features():
+    """
+    Test that storing the dependencies of a fused feature collection stores each fused feature.
+    """
+    start, stop = "2016-01-01", "2016-01-03"
+    metrics = [
+        EventCount(start, stop),
+        NocturnalEvents(start, stop),
+        SubscriberDegree(start, stop),
+    ]
+    expected = [metric.get_dataframe() for metric in metrics]
+    fc = feature_collection(metrics, fused=True)
+    store_all_unstored_dependencies(fc)
+    assert fc.fused_features == []
+    for metric, expected_df in zip(metrics, expected):
+        assert metric.is_stored
+        assert_frame_equal(
+            metric.get_dataframe().sort_values("subscriber").reset_index(drop=True),
+            expected_df.sort_values("subscriber").reset_index(drop=True),
+        )
+
+
+def test_fused_subscriber_features_rejects_different_events():
+    """
+    Test that features aggregating different events can't be fused.
+    """
+    with pytest.raises(ValueError):
+        FusedSubscriberFeatures(
+            [
+                EventCount("2016-01-01", "2016-01-03"),
+                EventCount("2016-01-01", "2016-01-02"),
+            ]
+        )
@@ -0,0 +1,105 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Tests for choosing which dependencies to store from cache reuse history.
+"""
+from functools import partial
+
+import pytest
+
+from flowmachine.core.cache import ClassReuseStatistics, get_class_reuse_statistics
+from flowmachine.core.dependency_graph import (
+    common_subexpressions,
+    store_all_unstored_dependencies,
+)
+from flowmachine.core.materialisation_advisor import (
+    MaterialisationAdvisor,
+    get_materialisation_advisor,
+    set_materialisation_advisor,
+)
+from flowmachine.features import ContactReciprocal, daily_location
+from flowmachine.features.utilities.subscriber_locations import SubscriberLocations
+
+
+@pytest.fixture
+def advisor():
+    """
+    Sets a materialisation advisor for the duration of a test.
+    """
+    advisor = MaterialisationAdvisor()
+    set_materialisation_advisor(advisor)
+    yield advisor
+    set_materialisation_advisor(None)
+
+
+def test_class_reuse_statistics(flowmachine_connect):
+    """
+    Test that a dependency used by two stored queries is counted as reused.
+    """
+    daily_location("2016-01-01", method="last").store(store_dependencies=True).result()
+    stats = get_class_reuse_statistics(flowmachine_connect)
+    assert stats["SubscriberLocations"].intermediates == 1
+    assert stats["SubscriberLocations"].reused == 0
+    daily_location("2016-01-01", method="most-common").store(
+        store_dependencies=True
+    ).result()
+    stats = get_class_reuse_statistics(flowmachine_connect)
+    assert stats["SubscriberLocations"].intermediates == 1
+    assert stats["SubscriberLocations"].reused == 1
+    assert "LastLocation" not in stats
+
+
+@pytest.mark.parametrize(
+    "stats, expected",
+    [
+        (None, True),
+        (ClassReuseStatistics("SubscriberLocations", 2, 0, 3.0, 10.0), True),
+        (ClassReuseStatistics("SubscriberLocations", 10, 5, 3.0, 10.0), True),
+        (ClassReuseStatistics("SubscriberLocations", 10, 0, 3.0, 10.0), False),
+        (ClassReuseStatistics("SubscriberLocations", 10, 5, 3.0, 0.1), False),
+    ],
+)
+def test_should_store(stats, expected, monkeypatch):
+    """
+    Test that the advisor stores classes without enough history, and otherwise only expensive, reused ones.
+    """
+    monkeypatch.setattr(
+        "flowmachine.core.materialisation_advisor.get_class_reuse_statistics",
+        lambda connection: {} if stats is None else {stats.class_name: stats},
+    )
+    query = SubscriberLocations("2016-01-01", "2016-01-02")
+    assert MaterialisationAdvisor().should_store(query) == expected
+
+
+def test_store_dependencies_with_advisor(advisor, monkeypatch):
+    """
+    Test that only the dependencies the advisor recommends are stored.
+    """
+    monkeypatch.setattr(
+        advisor,
+        "should_store",
+        lambda query: not isinstance(query, SubscriberLocations),
+    )
+    assert get_materialisation_advisor() is advisor
+    dl = daily_location("2016-01-01")
+    store_all_unstored_dependencies(dl)
+    assert not dl.subscriber_locs.is_stored
+    assert dl.subscriber_locs.unioned.is_stored
+
+
+def test_store_dependencies_with_advisor_keeps_shared(advisor, monkeypatch):
+    """
+    Test that dependencies referenced more than once are stored even if the advisor advises against it.
+    """
+    monkeypatch.setattr(advisor, "should_store", lambda query: False)
+    monkeypatch.setattr(
+        "flowmachine.core.dependency_graph.common_subexpressions",
+        partial(common_subexpressions, min_cost=0),
+    )
+    query = ContactReciprocal("2016-01-01", "2016-01-02")
+    store_all_unstored_dependencies(query)
+    assert query.contact_in_query.unioned_query.is_stored
+    assert not query.contact_in_query.is_stored
+    assert not query.contact_out_query.is_stored
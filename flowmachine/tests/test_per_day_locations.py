@@ -0,0 +1,159 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from flowmachine.core import make_spatial_unit
+from flowmachine.core.dependency_graph import store_all_unstored_dependencies
+from flowmachine.features import (
+    DayTrajectories,
+    ModalLocation,
+    PerDayLocations,
+    daily_location,
+)
+from flowmachine.utils import list_of_dates
+
+
+def test_column_names_per_day_locations(exemplar_spatial_unit_param):
+    """ Test that column_names property matches head(0) for PerDayLocations"""
+    locs = PerDayLocations(
+        "2016-01-01", "2016-01-03", spatial_unit=exemplar_spatial_unit_param
+    )
+    assert locs.head(0).columns.tolist() == locs.column_names
+
+
+def test_per_day_locations_bad_method_raises_error():
+    """
+    PerDayLocations raises an error for an unknown method.
+    """
+    with pytest.raises(ValueError):
+        PerDayLocations("2016-01-01", "2016-01-03", method="BAD_METHOD")
+
+
+def test_per_day_locations_dates():
+    """
+    PerDayLocations has one daily location for each day, excluding the stop date.
+    """
+    locs = PerDayLocations("2016-01-01", "2016-01-04", hours=(4, 17))
+    assert locs.dates == ["2016-01-01", "2016-01-02", "2016-01-03"]
+    assert [dl.query_id for dl in locs.daily_locations] == [
+        daily_location(d, hours=(4, 17)).query_id for d in locs.dates
+    ]
+
+
+def test_per_day_locations_sparse_dates(get_dataframe):
+    """
+    PerDayLocations only finds locations on the requested dates.
+    """
+    locs = PerDayLocations(
+        "2016-01-01", "2016-01-04", dates=["2016-01-03", "2016-01-01"]
+    )
+    assert locs.dates == ["2016-01-01", "2016-01-03"]
+    assert len(locs.subscriber_locs) == 2
+    assert [dl.query_id for dl in locs.daily_locations] == [
+        daily_location(d).query_id for d in ["2016-01-01", "2016-01-03"]
+    ]
+    assert sorted(get_dataframe(locs).date.astype(str).unique()) == [
+        "2016-01-01",
+        "2016-01-03",
+    ]
+
+
+def test_per_day_locations_dates_out_of_range_raises_error():
+    """
+    PerDayLocations raises an error for dates outside of start and stop.
+    """
+    with pytest.raises(ValueError):
+        PerDayLocations("2016-01-01", "2016-01-03", dates=["2016-01-03"])
+
+
+def test_per_day_locations_match_daily_locations(get_dataframe):
+    """
+    Each day of PerDayLocations gives the same locations as daily_location.
+    """
+    locs = PerDayLocations(
+        "2016-01-01", "2016-01-03", spatial_unit=make_spatial_unit("admin", level=3)
+    )
+    df = get_dataframe(locs)
+    for date, dl in zip(locs.dates, locs.daily_locations):
+        per_day_df = (
+            df[df.date.astype(str) == date]
+            .drop(columns="date")
+            .sort_values("subscriber")
+            .reset_index(drop=True)
+        )
+        dl_df = get_dataframe(dl).sort_values("subscriber").reset_index(drop=True)
+        assert per_day_df.equals(dl_df)
+
+
+def test_store_daily_locations():
+    """
+    Storing the daily locations of PerDayLocations stores the equivalent daily_location queries.
+    """
+    locs = PerDayLocations("2016-01-01", "2016-01-04")
+    dls = [daily_location(d) for d in locs.dates]
+    expected = [dl.get_dataframe() for dl in dls]
+    locs.store_daily_locations().result()
+    assert not locs.is_stored
+    assert not locs.connection.engine.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_schema = 'cache' AND table_name LIKE 'per_day_locations_%'"
+    ).fetchall()
+    for dl, expected_df in zip(dls, expected):
+        assert dl.is_stored
+        df = dl.get_dataframe()
+        assert sorted(map(tuple, df.values.tolist())) == sorted(
+            map(tuple, expected_df.values.tolist())
+        )
+
+
+def test_modal_location_dependencies_stored_in_one_pass():
+    """
+    Storing the dependencies of a ModalLocation stores its daily locations using PerDayLocations.
+    """
+    dls = [daily_location(d) for d in list_of_dates("2016-01-01", "2016-01-03")]
+    ml = ModalLocation(*dls)
+    store_all_unstored_dependencies(ml)
+    assert all(dl.is_stored for dl in dls)
+    assert not PerDayLocations("2016-01-01", "2016-01-04").is_stored
+
+
+def test_modal_location_sparse_dates_stored_in_one_pass():
+    """
+    Storing the dependencies of a ModalLocation over non-consecutive days only stores those days.
+    """
+    dls = [daily_location(d) for d in ["2016-01-01", "2016-01-03"]]
+    ml = ModalLocation(*dls)
+    per_day_locations = ml._get_per_day_locations(dls)
+    assert per_day_locations.dates == ["2016-01-01", "2016-01-03"]
+    store_all_unstored_dependencies(ml)
+    assert all(dl.is_stored for dl in dls)
+    assert not daily_location("2016-01-02").is_stored
+    assert not per_day_locations.is_stored
+
+
+def test_day_trajectories_unchanged_by_per_day_locations(get_dataframe):
+    """
+    DayTrajectories gives the same result whether or not its daily locations are stored.
+    """
+    dls = [daily_location(d) for d in list_of_dates("2016-01-01", "2016-01-03")]
+    unstored_df = get_dataframe(DayTrajectories(*dls))
+    for dl in dls:
+        dl.store().result()
+    stored_df = get_dataframe(DayTrajectories(*dls))
+    assert sorted(map(tuple, unstored_df.values.tolist())) == sorted(
+        map(tuple, stored_df.values.tolist())
+    )
+
+
+def test_day_trajectories_with_partly_stored_daily_locations(get_dataframe):
+    """
+    DayTrajectories gives the same result when only some daily locations are stored.
+    """
+    dls = [daily_location(d) for d in list_of_dates("2016-01-01", "2016-01-03")]
+    expected = get_dataframe(DayTrajectories(*dls))
+    dls[1].store().result()
+    df = get_dataframe(DayTrajectories(*dls))
+    assert sorted(map(tuple, df.values.tolist())) == sorted(
+        map(tuple, expected.values.tolist())
+    )
@@ -8,6 +8,7 @@ pertain to any one particular query
 """
 from typing import List
 
+import pandas as pd
 import pytest
 from sqlalchemy.exc import ProgrammingError
 
@@ -107,6 +108,34 @@ def test_return_table():
     )
 
 
+def test_iter_batches():
+    """Test that iterating in batches gives all the rows of the result."""
+    dl = daily_location("2016-01-01")
+    batches = list(dl.iter_batches(batch_size=100))
+    assert all(len(batch) <= 100 for batch in batches)
+    assert len(batches) > 1
+    assert sorted(list(row) for batch in batches for row in batch) == sorted(
+        dl.get_dataframe().values.tolist()
+    )
+
+
+def test_iter_batches_bad_batch_size():
+    """Test that a batch size less than 1 raises an error."""
+    with pytest.raises(ValueError):
+        next(daily_location("2016-01-01").iter_batches(batch_size=0))
+
+
+def test_iter_dataframes():
+    """Test that iterating over dataframes gives the same result as get_dataframe."""
+    dl = daily_location("2016-01-01")
+    chunks = list(dl.iter_dataframes(chunk_rows=100))
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks).sort_values(dl.column_names).reset_index(drop=True),
+        dl.get_dataframe().sort_values(dl.column_names).reset_index(drop=True),
+    )
+
+
 def test_exception_on_unstored():
     """Test that an exception is raised when the query is not stored"""
     dl = daily_location("2016-01-01")
@@ -156,3 +185,92 @@ def test_query_formatting():
         ValueError, match="Format string contains invalid query attribute: 'foo'"
     ):
         format(dl, "query_id,foo")
+
+
+def test_get_page_query(get_dataframe):
+    """
+    Test that a page of a query's result can be fetched, with projection and filters.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    df = get_dataframe(dl)
+    pcod = df.pcod.iloc[0]
+    page = dl.connection.fetch(
+        dl.get_page_query(
+            columns=["subscriber"], filters=[("pcod", "eq", pcod)], limit=5, offset=1
+        )
+    )
+    assert len(page) == min(5, (df.pcod == pcod).sum() - 1)
+    assert set(row[0] for row in page) <= set(df[df.pcod == pcod].subscriber)
+
+
+def test_get_page_query_pages_cover_result(get_dataframe):
+    """
+    Test that consecutive pages, in descending order, cover the whole result.
+    """
+    dl = daily_location("2016-01-01")
+    df = get_dataframe(dl)
+    pages = [
+        dl.connection.fetch(
+            dl.get_page_query(order_by=["-subscriber"], limit=100, offset=offset)
+        )
+        for offset in range(0, len(df), 100)
+    ]
+    rows = [tuple(row) for page in pages for row in page]
+    assert rows == [
+        tuple(row)
+        for row in dl.connection.fetch(
+            f"SELECT * FROM ({dl.get_query()}) _ ORDER BY subscriber DESC"
+        )
+    ]
+
+
+def test_get_page_query_only_orders_pages():
+    """
+    Test that rows are only ordered if a page or an order is requested.
+    """
+    dl = daily_location("2016-01-01")
+    assert "ORDER BY" not in dl.get_page_query(columns=["subscriber"])
+    assert "ORDER BY" in dl.get_page_query(columns=["subscriber"], limit=10)
+    assert "ORDER BY" in dl.get_page_query(order_by=["subscriber"])
+
+
+def test_get_page_query_orders_stored_result_by_one_index():
+    """
+    Test that pages of a stored result are ordered by one index and the row's location in the table.
+    """
+    dl = daily_location("2016-01-01").store().result()
+    assert dl.get_page_query(limit=10) == (
+        f'SELECT "subscriber", "pcod" FROM {dl.fully_qualified_table_name} _ '
+        'ORDER BY "pcod", ctid LIMIT 10'
+    )
+
+
+@pytest.mark.parametrize(
+    "page_params",
+    [
+        dict(columns=["NOT_A_COLUMN"]),
+        dict(columns=[]),
+        dict(filters=[("pcod", "like", "%")]),
+        dict(filters=[("NOT_A_COLUMN", "eq", "1")]),
+        dict(order_by=["-NOT_A_COLUMN"]),
+        dict(limit=-1),
+        dict(offset=-1),
+    ],
+)
+def test_get_page_query_errors(page_params):
+    """
+    Test that invalid page parameters raise an error.
+    """
+    with pytest.raises(ValueError):
+        daily_location("2016-01-01").get_page_query(**page_params)
+
+
+def test_get_page_query_escapes_filter_values():
+    """
+    Test that quotes in filter values can't end the string literal.
+    """
+    dl = daily_location("2016-01-01")
+    page = dl.connection.fetch(
+        dl.get_page_query(filters=[("pcod", "eq", "x'; DROP TABLE foo; --\\")])
+    )
+    assert page == []
@@ -5,6 +5,7 @@
 """
 Tests for the query state machine.
 """
+from threading import Timer
 from unittest.mock import Mock
 
 import time
@@ -55,7 +56,7 @@ class DummyQuery(Query):
 def test_blocks(blocking_state, monkeypatch, dummy_redis):
     """Test that states which alter the executing state of the query block."""
     state_machine = QueryStateMachine(dummy_redis, "DUMMY_QUERY_ID")
-    dummy_redis.set(state_machine.state_machine._name, blocking_state)
+    dummy_redis.set(state_machine.state_key, blocking_state)
     monkeypatch.setattr(
         flowmachine.core.query_state, "_sleep", Mock(side_effect=BlockingIOError)
     )
@@ -68,7 +69,9 @@ def test_no_limit_on_blocks(monkeypatch):
     """Test that even with a large number of queries, starting a store op will block calls to get_query."""
 
     monkeypatch.setattr(
-        flowmachine.core.query_state, "_sleep", Mock(side_effect=BlockingIOError)
+        flowmachine.core.query_state,
+        "_wait_for_state_change",
+        Mock(side_effect=BlockingIOError),
     )
     dummies = [DummyQuery(dummy_id=x) for x in range(50)]
     [dummy.store() for dummy in dummies]
@@ -83,7 +86,9 @@ def test_non_blocking(monkeypatch):
     dummies = [DummyQuery(dummy_id=x) for x in range(50)]
     [dummy.store() for dummy in dummies]
     monkeypatch.setattr(
-        flowmachine.core.query_state, "_sleep", Mock(side_effect=BlockingIOError)
+        flowmachine.core.query_state,
+        "_wait_for_state_change",
+        Mock(side_effect=BlockingIOError),
     )
 
     with pytest.raises(BlockingIOError):
@@ -102,7 +107,7 @@ def test_non_blocking(monkeypatch):
 def test_non_blocks(non_blocking_state, expected_return, monkeypatch, dummy_redis):
     """Test that states which don't alter the executing state of the query don't block."""
     state_machine = QueryStateMachine(dummy_redis, "DUMMY_QUERY_ID")
-    dummy_redis.set(state_machine.state_machine._name, non_blocking_state)
+    dummy_redis.set(state_machine.state_key, non_blocking_state)
     monkeypatch.setattr(
         flowmachine.core.query_state, "_sleep", Mock(side_effect=BlockingIOError)
     )
@@ -113,6 +118,68 @@ def test_non_blocks(non_blocking_state, expected_return, monkeypatch, dummy_redi
         pytest.fail("Blocked!")
 
 
+def test_wait_until_complete_wakes_on_state_change():
+    """Test that waiters are woken by a state change notification without waiting for the poll interval."""
+    state_machine = QueryStateMachine(Query.redis, "DUMMY_QUERY_ID")
+    state_machine.enqueue()
+    state_machine.execute()
+
+    finisher = Timer(0.5, state_machine.finish)
+    finisher.start()
+    start = time.time()
+    state_machine.wait_until_complete(sleep_duration=60)
+    finisher.join()
+    assert state_machine.is_completed
+    assert time.time() - start < 30
+
+
+def test_new_state_machine_does_not_write_to_redis():
+    """Test that creating a state machine for a new query doesn't write anything to redis."""
+    state_machine = QueryStateMachine(Query.redis, "DUMMY_QUERY_ID")
+    assert state_machine.is_known
+    assert Query.redis.get(state_machine.state_key) is None
+
+
+@pytest.mark.parametrize(
+    "start_state, event, expected_state, expected_success",
+    [
+        (QueryState.KNOWN, QueryEvent.QUEUE, QueryState.QUEUED, True),
+        (QueryState.QUEUED, QueryEvent.EXECUTE, QueryState.EXECUTING, True),
+        (QueryState.EXECUTING, QueryEvent.FINISH, QueryState.COMPLETED, True),
+        (QueryState.EXECUTING, QueryEvent.ERROR, QueryState.ERRORED, True),
+        (QueryState.COMPLETED, QueryEvent.RESET, QueryState.RESETTING, True),
+        (QueryState.RESETTING, QueryEvent.FINISH_RESET, QueryState.KNOWN, True),
+        (QueryState.KNOWN, QueryEvent.FINISH, QueryState.KNOWN, False),
+        (QueryState.COMPLETED, QueryEvent.EXECUTE, QueryState.COMPLETED, False),
+    ],
+)
+def test_trigger_event(start_state, event, expected_state, expected_success):
+    """Test that the redis transition script applies the expected transitions."""
+    state_machine = QueryStateMachine(Query.redis, "DUMMY_QUERY_ID")
+    Query.redis.set(state_machine.state_key, start_state.value)
+    assert state_machine.trigger_event(event) == (expected_state, expected_success)
+    assert state_machine.current_query_state == expected_state
+
+
+@pytest.mark.parametrize(
+    "start_state, expected_state, expected_success",
+    [
+        (QueryState.RESETTING, QueryState.COMPLETED, True),
+        (QueryState.KNOWN, QueryState.KNOWN, False),
+        (QueryState.EXECUTING, QueryState.EXECUTING, False),
+    ],
+)
+def test_cancel_resetting(start_state, expected_state, expected_success, dummy_redis):
+    """Test that cancelling a reset only returns a resetting query to its previous state."""
+    state_machine = QueryStateMachine(dummy_redis, "DUMMY_QUERY_ID")
+    dummy_redis.set(state_machine.state_key, start_state)
+    assert state_machine.cancel_resetting(QueryState.COMPLETED) == (
+        expected_state,
+        expected_success,
+    )
+    assert state_machine.current_query_state == expected_state
+
+
 @pytest.mark.parametrize(
     "start_state, succeeds",
     [
@@ -128,7 +195,7 @@ def test_non_blocks(non_blocking_state, expected_return, monkeypatch, dummy_redi
 def test_query_cancellation(start_state, succeeds, dummy_redis):
     """Test the cancel method works as expected."""
     state_machine = QueryStateMachine(dummy_redis, "DUMMY_QUERY_ID")
-    dummy_redis.set(state_machine.state_machine._name, start_state)
+    dummy_redis.set(state_machine.state_key, start_state)
     state_machine.cancel()
     assert succeeds == state_machine.is_cancelled
 
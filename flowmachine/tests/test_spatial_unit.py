@@ -5,6 +5,7 @@
 from flowmachine.core import CustomQuery
 from flowmachine.core.errors import InvalidSpatialUnitError
 from flowmachine.core.spatial_unit import *
+from flowmachine.features import daily_location
 import pytest
 
 
@@ -321,3 +322,53 @@ def test_location_subset_clause_return_value(spatial_unit_type, locations, expec
     """
     su = make_spatial_unit(spatial_unit_type)
     assert expected == su.location_subset_clause(locations)
+
+
+def test_stored_spatial_unit_is_labelled_with_infrastructure_version():
+    """
+    Test that a stored spatial unit records the version of the infrastructure tables it was built from.
+    """
+    su = make_spatial_unit("admin", level=3)
+    su.store().result()
+    schema, name = su.fully_qualified_table_name.split(".")
+    assert su.connection.get_table_comment(name, schema) == su.infrastructure_version
+    assert su.get_query() == f"SELECT * FROM {su.fully_qualified_table_name}"
+
+
+def test_stored_spatial_unit_is_removed_when_infrastructure_changes(monkeypatch):
+    """
+    Test that a stored spatial unit, and queries which depend on it, are removed from
+    cache by invalidate_stale_spatial_units when the infrastructure tables change.
+    """
+    su = make_spatial_unit("admin", level=3)
+    dl = daily_location("2016-01-01", spatial_unit=su)
+    dl.store(store_dependencies=True).result()
+    assert su.is_stored
+    assert dl.is_stored
+    assert invalidate_stale_spatial_units(su.connection) == []
+
+    monkeypatch.setattr(
+        su.connection, "get_table_checksum", lambda name, schema: "CHANGED"
+    )
+    assert su.get_query() == f"SELECT * FROM {su.fully_qualified_table_name}"
+    assert su.is_stored
+    assert invalidate_stale_spatial_units(su.connection) == [su.query_id]
+    assert not su.is_stored
+    assert not dl.is_stored
+
+
+def test_infrastructure_version_includes_geography_table(monkeypatch):
+    """
+    Test that a change to the geography table a spatial unit is built from changes its infrastructure version.
+    """
+    su = make_spatial_unit("admin", level=3)
+    version = su.infrastructure_version
+    checksum = su.connection.get_table_checksum
+    monkeypatch.setattr(
+        su.connection,
+        "get_table_checksum",
+        lambda name, schema: "CHANGED"
+        if schema == "geography"
+        else checksum(name, schema),
+    )
+    assert su.infrastructure_version != version
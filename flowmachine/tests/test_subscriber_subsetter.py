@@ -4,9 +4,12 @@
 import flowmachine
 import numpy as np
 import pandas as pd
+import pickle
 import pytest
 
-from flowmachine.core import CustomQuery
+from flowmachine.core import CustomQuery, Query
+from flowmachine.core.cache import cache_table_exists
+from flowmachine.core.dependency_graph import unstored_dependencies_graph
 from flowmachine.core.subscriber_subsetter import *
 from flowmachine.features import daily_location
 
@@ -94,3 +97,102 @@ def test_subsetting_of_query(get_dataframe):
     assert 499 == len(get_dataframe(dl_1))
     assert 3 == len(get_dataframe(dl_2))
     assert 26 == len(get_dataframe(dl_3))
+
+
+def test_subsetting_of_query_using_subset_table(get_dataframe):
+    """
+    Check that subsetting using a subset table gives the same result as inlining the subscribers.
+    """
+    selected_subscriber_ids = [
+        "1jwYL3Nl1Y46lNeQ",
+        "nLvm2gVnEdg7lzqX",
+        "jwKJorl0yBrZX5N8",
+    ]
+    inline_subsetter = SubscriberSubsetterForExplicitSubset(selected_subscriber_ids)
+    table_subsetter = SubscriberSubsetterForExplicitSubset(
+        selected_subscriber_ids, use_table=True
+    )
+
+    dl_inline = daily_location(date="2016-01-01", subscriber_subset=inline_subsetter)
+    dl_table = daily_location(date="2016-01-01", subscriber_subset=table_subsetter)
+    assert get_dataframe(dl_inline).equals(get_dataframe(dl_table))
+    dl_table.store().result()
+    assert table_subsetter.subset_table.is_stored
+    assert get_dataframe(dl_inline).equals(get_dataframe(dl_table))
+
+
+def test_large_explicit_subset_uses_table():
+    """
+    Large explicit subsets use a subset table, and their query id depends only on the set of subscribers.
+    """
+    subscribers = [f"<SUBSCRIBER_ID_{i}>" for i in range(2000)]
+    subsetter = make_subscriber_subsetter(subscribers)
+    assert subsetter.use_table
+    reordered_subsetter = make_subscriber_subsetter(
+        pd.Series(subscribers[::-1] + subscribers[:10])
+    )
+    assert subsetter.query_id == reordered_subsetter.query_id
+    dl = daily_location(date="2016-01-01", subscriber_subset=subsetter)
+    assert subsetter.subset_table.query_id in {
+        query.query_id
+        for _, query in unstored_dependencies_graph(dl).nodes(data="query_object")
+    }
+
+
+def test_getting_sql_does_not_store_subset_table():
+    """
+    Test that making SQL which uses a subset table doesn't store it.
+    """
+    subsetter = SubscriberSubsetterForExplicitSubset(
+        ["1jwYL3Nl1Y46lNeQ", "nLvm2gVnEdg7lzqX"], use_table=True
+    )
+    dl = daily_location(date="2016-01-01", subscriber_subset=subsetter)
+    assert "1jwYL3Nl1Y46lNeQ" in dl.get_query()
+    assert not subsetter.subset_table.is_stored
+
+
+def test_subset_table_stored_with_dependent_query(flowmachine_connect):
+    """
+    Test that a subset table is stored as a cached query when a query using it is stored,
+    and that the query then reads the subset from the table.
+    """
+    subsetter = SubscriberSubsetterForExplicitSubset(
+        ["1jwYL3Nl1Y46lNeQ", "nLvm2gVnEdg7lzqX"], use_table=True
+    )
+    dl = daily_location(date="2016-01-01", subscriber_subset=subsetter)
+    dl.store().result()
+    subset_table = subsetter.subset_table
+    assert cache_table_exists(flowmachine_connect, subset_table.query_id)
+    assert 2 == len(
+        flowmachine_connect.fetch(
+            f"SELECT * FROM {subset_table.fully_qualified_table_name}"
+        )
+    )
+    dl_2 = daily_location(date="2016-01-02", subscriber_subset=subsetter)
+    assert subset_table.fully_qualified_table_name in dl_2.get_query()
+    assert "1jwYL3Nl1Y46lNeQ" not in dl_2.get_query()
+
+    # The cached subset table can be removed like any other cached query
+    subset_table.invalidate_db_cache()
+    assert not subset_table.is_stored
+    assert not dl.is_stored
+    dl.store().result()
+    assert subset_table.is_stored
+
+
+def test_subset_table_subscribers_are_not_pickled():
+    """
+    Test that pickled queries using a subset table don't contain the subscribers.
+    """
+    subsetter = SubscriberSubsetterForExplicitSubset(
+        ["1jwYL3Nl1Y46lNeQ", "nLvm2gVnEdg7lzqX"], use_table=True
+    )
+    dl = daily_location(date="2016-01-01", subscriber_subset=subsetter)
+    pickled = pickle.dumps(dl)
+    assert b"1jwYL3Nl1Y46lNeQ" not in pickled
+    unpickled = pickle.loads(pickled)
+    assert unpickled.query_id == dl.query_id
+    assert (
+        pickle.loads(pickle.dumps(subsetter.subset_table)).query_id
+        == subsetter.subset_table.query_id
+    )
@@ -67,6 +67,7 @@ def test_get_sql(zmq_port, zmq_host):
     reply = send_zmq_message_and_receive_reply(msg, port=zmq_port, host=zmq_host)
     assert "success" == reply["status"]
     assert f"SELECT * FROM cache.x{expected_query_id}" == reply["payload"]["sql"]
+    assert "created" in reply["payload"]
 
 
 def test_get_sql_for_nonexistent_query_id(zmq_port, zmq_host):